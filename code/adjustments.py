@@ -0,0 +1,179 @@
+# Corporate action adjustments
+# The store keeps bars as they traded. Splits and dividends live in a small per-ticker table and adjusted prices are
+# derived from it when read, so a new split only changes the table and never the years of stored bars.
+#   adjusted price = raw price x product of the factors of every action after the bar
+#   split factor = 1 / ratio, dividend factor = 1 - dividend / close before the ex-date (like Yahoo's Adj Close)
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+# Globals
+
+SPLITS_COLUMN = 'Stock Splits'  # action columns of yf.download(actions=True), 0 on days without an action
+DIVIDENDS_COLUMN = 'Dividends'
+
+
+class ActionTable:
+    """
+    Split ratios and dividend factors by ticker and ex-date
+    """
+
+    def __init__(self, splits=None, dividends=None, version=''):
+        """
+        :param splits: {ticker: {%Y-%m-%d ex-date: ratio}}, e.g. 4.0 for a 4:1 split
+        :type splits: dict
+        :param dividends: {ticker: {%Y-%m-%d ex-date: price factor}}
+        :type dividends: dict
+        :param version: changes on every update, '' for a table that was never updated
+        :type version: str
+        """
+        self.splits = {ticker: dict(events) for ticker, events in (splits or {}).items()}
+        self.dividends = {ticker: dict(events) for ticker, events in (dividends or {}).items()}
+        self.version = version
+
+    def __contains__(self, ticker):
+        return ticker in self.splits or ticker in self.dividends
+
+    def tickers(self) -> list:
+        return list(dict.fromkeys([*self.splits, *self.dividends]))
+
+    def copy(self) -> 'ActionTable':
+        return ActionTable(self.splits, self.dividends, self.version)
+
+    def add_split(self, ticker: str, date, ratio: float) -> bool:
+        """
+        Record a split
+        :param ticker: ticker symbol
+        :type ticker: str
+        :param date: ex-date
+        :type date: datetime or str or np.datetime64
+        :param ratio: new shares per old share, e.g. 4.0 for a 4:1 split and 0.1 for a 1:10 reverse split
+        :type ratio: float
+        :return: true if the table changed
+        :rtype: bool
+        """
+        return self._add(self.splits, ticker, date, float(ratio))
+
+    def add_dividend(self, ticker: str, date, factor: float) -> bool:
+        """
+        Record a dividend
+        :param ticker: ticker symbol
+        :type ticker: str
+        :param date: ex-date
+        :type date: datetime or str or np.datetime64
+        :param factor: 1 - dividend / close before the ex-date
+        :type factor: float
+        :return: true if the table changed
+        :rtype: bool
+        """
+        return self._add(self.dividends, ticker, date, float(factor))
+
+    def update(self, other: 'ActionTable') -> list:
+        """
+        Add the actions of another table
+        :param other: newer actions, replace actions of the same ticker and ex-date
+        :type other: ActionTable
+        :return: tickers whose actions changed
+        :rtype: list
+        """
+        changed = [ticker for ticker, events in other.splits.items() for date, ratio in events.items()
+                   if self.add_split(ticker, date, ratio)]
+        changed += [ticker for ticker, events in other.dividends.items() for date, factor in events.items()
+                    if self.add_dividend(ticker, date, factor)]
+        return list(dict.fromkeys(changed))
+
+    def price_factors(self, ticker: str, dates: np.ndarray, dividends=False) -> np.ndarray:
+        """
+        Adjustment factor of every bar of a ticker
+        :param ticker: ticker symbol
+        :type ticker: str
+        :param dates: datetime64[D] bar dates
+        :type dates: np.ndarray
+        :param dividends: also adjust for dividends, splits only if false
+        :type dividends: bool
+        :return: factor per date, raw price x factor = adjusted price
+        :rtype: np.ndarray
+        """
+        factors = cumulative_factors(dates, {date: 1 / ratio for date, ratio in self.splits.get(ticker, {}).items()})
+        if dividends:
+            factors *= cumulative_factors(dates, self.dividends.get(ticker, {}))
+        return factors
+
+    def save(self, path: str):
+        """
+        Save the table as json, the file is replaced atomically
+        :param path: json path
+        :type path: str
+        """
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'splits': self.splits, 'dividends': self.dividends, 'version': self.version}, f)
+        os.replace(tmp, path)
+
+    def _add(self, table: dict, ticker: str, date, value: float) -> bool:
+        date = str(np.datetime64(pd.Timestamp(date).date(), 'D'))
+        events = table.setdefault(ticker, {})
+        if events.get(date) == value:
+            return False
+        events[date] = value
+        self.version = str(time.time_ns())
+        return True
+
+
+def cumulative_factors(dates: np.ndarray, events: dict) -> np.ndarray:
+    """
+    Product of the factors of every event after each date
+    :param dates: datetime64[D] dates
+    :type dates: np.ndarray
+    :param events: {%Y-%m-%d ex-date: factor}
+    :type events: dict
+    :return: factor per date
+    :rtype: np.ndarray
+    """
+    factors = np.ones(len(dates))
+    for date, factor in events.items():
+        factors[dates < np.datetime64(date, 'D')] *= factor  # the ex-date's own bar already trades adjusted
+    return factors
+
+
+def load_table(path: str) -> ActionTable:
+    """
+    Load a saved table
+    :param path: json path
+    :type path: str
+    :return: the saved table, an empty table if there is no file
+    :rtype: ActionTable
+    """
+    if not os.path.isfile(path):
+        return ActionTable()
+    with open(path) as f:
+        saved = json.load(f)
+    return ActionTable(saved['splits'], saved['dividends'], saved.get('version', ''))
+
+
+def from_download(frame: pd.DataFrame, ticker: str) -> ActionTable:
+    """
+    Actions of one ticker's downloaded bars
+    :param frame: bars with SPLITS_COLUMN and DIVIDENDS_COLUMN, like yf.download(actions=True) gives per ticker
+    :type frame: pd.DataFrame
+    :param ticker: ticker symbol
+    :type ticker: str
+    :return: table of the actions inside the downloaded range
+    :rtype: ActionTable
+    """
+    table = ActionTable()
+    if SPLITS_COLUMN in frame:
+        splits = frame[SPLITS_COLUMN].fillna(0)
+        for date, ratio in splits[splits > 0].items():
+            table.add_split(ticker, date, ratio)
+    if DIVIDENDS_COLUMN in frame:
+        dividends = frame[DIVIDENDS_COLUMN].fillna(0).to_numpy(dtype=float)
+        # the dividend and the close before it are both in Yahoo's split adjusted basis
+        previous_close = frame['Close'].ffill().shift(1).to_numpy(dtype=float)
+        for i in np.flatnonzero(dividends > 0):
+            if not np.isnan(previous_close[i]):  # no close before the first bar, the earlier download had it
+                table.add_dividend(ticker, frame.index[i], 1 - dividends[i] / previous_close[i])
+    return table
@@ -0,0 +1,119 @@
+# Consolidation breakout backtester
+# Evaluates is_breaking_consolidation for every ticker on every date of the stored daily panel in one vectorized
+# pass, then exits every signal with the risk_dict stop loss and PROFIT*1/2/3 targets.
+import numpy as np
+import pandas as pd
+
+import data_store
+import indicators
+import yf_functions
+
+# Globals
+
+PROFIT_MULTIPLES = [1, 2, 3]  # risk_dict PROFIT*1, PROFIT*2, PROFIT*3
+
+
+def breakout_signals(closes: np.ndarray, percentage=2.5, look_back_data=15) -> np.ndarray:
+    """
+    is_breaking_consolidation at every date, as if the data ended on that date
+    :param closes: close prices shaped (tickers, dates), oldest first, empty bars are NaN
+    :type closes: np.ndarray
+    :param percentage: percentage consolidation pattern
+    :type percentage: float
+    :param look_back_data: how many days to look back on (+1)
+    :type look_back_data: int
+    :return: boolean array shaped like closes
+    :rtype: np.ndarray
+    """
+    closes = np.asarray(closes, dtype=float)
+    threshold = 1 - (percentage / 100)
+    signals = np.zeros(closes.shape, dtype=bool)
+    # previous date's look_back_data window decides consolidation, the look_back_data - 1 closes before the
+    # signal date are the ones to break above
+    window_max = indicators.rolling_max(closes, look_back_data)[:, :-1]
+    window_min = indicators.rolling_min(closes, look_back_data)[:, :-1]
+    if look_back_data > 1:
+        recent_max = indicators.rolling_max(closes, look_back_data - 1)[:, :-1]
+    else:
+        recent_max = np.full(window_max.shape, np.nan)
+    with np.errstate(invalid='ignore'):
+        signals[:, 1:] = (window_min > window_max * threshold) & (closes[:, 1:] > recent_max)
+    return signals
+
+
+def backtest_breakouts(panel: data_store.PricePanel, percentage=2.5, look_back_data=15, max_hold=20,
+                       risk=100.0) -> tuple:
+    """
+    Backtest the consolidation breakout strategy over the whole panel
+    Every signal enters long at its close. The risk candle is the signal day's candle (|close - open|), so like
+    risk_dict the stop loss is one risk candle below the entry and PROFIT*k is k risk candles above it.
+    A day touching both the stop and the target counts as stopped out, trades still open after max_hold days exit
+    at that day's close.
+    :param panel: daily price panel
+    :type panel: data_store.PricePanel
+    :param percentage: percentage consolidation pattern
+    :type percentage: float
+    :param look_back_data: how many days to look back on (+1)
+    :type look_back_data: int
+    :param max_hold: days a trade is held at most
+    :type max_hold: int
+    :param risk: risk in dollars per trade, used for the dollar expectancy
+    :type risk: float
+    :return: (summary indexed by PROFIT*k, trades with the R multiple of every exit)
+    :rtype: tuple
+    """
+    opens, highs, lows, closes = (np.asarray(panel.adjusted(f), dtype=float) for f in ['Open', 'High', 'Low', 'Close'])
+    rows, cols = np.nonzero(breakout_signals(closes, percentage, look_back_data))
+    entry = closes[rows, cols]
+    risk_candle = np.abs(entry - opens[rows, cols])
+    valid = risk_candle > 0
+    rows, cols, entry, risk_candle = rows[valid], cols[valid], entry[valid], risk_candle[valid]
+
+    # forward windows of every trade, shaped (trades, max_hold), NaN past the end of the data
+    days = cols[:, None] + np.arange(1, max_hold + 1)
+    in_data = days < closes.shape[1]
+    days = np.minimum(days, closes.shape[1] - 1)
+    forward_high = np.where(in_data, highs[rows[:, None], days], np.nan)
+    forward_low = np.where(in_data, lows[rows[:, None], days], np.nan)
+    forward_close = np.where(in_data, closes[rows[:, None], days], np.nan)
+    stop = entry - risk_candle
+    stop_hit = forward_low <= stop[:, None]
+    last_day = np.where(np.isnan(forward_close), -np.inf, np.arange(max_hold)).argmax(axis=1)
+    last_close = forward_close[np.arange(len(rows)), last_day]
+
+    trades = pd.DataFrame({'Ticker': np.array(panel.symbols, dtype=object)[rows],
+                           'Date': panel.dates[cols], 'Entry': entry, 'Risk candle': risk_candle})
+    summary = {}
+    for k in PROFIT_MULTIPLES:
+        target_hit = forward_high >= (entry + k * risk_candle)[:, None]
+        first_stop = np.where(stop_hit.any(axis=1), stop_hit.argmax(axis=1), max_hold)
+        first_target = np.where(target_hit.any(axis=1), target_hit.argmax(axis=1), max_hold)
+        result = np.where(first_stop <= first_target, -1.0, float(k))  # same day counts as stopped
+        is_open = (first_stop == max_hold) & (first_target == max_hold)
+        result = np.where(is_open, (last_close - entry) / risk_candle, result)
+        exit_day = np.where(is_open, last_day, np.minimum(first_stop, first_target))
+        trades[f'PROFIT*{k}'] = result
+        summary[f'PROFIT*{k}'] = _summarize(result, panel.dates[days[np.arange(len(rows)), exit_day]], risk)
+    return pd.DataFrame(summary).T, trades
+
+
+def _summarize(result: np.ndarray, exit_dates: np.ndarray, risk: float) -> dict:
+    closed = ~np.isnan(result)  # signals on the last date have no exit yet
+    result, exit_dates = result[closed], exit_dates[closed]
+    if len(result) == 0:
+        return {'Trades': 0, 'Hit rate': np.nan, 'Expectancy (R)': np.nan, 'Expectancy ($)': np.nan,
+                'Max drawdown (R)': np.nan}
+    # equity curve of the R results ordered by exit date
+    equity = np.cumsum(result[np.argsort(exit_dates, kind='stable')])
+    drawdown = np.max(np.maximum.accumulate(np.concatenate([[0.0], equity]))[1:] - equity)
+    return {'Trades': len(result),
+            'Hit rate': float(np.mean(result > 0)),
+            'Expectancy (R)': float(np.mean(result)),
+            'Expectancy ($)': yf_functions.decimal2_float(np.mean(result) * risk),
+            'Max drawdown (R)': float(drawdown)}
+
+
+if __name__ == "__main__":
+    summary, trades = backtest_breakouts(data_store.load_panel())
+    print(f'{len(trades)} signals')
+    print(summary)
@@ -0,0 +1,253 @@
+# Streaming intraday bar aggregator
+# 1-minute bars (or trades from a replay feed) are kept in fixed size per-ticker ring buffers and rolled up
+# incrementally into 2m/5m/15m candles. First candle and gap values are stored as soon as their bar closes so
+# lookups are O(1) for every watched ticker.
+from datetime import datetime
+
+import numpy as np
+
+import market_clock
+
+# Globals
+
+SESSION_OPEN = 9 * 60 + 30  # minutes after midnight, exchange time
+SESSION_MINUTES = 390
+INTERVALS = (2, 5, 15)  # minutes, rolled up from 1m bars
+BAR_COLUMNS = ['Time', 'Open', 'High', 'Low', 'Close', 'Volume']
+
+
+class RingBuffer:
+    """
+    Fixed size buffer of bars, the oldest bar is overwritten when full
+    """
+
+    def __init__(self, capacity: int):
+        self.bars = np.full((capacity, len(BAR_COLUMNS)), np.nan)
+        self.head = 0  # next slot to write
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, bar):
+        self.bars[self.head] = bar
+        self.head = (self.head + 1) % len(self.bars)
+        self.count = min(self.count + 1, len(self.bars))
+
+    def last(self, n=None) -> np.ndarray:
+        """
+        Last n bars, oldest first
+        :param n: number of bars, all stored bars if None
+        :type n: int
+        :return: array shaped (n, len(BAR_COLUMNS))
+        :rtype: np.ndarray
+        """
+        n = self.count if n is None else min(n, self.count)
+        return self.bars[(self.head - n + np.arange(n)) % len(self.bars)]
+
+
+class _TickerState:
+    def __init__(self, intervals, capacity):
+        self.session = None  # date of the current session
+        self.buffers = {1: RingBuffer(capacity), **{n: RingBuffer(capacity // n + 1) for n in intervals}}
+        self.partial = {n: None for n in intervals}  # (bucket, [time, open, high, low, close, volume])
+        self.trade_bar = None  # (minute, bar) 1m bar being built from trades
+        self.first_candle = {}  # {interval: close - open of the session's first candle}
+        self.open = None
+        self.previous_close = None
+        self.last_close = None
+
+
+class BarAggregator:
+    """
+    Per-ticker streaming aggregation of 1m bars into larger candles
+    """
+
+    def __init__(self, intervals=INTERVALS, capacity=SESSION_MINUTES):
+        """
+        :param intervals: candle sizes in minutes to roll 1m bars up into
+        :type intervals: tuple
+        :param capacity: 1m bars kept per ticker, larger candles keep capacity / interval
+        :type capacity: int
+        """
+        self.intervals = tuple(intervals)
+        self.capacity = capacity
+        self.tickers = {}
+
+    def _state(self, ticker: str, time: datetime) -> _TickerState:
+        state = self.tickers.get(ticker)
+        if state is None:
+            state = self.tickers[ticker] = _TickerState(self.intervals, self.capacity)
+        if state.session != time.date():  # new session, yesterday's last close becomes the gap reference
+            if state.session is not None and state.last_close is not None:
+                state.previous_close = state.last_close
+            state.session = time.date()
+            state.partial = {n: None for n in self.intervals}
+            state.first_candle = {}
+            state.open = None
+        return state
+
+    def set_previous_close(self, ticker: str, close: float):
+        """
+        Seed the gap reference of a ticker, e.g. from the daily store before the session starts
+        :param ticker: ticker symbol
+        :type ticker: str
+        :param close: previous session close
+        :type close: float
+        """
+        state = self.tickers.get(ticker)
+        if state is None:
+            state = self.tickers[ticker] = _TickerState(self.intervals, self.capacity)
+        state.previous_close = close
+
+    def add_bar(self, ticker: str, time: datetime, open_price: float, high: float, low: float, close: float,
+                volume: float):
+        """
+        Push a closed 1m bar
+        :param ticker: ticker symbol
+        :type ticker: str
+        :param time: bar start time in exchange time
+        :type time: datetime
+        """
+        state = self._state(ticker, time)
+        minute = time.hour * 60 + time.minute - SESSION_OPEN
+        bar = [time.timestamp(), open_price, high, low, close, volume]
+        state.buffers[1].append(bar)
+        if not 0 <= minute < SESSION_MINUTES:  # pre/post market bars are stored but not rolled up
+            return
+        state.last_close = close  # the regular session's close is the next session's gap reference
+        if state.open is None:
+            state.open = open_price
+        if minute == 0:
+            state.first_candle[1] = close - open_price
+        for n in self.intervals:
+            bucket = minute // n
+            partial = state.partial[n]
+            if partial is not None and partial[0] != bucket:  # a minute was missing, close the old candle
+                self._close_candle(state, n)
+                partial = None
+            if partial is None:
+                state.partial[n] = (bucket, list(bar))
+            else:
+                candle = partial[1]
+                candle[2] = max(candle[2], high)
+                candle[3] = min(candle[3], low)
+                candle[4] = close
+                candle[5] += volume
+            if minute % n == n - 1:  # last minute of the candle
+                self._close_candle(state, n)
+
+    def add_trade(self, ticker: str, time: datetime, price: float, size: float):
+        """
+        Push a trade, trades are built into 1m bars which are pushed once the minute is over
+        :param ticker: ticker symbol
+        :type ticker: str
+        :param time: trade time in exchange time
+        :type time: datetime
+        """
+        minute = time.replace(second=0, microsecond=0)
+        state = self.tickers.get(ticker)
+        if state is not None and state.trade_bar is not None and state.trade_bar[0] != minute:
+            self.flush(ticker)
+        state = self._state(ticker, time)
+        if state.trade_bar is None:
+            state.trade_bar = (minute, [price, price, price, price, size])
+        else:
+            bar = state.trade_bar[1]
+            bar[1] = max(bar[1], price)
+            bar[2] = min(bar[2], price)
+            bar[3] = price
+            bar[4] += size
+
+    def flush(self, ticker: str):
+        """
+        Push the 1m bar being built from trades, call when its minute is over without a newer trade
+        :param ticker: ticker symbol
+        :type ticker: str
+        """
+        state = self.tickers.get(ticker)
+        if state is not None and state.trade_bar is not None:
+            minute, bar = state.trade_bar
+            state.trade_bar = None
+            self.add_bar(ticker, minute, *bar)
+
+    def _close_candle(self, state: _TickerState, n: int):
+        bucket, candle = state.partial[n]
+        state.buffers[n].append(candle)
+        state.partial[n] = None
+        if bucket == 0:
+            state.first_candle[n] = candle[4] - candle[1]
+
+    def first_candle(self, ticker: str, interval=2):
+        """
+        First candle of the session (close - open, like get_1st_candle)
+        :param ticker: ticker symbol
+        :type ticker: str
+        :param interval: candle size in minutes, 1 or one of the aggregator's intervals
+        :type interval: int
+        :return: candle size, None until the first candle of the market clock's session closed
+        :rtype: float or None
+        """
+        state = self.tickers.get(ticker)
+        if state is None or state.session != market_clock.get_clock().today():  # e.g. yesterday's, left running
+            return None
+        return state.first_candle.get(interval)
+
+    def session_open(self, ticker: str):
+        """
+        Session open and previous session close
+        :param ticker: ticker symbol
+        :type ticker: str
+        :return: (session date, open, previous close), None until both prices are known
+        :rtype: tuple or None
+        """
+        state = self.tickers.get(ticker)
+        if state is None or state.open is None or state.previous_close is None:
+            return None
+        return state.session, state.open, state.previous_close
+
+    def gap(self, ticker: str):
+        """
+        Session open - previous session close, like get_gap
+        :param ticker: ticker symbol
+        :type ticker: str
+        :return: gap, None until both values of the market clock's session are known
+        :rtype: float or None
+        """
+        opening = self.session_open(ticker)
+        if opening is None or opening[0] != market_clock.get_clock().today():  # e.g. yesterday's, left running
+            return None
+        return opening[1] - opening[2]
+
+    def candles(self, ticker: str, interval=1, n=None) -> np.ndarray:
+        """
+        Last closed candles of a ticker
+        :param ticker: ticker symbol
+        :type ticker: str
+        :param interval: candle size in minutes, 1 or one of the aggregator's intervals
+        :type interval: int
+        :param n: number of candles, all kept candles if None
+        :type n: int
+        :return: array shaped (n, len(BAR_COLUMNS)), oldest first
+        :rtype: np.ndarray
+        """
+        state = self.tickers.get(ticker)
+        if state is None:
+            return np.empty((0, len(BAR_COLUMNS)))
+        return state.buffers[interval].last(n)
+
+
+def replay(aggregator: BarAggregator, bars):
+    """
+    Feed recorded 1m bars to an aggregator
+    :param aggregator: aggregator to feed
+    :type aggregator: BarAggregator
+    :param bars: iterable of (ticker, time, open, high, low, close, volume), oldest first
+    :type bars: iterable
+    """
+    for bar in bars:
+        aggregator.add_bar(*bar)
+
+
+# Shared aggregator, get_1st_candle and get_gap read from it before going to the network
+AGGREGATOR = BarAggregator()
@@ -0,0 +1,163 @@
+# Offline benchmark suite
+# Times the hot paths on synthetic data and writes machine-readable results, e.g.
+#   python benchmark.py --output bench.json
+#   python benchmark.py --output new.json --compare bench.json
+# --compare exits with 1 when a benchmark got slower than the tolerance allows.
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import config
+import data_store
+import ranking_system
+import synthetic_data
+import yf_functions
+
+# Globals
+
+SIZES = [35, 500, 5000]
+REPEAT = 3
+TOLERANCE = 0.25  # allowed slowdown against a baseline
+
+
+def _per_ticker(function, frames):
+    return lambda: [function(df) for df in frames]
+
+
+@contextlib.contextmanager
+def _store_at(store: str):
+    # the store functions read config.FILE_PATHS, the app's store is pointed back to when done
+    saved = config.FILE_PATHS['1D_STORE']
+    config.FILE_PATHS['1D_STORE'] = store
+    try:
+        yield
+    finally:
+        config.FILE_PATHS['1D_STORE'] = saved
+
+
+def _in_store(store: str, function):
+    def run():
+        with _store_at(store):
+            return function()
+    return run
+
+
+def benchmarks(n: int, directory: str) -> dict:
+    """
+    Benchmarks of a universe size, prepared and ready to time
+    :param n: number of tickers
+    :type n: int
+    :param directory: scratch directory for files
+    :type directory: str
+    :return: {name: function without arguments}
+    :rtype: dict
+    """
+    panel = synthetic_data.daily_panel(n)
+    frames = [panel.ticker_frame(ticker) for ticker in panel.symbols]
+    csv_paths = []
+    for ticker, df in zip(panel.symbols, frames):
+        csv_paths.append(os.path.join(directory, ticker + '.csv'))
+        df.to_csv(csv_paths[-1])
+    store = os.path.join(directory, 'store', '')
+    with _store_at(store):
+        data_store.save_panel(panel)
+    closes = np.asarray(panel.field('Close'), dtype=float)
+
+    def store_lookups():
+        stored = data_store.load_panel()
+        return [stored.ticker_frame(ticker) for ticker in stored.symbols]
+
+    def full_consolidation_scan():
+        stored = data_store.load_panel()
+        consolidating, breaking = yf_functions.scan_consolidation(stored.field('Close'))
+        return [t for t, c, b in zip(stored.symbols, consolidating, breaking) if c or b]
+
+    return {'is_consolidating': _per_ticker(yf_functions.is_consolidating, frames),
+            'get_SMA': lambda: [yf_functions.get_SMA(df, sma) for df in frames for sma in [20, 50, 100, 200]],
+            'sma_score': _per_ticker(ranking_system.sma_score, frames),
+            'sma_scores (vectorized)': lambda: ranking_system.sma_scores(closes),
+            'get_last_day_percentage': _per_ticker(yf_functions.get_last_day_percentage, frames),
+            'load csv files': lambda: [pd.read_csv(path) for path in csv_paths],
+            'load store': _in_store(store, lambda: data_store.load_panel().field('Close').sum()),
+            'store ticker lookups': _in_store(store, store_lookups),
+            'consolidation scan (vectorized)': lambda: yf_functions.scan_consolidation(closes),
+            'full consolidation scan': _in_store(store, full_consolidation_scan)}
+
+
+def time_function(function, repeat=REPEAT) -> dict:
+    """
+    Time a function
+    :param function: function without arguments
+    :type function: function
+    :param repeat: number of runs
+    :type repeat: int
+    :return: {'best': seconds, 'mean': seconds, 'runs': repeat}
+    :rtype: dict
+    """
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        runs.append(time.perf_counter() - start)
+    return {'best': min(runs), 'mean': sum(runs) / len(runs), 'runs': repeat}
+
+
+def run(sizes=SIZES, repeat=REPEAT) -> dict:
+    """
+    Run every benchmark at every universe size
+    :return: machine-readable results
+    :rtype: dict
+    """
+    results = []
+    for n in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            for name, function in benchmarks(n, directory).items():
+                results.append({'benchmark': name, 'tickers': n, **time_function(function, repeat)})
+                print(f"{name:<34}{n:>6} tickers  {results[-1]['best'] * 1000:10.2f} ms")
+    return {'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+            'results': results}
+
+
+def compare(results: dict, baseline: dict, tolerance=TOLERANCE) -> list:
+    """
+    Find regressions against a baseline
+    :return: descriptions of every benchmark slower than baseline * (1 + tolerance)
+    :rtype: list
+    """
+    before = {(r['benchmark'], r['tickers']): r['best'] for r in baseline['results']}
+    regressions = []
+    for r in results['results']:
+        old = before.get((r['benchmark'], r['tickers']))
+        if old is not None and r['best'] > old * (1 + tolerance):
+            regressions.append(f"{r['benchmark']} @ {r['tickers']}: {old * 1000:.2f} ms -> {r['best'] * 1000:.2f} ms")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Offline Stock-Finder benchmarks')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help='baseline results json')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.repeat)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        sys.exit(1 if regressions else 0)
@@ -16,10 +16,21 @@ def resource_path(relative_path):
 FILE_PATHS = {'INI': resource_path('dependencies\\initialization.ini'),
               'MAIN_UI': resource_path('ui_elements\\main.ui'),
               'SPLASH_UI': resource_path('ui_elements\\splash_screen.ui'),
-              '1D_DATA': resource_path('data\\1D\\')
+              '1D_STORE': resource_path('data\\1D\\'),
+              'INTRADAY_STORE': resource_path('data\\intraday\\'),
+              'LOGS': resource_path('logs\\'),
+              'UI_CACHE': resource_path('ui_elements\\compiled\\')
               }
 
 INI_SECTIONS = {'TICKERS': 'Tickers',
-                'DATA': 'DATA'}
+                'WATCHLISTS': 'Watchlists'}
 
-INI_DATA = {'1D': 'data_1d_date'}
+SMA_WEIGHTS = {20: 0.4, 50: 0.1, 100: 0.2, 200: 0.3}  # SMA score weight of each window
+
+FACTOR_WEIGHTS = {'SMA': 1.0,  # SMA score, 0-100
+                  'GAP': 0.5,  # gap, % of the current price
+                  'FIRST_CANDLE': 0.5,  # first candle of the session, % of the current price
+                  'MOMENTUM': 0.5}  # last day change, %
+
+INSTRUMENTATION = {'ENABLED': os.environ.get('STOCKFINDER_PROFILE', '') != '',  # stage timers and counters
+                   'CPROFILE': os.environ.get('STOCKFINDER_PROFILE', '') == 'cprofile'}  # cProfile every scan
@@ -0,0 +1,222 @@
+# Coverage manifest
+# What the local stores hold without opening them: per ticker and interval the first and last stored bar, the row
+# count, a checksum of the stored bars and when they were last fetched. One small json file read once, every lookup
+# is a dict access.
+import json
+import os
+import re
+import threading
+
+import pandas as pd
+
+import market_clock
+
+# Globals
+
+MANIFEST_FILE = 'manifest.json'
+DAILY = '1d'
+
+_lock = threading.Lock()
+_MANIFESTS = {}  # path -> (modification time, manifest)
+
+
+class Coverage:
+    """
+    Stored bars of one ticker at one interval
+    """
+    __slots__ = ('first', 'last', 'rows', 'checksum', 'fetched')
+
+    def __init__(self, first: str, last: str, rows: int, checksum: int, fetched=None):
+        """
+        :param first: first stored bar, %Y-%m-%d for daily bars, ISO time for intraday bars, None without bars
+        :type first: str
+        :param last: last stored bar, same format as first, None without bars
+        :type last: str
+        :param rows: number of stored bars
+        :type rows: int
+        :param checksum: checksum of the stored bars, see data_store.PricePanel.checksum
+        :type checksum: int
+        :param fetched: epoch seconds of the last fetch, None if unknown
+        :type fetched: float
+        """
+        self.first = first
+        self.last = last
+        self.rows = rows
+        self.checksum = checksum
+        self.fetched = fetched
+
+    def fetched_on(self):
+        """
+        Exchange date of the last fetch, None if unknown
+        :rtype: datetime.date or None
+        """
+        if self.fetched is None:
+            return None
+        return pd.Timestamp(self.fetched, unit='s', tz='UTC').tz_convert(market_clock.EXCHANGE_TZ).date()
+
+
+class Manifest:
+    """
+    Coverage of every stored ticker by interval
+    """
+
+    def __init__(self, entries=None):
+        """
+        :param entries: {interval: {ticker: Coverage}}
+        :type entries: dict
+        """
+        self.entries = {interval: dict(coverages) for interval, coverages in (entries or {}).items()}
+        self._lock = threading.Lock()  # the daily refresh and the intraday store record from different threads
+
+    def __len__(self):
+        return sum(len(coverages) for coverages in self.entries.values())
+
+    def get(self, ticker: str, interval=DAILY):
+        """
+        Coverage of a ticker
+        :rtype: Coverage or None
+        """
+        return self.entries.get(interval, {}).get(ticker)
+
+    def tickers(self, interval=DAILY) -> list:
+        return list(self.entries.get(interval, {}))
+
+    def record(self, ticker: str, coverage: Coverage, interval=DAILY):
+        """
+        Set the coverage of a ticker after its bars were stored
+        :param ticker: ticker symbol
+        :type ticker: str
+        :param coverage: the stored bars, None removes the ticker
+        :type coverage: Coverage
+        :param interval: bar interval
+        :type interval: str
+        """
+        with self._lock:
+            if coverage is None:
+                self.entries.get(interval, {}).pop(ticker, None)
+            else:
+                self.entries.setdefault(interval, {})[ticker] = coverage
+
+    def clear(self, interval: str):
+        """
+        Forget every ticker of an interval, e.g. after its store was deleted
+        :param interval: bar interval
+        :type interval: str
+        """
+        with self._lock:
+            self.entries.pop(interval, None)
+
+    def covers(self, ticker: str, when: str, interval=DAILY) -> bool:
+        """
+        Checks if a bar time is inside the stored range of a ticker
+        :param ticker: ticker symbol
+        :type ticker: str
+        :param when: bar time, same format as Coverage.first
+        :type when: str
+        :param interval: bar interval
+        :type interval: str
+        :rtype: bool
+        """
+        coverage = self.get(ticker, interval)
+        return coverage is not None and coverage.rows > 0 and coverage.first <= when <= coverage.last
+
+    def is_fresh(self, ticker: str, today=None, interval=DAILY) -> bool:
+        """
+        Checks if a ticker was fetched today
+        :param today: exchange date, the market clock's today if None
+        :type today: datetime.date
+        :rtype: bool
+        """
+        coverage = self.get(ticker, interval)
+        return coverage is not None and coverage.fetched_on() == (today or market_clock.get_clock().today())
+
+    def missing(self, tickers: list, start, today=None, interval=DAILY) -> dict:
+        """
+        What has to be fetched to bring tickers up to date.
+        Stored tickers are fetched from their last bar (re-fetching it so a partial session is replaced), tickers
+        that are not stored from start. Tickers fetched today are up to date, tickers a fetch had no bars for are
+        fetched again from that fetch only.
+        :param tickers: tickers to keep fresh
+        :type tickers: list
+        :param start: first date of tickers that are not stored, None for their whole history
+        :type start: str
+        :param today: exchange date, the market clock's today if None
+        :type today: datetime.date
+        :param interval: bar interval
+        :type interval: str
+        :return: {ticker: first date to fetch or None for the whole history}, only tickers that are not up to date
+        :rtype: dict
+        """
+        result = {}
+        for ticker in tickers:
+            coverage = self.get(ticker, interval)
+            if coverage is None:
+                result[ticker] = start
+            elif not self.is_fresh(ticker, today, interval):
+                result[ticker] = coverage.last if coverage.rows else str(coverage.fetched_on() or start)
+        return result
+
+    def save(self, path: str):
+        """
+        Save the manifest as json, the file is replaced atomically
+        :param path: json path
+        :type path: str
+        """
+        tmp = path + '.tmp'
+        with self._lock:
+            with open(tmp, 'w') as f:
+                json.dump({interval: {ticker: [getattr(coverage, name) for name in Coverage.__slots__]
+                                      for ticker, coverage in coverages.items()}
+                           for interval, coverages in self.entries.items()}, f)
+            os.replace(tmp, path)
+
+
+def load_manifest(path: str) -> Manifest:
+    """
+    Load a saved manifest
+    :param path: json path
+    :type path: str
+    :return: the saved manifest, an empty manifest if there is no file
+    :rtype: Manifest
+    """
+    if not os.path.isfile(path):
+        return Manifest()
+    with open(path) as f:
+        saved = json.load(f)
+    return Manifest({interval: {ticker: Coverage(*values) for ticker, values in coverages.items()}
+                     for interval, coverages in saved.items()})
+
+
+def get_manifest(path: str) -> Manifest:
+    """
+    The shared manifest of a path, the file is read again only after it changed
+    :param path: json path
+    :type path: str
+    :rtype: Manifest
+    """
+    modified = os.path.getmtime(path) if os.path.isfile(path) else None
+    with _lock:
+        loaded = _MANIFESTS.get(path)
+        if loaded is None or loaded[0] != modified:
+            loaded = _MANIFESTS[path] = (modified, load_manifest(path))
+        return loaded[1]
+
+
+def period_start(period: str, today=None):
+    """
+    First date of a download period
+    :param period: period in 1d,5d,1mo,3mo,1y,ytd,max template
+    :type period: str
+    :param today: exchange date, the market clock's today if None
+    :type today: datetime.date
+    :return: %Y-%m-%d date, None for max
+    :rtype: str or None
+    """
+    today = pd.Timestamp(today or market_clock.get_clock().today())
+    if period == 'max':
+        return None
+    if period == 'ytd':
+        return today.replace(month=1, day=1).strftime('%Y-%m-%d')
+    count, unit = re.fullmatch(r'(\d+)(d|mo|y)', period).groups()
+    offset = {'d': 'days', 'mo': 'months', 'y': 'years'}[unit]
+    return (today - pd.DateOffset(**{offset: int(count)})).strftime('%Y-%m-%d')
@@ -0,0 +1,536 @@
+# Columnar price store
+import json
+import os
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+
+import adjustments
+import config
+import coverage_manifest
+import instrumentation
+import market_clock
+import providers
+
+# Globals
+
+PRICE_FIELDS = ['Open', 'High', 'Low', 'Close', 'Adj Close']
+FIELDS = PRICE_FIELDS + ['Volume']
+PRICE_DTYPE = np.float32  # Yahoo quotes are single precision already, float64 only doubled the memory
+VOLUME_DTYPE = np.int64  # empty bars have a volume of 0, NaN closes mark them
+STORE_FILES = {'PRICES': 'prices.npy',
+               'VOLUME': 'volume.npy',
+               'DATES': 'dates.npy',
+               'META': 'meta.json'}
+ACTIONS_FILE = 'actions.json'  # splits and dividends, see adjustments
+LEGACY_DATA = 'ohlcv.npy'  # float64 (field, ticker, date) array of older stores, converted on load
+
+
+class PricePanel:
+    """
+    Ticker x date x OHLCV panel with symbol and date indexes.
+    Prices are one float32 block kept field-major (field, ticker, date) so every field of the whole universe is
+    contiguous, volumes are a separate integer (ticker, date) array and all tickers share one date axis.
+    Bars are stored as they traded, scans read split adjusted views of them (see adjusted).
+    """
+
+    def __init__(self, prices: np.ndarray, volume: np.ndarray, symbols: list, dates: np.ndarray, version=None,
+                 actions=None):
+        """
+        :param prices: array shaped (len(PRICE_FIELDS), len(symbols), len(dates)), empty bars are NaN
+        :type prices: np.ndarray
+        :param volume: integer array shaped (len(symbols), len(dates))
+        :type volume: np.ndarray
+        :param symbols: ticker symbols, row order of prices and volume
+        :type symbols: list
+        :param dates: datetime64[D] session dates, column order of prices and volume
+        :type dates: np.ndarray
+        :param version: dataset version of a saved panel, changes on every save, None if unsaved
+        :type version: str
+        :param actions: splits and dividends of the tickers
+        :type actions: adjustments.ActionTable
+        """
+        self.prices = prices
+        self.volume = volume
+        self.symbols = list(symbols)
+        self.dates = dates
+        self.symbol_index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.version = version
+        self.actions = actions or adjustments.ActionTable()
+        self._adjusted = {}  # (field, dividends, actions version) -> adjusted field of every ticker
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __contains__(self, ticker):
+        return ticker in self.symbol_index
+
+    @property
+    def nbytes(self) -> int:
+        return self.prices.nbytes + self.volume.nbytes + self.dates.nbytes
+
+    def field(self, name: str) -> np.ndarray:
+        """
+        Get a whole field of the universe (no copy)
+        :param name: one of FIELDS
+        :type name: str
+        :return: array shaped (tickers, dates), float32 prices or integer volumes
+        :rtype: np.ndarray
+        """
+        if name == 'Volume':
+            return self.volume
+        return self.prices[PRICE_FIELDS.index(name)]
+
+    def adjusted(self, name: str, rows=None, dividends=False) -> np.ndarray:
+        """
+        Field adjusted for the corporate actions of every ticker, whole fields are cached until the actions change
+        :param name: one of FIELDS, volumes are adjusted for splits only
+        :type name: str
+        :param rows: rows to adjust, every ticker if None
+        :type rows: np.ndarray
+        :param dividends: also adjust prices for dividends, like Adj Close
+        :type dividends: bool
+        :return: float64 array shaped (rows, dates), for every ticker the field itself if no ticker has actions to
+                 apply, i.e. splits or with dividends also dividends
+        :rtype: np.ndarray
+        """
+        dividends = dividends and name != 'Volume'
+        key = (name, dividends, self.actions.version)
+        if rows is None and key in self._adjusted:
+            return self._adjusted[key]
+        positions = {row: i for i, row in enumerate(range(len(self)) if rows is None else rows)}
+        with_actions = self.actions.tickers() if dividends else self.actions.splits  # dividends change nothing else
+        affected = [(positions[self.symbol_index[ticker]], ticker) for ticker in with_actions
+                    if self.symbol_index.get(ticker) in positions]
+        if rows is None and not affected:
+            return self.field(name)  # nothing to adjust, no float64 copy of the whole universe
+        values = np.asarray(self.field(name) if rows is None else self.field(name)[rows], dtype=float)
+        for i, ticker in affected:
+            factors = self.actions.price_factors(ticker, self.dates, dividends)
+            if name == 'Volume':
+                values[i] /= factors
+            else:
+                values[i] *= factors
+        if rows is None:
+            values.flags.writeable = False  # shared by every caller
+            self._adjusted = {key: values, **{k: v for k, v in self._adjusted.items() if k[2] == key[2]}}
+        return values
+
+    def rows(self, tickers: list) -> tuple:
+        """
+        Integer rows of tickers, scanners index fields with them
+        :param tickers: ticker symbols, tickers missing from the panel are skipped
+        :type tickers: list
+        :return: (tickers in the panel, their rows)
+        :rtype: tuple
+        """
+        tickers = [ticker for ticker in tickers if ticker in self.symbol_index]
+        return tickers, np.fromiter((self.symbol_index[t] for t in tickers), dtype=np.intp, count=len(tickers))
+
+    def row(self, ticker: str) -> 'TickerView':
+        """
+        View of a single ticker's bars, nothing is copied
+        :param ticker: ticker symbol
+        :type ticker: str
+        :rtype: TickerView
+        """
+        return TickerView(self, self.symbol_index[ticker])
+
+    def ticker_frame(self, ticker: str) -> pd.DataFrame:
+        """
+        Get a single ticker as a dataframe, same layout the per-ticker csv files had
+        :param ticker: ticker symbol
+        :type ticker: str
+        :return: dataframe with a Date column and FIELDS columns on a default index, like pd.read_csv gave
+        :rtype: pd.DataFrame
+        """
+        return self.row(ticker).frame()
+
+    def coverage(self, ticker: str, fetched=None) -> coverage_manifest.Coverage:
+        """
+        Coverage manifest entry of a ticker's bars
+        :param ticker: ticker symbol
+        :type ticker: str
+        :param fetched: epoch seconds the bars were fetched at
+        :type fetched: float
+        :return: first and last bar, bar count and a crc32 of the bars, ignoring empty dates so the checksum does
+                 not change when other tickers add dates
+        :rtype: coverage_manifest.Coverage
+        """
+        view = self.row(ticker)
+        valid = np.flatnonzero(~np.isnan(view.close))
+        if len(valid) == 0:
+            return coverage_manifest.Coverage(None, None, 0, 0, fetched)
+        checksum = zlib.crc32(np.ascontiguousarray(self.prices[:, view.slot, valid]).tobytes())
+        checksum = zlib.crc32(np.ascontiguousarray(view.volume[valid]).tobytes(), checksum)
+        return coverage_manifest.Coverage(str(self.dates[valid[0]]), str(self.dates[valid[-1]]), len(valid),
+                                          checksum, fetched)
+
+    def last_bar_date(self, ticker: str):
+        """
+        Date of the last stored bar of a ticker
+        :param ticker: ticker symbol
+        :type ticker: str
+        :return: datetime64[D] of the last non empty close, None if the ticker has no bars
+        :rtype: np.datetime64 or None
+        """
+        if ticker not in self.symbol_index:
+            return None
+        valid = np.flatnonzero(~np.isnan(self.row(ticker).close))
+        if len(valid) == 0:
+            return None
+        return self.dates[valid[-1]]
+
+
+class TickerView:
+    """
+    One ticker's slot in a panel. Fields are views into the panel's arrays, so a view costs two references
+    instead of a dataframe per ticker.
+    """
+    __slots__ = ('panel', 'slot')
+
+    def __init__(self, panel: PricePanel, slot: int):
+        """
+        :param panel: panel the ticker is in
+        :type panel: PricePanel
+        :param slot: the ticker's row in the panel
+        :type slot: int
+        """
+        self.panel = panel
+        self.slot = slot
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.panel.field(name)[self.slot]
+
+    @property
+    def ticker(self) -> str:
+        return self.panel.symbols[self.slot]
+
+    @property
+    def dates(self) -> np.ndarray:
+        return self.panel.dates
+
+    @property
+    def open(self) -> np.ndarray:
+        return self.panel.prices[0, self.slot]
+
+    @property
+    def high(self) -> np.ndarray:
+        return self.panel.prices[1, self.slot]
+
+    @property
+    def low(self) -> np.ndarray:
+        return self.panel.prices[2, self.slot]
+
+    @property
+    def close(self) -> np.ndarray:
+        return self.panel.prices[3, self.slot]
+
+    @property
+    def volume(self) -> np.ndarray:
+        return self.panel.volume[self.slot]
+
+    def frame(self, adjusted=True) -> pd.DataFrame:
+        """
+        The ticker as a dataframe with a Date column and FIELDS columns
+        :param adjusted: adjust for splits like Yahoo's bars are, raw bars if false
+        :type adjusted: bool
+        :rtype: pd.DataFrame
+        """
+        if adjusted:
+            df = pd.DataFrame({name: self.panel.adjusted(name, [self.slot])[0] for name in FIELDS})
+        else:
+            df = pd.DataFrame(self.panel.prices[:, self.slot, :].T.astype(float), columns=PRICE_FIELDS)
+            df['Volume'] = self.volume
+        df.insert(0, 'Date', pd.DatetimeIndex(self.dates))
+        return df
+
+
+def empty_arrays(n_symbols: int, n_dates: int) -> tuple:
+    """
+    Price and volume arrays of a panel without bars
+    :param n_symbols: number of tickers
+    :type n_symbols: int
+    :param n_dates: number of dates
+    :type n_dates: int
+    :return: (NaN prices, zero volumes)
+    :rtype: tuple
+    """
+    return (np.full((len(PRICE_FIELDS), n_symbols, n_dates), np.nan, dtype=PRICE_DTYPE),
+            np.zeros((n_symbols, n_dates), dtype=VOLUME_DTYPE))
+
+
+def to_volume(values) -> np.ndarray:
+    """
+    Volumes as VOLUME_DTYPE, missing volumes become 0
+    :param values: volumes, may be float with NaN
+    :rtype: np.ndarray
+    """
+    return np.nan_to_num(np.asarray(values, dtype=float), nan=0.0).astype(VOLUME_DTYPE)
+
+
+def store_path(name: str) -> str:
+    """
+    Path of a store file
+    :param name: key of STORE_FILES
+    :type name: str
+    :return: path inside config.FILE_PATHS['1D_STORE']
+    :rtype: str
+    """
+    return os.path.join(config.FILE_PATHS['1D_STORE'], STORE_FILES[name])
+
+
+def store_exists() -> bool:
+    """
+    Checks if a saved panel exists
+    :return: true if all store files, or the files of an older store, exist
+    :rtype: bool
+    """
+    if not all(os.path.isfile(store_path(name)) for name in ['DATES', 'META']):
+        return False
+    return all(os.path.isfile(store_path(name)) for name in ['PRICES', 'VOLUME']) or os.path.isfile(_legacy_path())
+
+
+@instrumentation.timed('store.from_download')
+def panel_from_download(data: pd.DataFrame, tickers: list) -> PricePanel:
+    """
+    Build a panel out of a yf.download(group_by='ticker') dataframe.
+    Yahoo adjusts bars for every split up to today, the splits inside the downloaded range are recorded in the
+    panel's actions and taken out of the bars again so the panel holds bars as they traded.
+    :param data: downloaded dataframe, columns are (ticker, field) or plain fields for a single ticker
+    :type data: pd.DataFrame
+    :param tickers: tickers that were downloaded
+    :type tickers: list
+    :return: panel of the downloaded data
+    :rtype: PricePanel
+    """
+    dates = pd.DatetimeIndex(data.index).tz_localize(None).values.astype('datetime64[D]')
+    prices, volume = empty_arrays(len(tickers), len(dates))
+    actions = adjustments.ActionTable()
+    for row, ticker in enumerate(tickers):
+        ticker_data = data[ticker] if isinstance(data.columns, pd.MultiIndex) else data
+        actions.update(adjustments.from_download(ticker_data, ticker))
+        factors = actions.price_factors(ticker, dates)
+        for f, name in enumerate(PRICE_FIELDS):
+            if name in ticker_data:
+                prices[f, row] = ticker_data[name].to_numpy(dtype=float) / factors
+        if 'Volume' in ticker_data:
+            volume[row] = to_volume(ticker_data['Volume'].to_numpy(dtype=float) * factors)
+    return PricePanel(prices, volume, tickers, dates, actions=actions)
+
+
+@instrumentation.timed('store.save')
+def save_panel(panel: PricePanel):
+    """
+    Save a panel to config.FILE_PATHS['1D_STORE'], files are replaced atomically
+    :param panel: panel to save
+    :type panel: PricePanel
+    """
+    os.makedirs(config.FILE_PATHS['1D_STORE'], exist_ok=True)
+    panel.version = str(time.time_ns())
+    _atomic_save(store_path('PRICES'), np.ascontiguousarray(panel.prices, dtype=PRICE_DTYPE))
+    _atomic_save(store_path('VOLUME'), np.ascontiguousarray(panel.volume, dtype=VOLUME_DTYPE))
+    _atomic_save(store_path('DATES'), panel.dates.astype('datetime64[D]'))
+    tmp = store_path('META') + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'fields': PRICE_FIELDS, 'symbols': panel.symbols, 'version': panel.version}, f)
+    os.replace(tmp, store_path('META'))
+    save_actions(panel)
+    if os.path.isfile(_legacy_path()):  # converted, no longer read
+        os.remove(_legacy_path())
+
+
+def save_actions(panel: PricePanel):
+    """
+    Save only the corporate actions of a panel, a new split or dividend does not rewrite any bars
+    :param panel: panel whose actions changed
+    :type panel: PricePanel
+    """
+    os.makedirs(config.FILE_PATHS['1D_STORE'], exist_ok=True)
+    panel.actions.save(_actions_path())
+
+
+@instrumentation.timed('store.load')
+def load_panel(mmap=True) -> PricePanel:
+    """
+    Load the saved panel in one read
+    :param mmap: memory-map the price and volume arrays instead of reading them
+    :type mmap: bool
+    :return: saved panel
+    :rtype: PricePanel
+    """
+    with open(store_path('META')) as f:
+        meta = json.load(f)
+    if os.path.isfile(store_path('PRICES')):
+        prices = np.load(store_path('PRICES'), mmap_mode='r' if mmap else None)
+        volume = np.load(store_path('VOLUME'), mmap_mode='r' if mmap else None)
+    else:
+        legacy = np.load(_legacy_path())
+        prices, volume = legacy[:len(PRICE_FIELDS)].astype(PRICE_DTYPE), to_volume(legacy[len(PRICE_FIELDS)])
+    dates = np.load(store_path('DATES'))
+    return PricePanel(prices, volume, meta['symbols'], dates, meta.get('version'),
+                      adjustments.load_table(_actions_path()))
+
+
+@instrumentation.timed('store.merge')
+def merge_panels(base: PricePanel, delta: PricePanel) -> PricePanel:
+    """
+    Merge newly downloaded bars into a panel.
+    Symbols and dates are unioned, overlapping (ticker, date) bars are deduplicated by keeping the delta's bar,
+    the delta's corporate actions are added to the base's.
+    :param base: stored panel, may be None
+    :type base: PricePanel
+    :param delta: newly downloaded panel
+    :type delta: PricePanel
+    :return: merged panel
+    :rtype: PricePanel
+    """
+    if base is None:
+        return delta
+    symbols = base.symbols + [s for s in delta.symbols if s not in base.symbol_index]
+    dates = np.union1d(base.dates, delta.dates)
+    prices, volume = empty_arrays(len(symbols), len(dates))
+    base_cols = np.searchsorted(dates, base.dates)
+    prices[:, :len(base.symbols), base_cols] = base.prices
+    volume[:len(base.symbols), base_cols] = base.volume
+    symbol_index = {symbol: i for i, symbol in enumerate(symbols)}
+    rows = np.array([symbol_index[s] for s in delta.symbols], dtype=int)[:, None]
+    cols = np.searchsorted(dates, delta.dates)[None, :]
+    has_bar = ~np.isnan(delta.field('Close'))  # only real bars replace stored ones
+    prices[:, rows, cols] = np.where(has_bar, delta.prices, prices[:, rows, cols])
+    volume[rows, cols] = np.where(has_bar, delta.volume, volume[rows, cols])
+    actions = base.actions.copy()
+    actions.update(delta.actions)
+    return PricePanel(prices, volume, symbols, dates, actions=actions)
+
+
+def get_manifest() -> coverage_manifest.Manifest:
+    """
+    Coverage manifest of the store, what is stored can be asked without loading the store.
+    A store saved before the manifest existed is indexed once.
+    :rtype: coverage_manifest.Manifest
+    """
+    manifest = coverage_manifest.get_manifest(_manifest_path())
+    if not store_exists():
+        manifest.clear(coverage_manifest.DAILY)
+    elif not len(manifest.tickers(coverage_manifest.DAILY)):
+        with open(store_path('META')) as f:
+            watermarks = json.load(f).get('watermarks', {})  # refresh dates of older stores
+        panel = load_panel()
+        for ticker in panel.symbols:
+            fetched = watermarks.get(ticker)
+            fetched = pd.Timestamp(fetched, tz=market_clock.EXCHANGE_TZ).timestamp() if fetched else None
+            manifest.record(ticker, panel.coverage(ticker, fetched))
+        save_manifest()
+    return manifest
+
+
+def save_manifest():
+    """
+    Save the shared manifest after its entries were recorded
+    """
+    os.makedirs(config.FILE_PATHS['1D_STORE'], exist_ok=True)
+    coverage_manifest.get_manifest(_manifest_path()).save(_manifest_path())
+
+
+def previous_close(ticker: str, session):
+    """
+    Last stored close of a ticker before a session, the store is opened only if the manifest has the ticker
+    :param ticker: ticker symbol
+    :type ticker: str
+    :param session: session date
+    :type session: datetime.date or str
+    :return: split adjusted close, None if not stored
+    :rtype: float or None
+    """
+    session = str(np.datetime64(pd.Timestamp(session).date(), 'D'))
+    entry = get_manifest().get(ticker)
+    if entry is None or not entry.rows or entry.first >= session:
+        return None
+    panel = load_panel()
+    closes = panel.adjusted('Close', [panel.symbol_index[ticker]])[0, panel.dates < np.datetime64(session)]
+    closes = closes[~np.isnan(closes)]
+    return float(closes[-1]) if len(closes) else None
+
+
+def verify_store(tickers=None) -> list:
+    """
+    Compare the stored bars with the manifest's checksums
+    :param tickers: tickers to check, every stored ticker if None
+    :type tickers: list
+    :return: tickers whose stored bars do not match the manifest, a refresh fetches them again
+    :rtype: list
+    """
+    manifest = get_manifest()
+    panel = load_panel()
+    tickers = manifest.tickers() if tickers is None else tickers
+    mismatched = [ticker for ticker in tickers if manifest.get(ticker) is not None
+                  and (ticker not in panel or panel.coverage(ticker).checksum != manifest.get(ticker).checksum)]
+    for ticker in mismatched:
+        manifest.record(ticker, None)
+    if mismatched:
+        save_manifest()
+    return mismatched
+
+
+@instrumentation.timed('store.refresh')
+def refresh_panel(tickers: list, period='1y') -> PricePanel:
+    """
+    Incrementally bring the store up to date.
+    The manifest tells which tickers were not fetched today without reading the store. Stored tickers are fetched
+    from their last stored bar (re-fetching it so a partial session is replaced), new tickers get a full period.
+    Tickers sharing a start date are fetched in one batched request, so a new ticker does not re-fetch the period
+    for every stale one.
+    :param tickers: tickers to keep fresh
+    :type tickers: list
+    :param period: history to download for tickers that are not stored yet
+    :type period: str
+    :return: the up to date panel
+    :rtype: PricePanel
+    """
+    tickers = list(dict.fromkeys(tickers))  # watchlists may share symbols, fetch each once
+    manifest = get_manifest()
+    clock = market_clock.get_clock()
+    today = clock.today()  # exchange date, a replay's date while replaying
+    missing = manifest.missing(tickers, coverage_manifest.period_start(period, today), today)
+    if not missing:  # memory-mapped, scans read only the bars they use
+        return load_panel() if store_exists() else None
+    panel = load_panel(mmap=False) if store_exists() else None  # read, the save below replaces the store's files
+    groups = {}  # new tickers under None, stored ones by the date to fetch from
+    for ticker, start in missing.items():
+        groups.setdefault(None if manifest.get(ticker) is None else start, []).append(ticker)
+    end = (pd.Timestamp(today) + pd.Timedelta(days=1)).to_pydatetime()
+    for start, group in groups.items():
+        if start is None:  # whole period of new tickers
+            data = providers.get_provider().download(group, period=period, interval='1d')
+        else:
+            data = providers.get_provider().download(group, start=pd.Timestamp(start).to_pydatetime(), end=end,
+                                                     interval='1d')
+        panel = merge_panels(panel, panel_from_download(data, group))
+    save_panel(panel)
+    fetched = clock.now().timestamp()
+    for ticker in missing:
+        manifest.record(ticker, panel.coverage(ticker, fetched))
+    save_manifest()
+    return panel
+
+
+def _manifest_path() -> str:
+    return os.path.join(config.FILE_PATHS['1D_STORE'], coverage_manifest.MANIFEST_FILE)
+
+
+def _actions_path() -> str:
+    return os.path.join(config.FILE_PATHS['1D_STORE'], ACTIONS_FILE)
+
+
+def _legacy_path() -> str:
+    return os.path.join(config.FILE_PATHS['1D_STORE'], LEGACY_DATA)
+
+
+def _atomic_save(path: str, array: np.ndarray):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp, path)
@@ -0,0 +1,153 @@
+# Pre-market gap scanner
+# Open vs previous close gaps of a whole universe at the open. Sources, cheapest first: the bar aggregator's streamed
+# session open, today's bar in the local store or the intraday store's first bar, then batched downloads of whatever
+# is still missing. Downloads that did not finish within the latency budget are left out so the list is always ready
+# on time.
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+
+import bar_aggregator
+import data_store
+import instrumentation
+import intraday_store
+import market_clock
+import providers
+
+# Globals
+
+BUDGET = 5.0  # seconds until the gap list is ready
+BATCH_SIZE = 200  # tickers per batched download
+DOWNLOAD_THREADS = 4
+DIRECTIONS = ['both', 'up', 'down']
+COLUMNS = ['Previous Close', 'Open', 'Gap', 'Gap %', 'Source']
+
+
+def session_gaps(panel: data_store.PricePanel, tickers: list, session) -> tuple:
+    """
+    Open of a session and the close before it, from daily bars
+    :param panel: daily panel
+    :type panel: data_store.PricePanel
+    :param tickers: tickers, all must be in the panel
+    :type tickers: list
+    :param session: session date
+    :type session: np.datetime64
+    :return: (previous closes, session opens), NaN where unknown
+    :rtype: tuple
+    """
+    _, rows = panel.rows(tickers)
+    closes = panel.adjusted('Close', rows)[:, panel.dates < session]
+    previous_close = np.full(len(rows), np.nan)
+    if closes.shape[1]:
+        has_close = ~np.isnan(closes)
+        last = closes.shape[1] - 1 - np.argmax(has_close[:, ::-1], axis=1)  # last non empty close
+        previous_close = np.where(has_close.any(axis=1), closes[np.arange(len(rows)), last], np.nan)
+    opens = np.full(len(rows), np.nan)
+    today = np.flatnonzero(panel.dates == session)
+    if len(today):
+        opens = panel.adjusted('Open', rows)[:, today[0]]
+    return previous_close, opens
+
+
+def _download_gaps(tickers: list, session) -> tuple:
+    data = providers.get_provider().download(tickers, period='5d', interval='1d')
+    return (tickers, *session_gaps(data_store.panel_from_download(data, tickers), tickers, session))
+
+
+def _intraday_covers(manifest, ticker: str, day) -> bool:
+    # the manifest tells if the intraday store may have the session, so only those tickers' files are read
+    if manifest is None:
+        return False
+    for interval in intraday_store.INTERVALS:
+        entry = manifest.get(ticker, interval)
+        if entry is not None and entry.rows and entry.first[:10] <= str(day) <= entry.last[:10]:
+            return True
+    return False
+
+
+@instrumentation.timed('gaps.gap_table')
+def gap_table(tickers: list, session=None, budget=BUDGET, download=True, min_gap_percent=0.0,
+              direction='both') -> pd.DataFrame:
+    """
+    Gaps of a universe, biggest first
+    :param tickers: tickers to scan
+    :type tickers: list
+    :param session: session date, today if None
+    :type session: datetime or str
+    :param budget: seconds the scan may take, downloads still running then are left out
+    :type budget: float
+    :param download: fetch tickers the aggregator and the store have no open for
+    :type download: bool
+    :param min_gap_percent: smallest absolute gap % kept
+    :type min_gap_percent: float
+    :param direction: one of DIRECTIONS
+    :type direction: str
+    :return: COLUMNS indexed by ticker, sorted by absolute gap %, Source is stream, store, intraday or download
+    :rtype: pd.DataFrame
+    """
+    deadline = time.monotonic() + budget
+    session_date = pd.Timestamp(session or market_clock.get_clock().today()).date()
+    session = np.datetime64(session_date, 'D')
+    tickers = list(dict.fromkeys(tickers))
+    index = {ticker: i for i, ticker in enumerate(tickers)}
+    previous_close = np.full(len(tickers), np.nan)
+    opens = np.full(len(tickers), np.nan)
+    sources = np.full(len(tickers), '', dtype=object)
+
+    manifest = data_store.get_manifest() if data_store.store_exists() else None
+    if manifest is not None and any(manifest.get(ticker) is not None for ticker in tickers):
+        panel = data_store.load_panel()
+        stored, rows = panel.rows(tickers)
+        if len(stored):
+            stored_close, stored_open = session_gaps(panel, stored, session)
+            at = [index[ticker] for ticker in stored]
+            previous_close[at], opens[at] = stored_close, stored_open
+            sources[[i for i, value in zip(at, stored_open) if not np.isnan(value)]] = 'store'
+
+    for i, ticker in enumerate(tickers):  # streamed opens are the freshest
+        opening = bar_aggregator.AGGREGATOR.session_open(ticker)
+        if opening is not None and opening[0] == session_date:
+            _, opens[i], previous_close[i] = opening
+            sources[i] = 'stream'
+
+    for i, ticker in enumerate(tickers):  # stored intraday bars, e.g. written by the watcher
+        if time.monotonic() >= deadline:
+            break
+        if np.isnan(opens[i]) and not np.isnan(previous_close[i]) and _intraday_covers(manifest, ticker, session_date):
+            opening = intraday_store.session_open(ticker, session_date)
+            if opening is not None:
+                opens[i], sources[i] = opening, 'intraday'
+
+    missing = [ticker for ticker in tickers if np.isnan(opens[index[ticker]])]
+    if download and missing:
+        executor = ThreadPoolExecutor(DOWNLOAD_THREADS)
+        futures = [executor.submit(_download_gaps, missing[i:i + BATCH_SIZE], session)
+                   for i in range(0, len(missing), BATCH_SIZE)]
+        done, late = wait(futures, timeout=max(0.0, deadline - time.monotonic()))
+        executor.shutdown(wait=False, cancel_futures=True)
+        instrumentation.count('gaps.late_batches', len(late))
+        for future in done:
+            if future.exception() is not None:
+                print(future.exception())
+                continue
+            batch, batch_close, batch_open = future.result()
+            at = [index[ticker] for ticker in batch]
+            has_open = ~np.isnan(batch_open)
+            opens[at] = np.where(has_open, batch_open, opens[at])
+            previous_close[at] = np.where(np.isnan(previous_close[at]), batch_close, previous_close[at])
+            sources[[i for i, value in zip(at, has_open) if value]] = 'download'
+
+    gap = opens - previous_close
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gap_percent = gap / previous_close * 100
+    table = pd.DataFrame({'Previous Close': previous_close, 'Open': opens, 'Gap': gap, 'Gap %': gap_percent,
+                          'Source': sources}, index=pd.Index(tickers, name='Ticker'))
+    keep = ~np.isnan(gap_percent) & (np.abs(gap_percent) >= min_gap_percent)
+    if direction == 'up':
+        keep &= gap_percent > 0
+    elif direction == 'down':
+        keep &= gap_percent < 0
+    table = table[keep]
+    return table.iloc[np.argsort(-np.abs(table['Gap %'].to_numpy()), kind='stable')]
@@ -0,0 +1,181 @@
+# Shared ticker history cache
+# One fetch per (symbol, interval) serves every narrower period by slicing, entries expire per interval and the
+# least recently used entries are evicted. Concurrent requests for the same key wait for a single fetch.
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+import instrumentation
+import market_clock
+import providers
+
+# Globals
+
+INTERVAL_TTL = {'1m': 30, '2m': 60, '5m': 120, '15m': 300, '30m': 600, '60m': 900, '90m': 900, '1h': 900,
+                '1d': 60, '5d': 3600, '1wk': 3600, '1mo': 3600, '3mo': 3600}  # market seconds
+WIDEST_PERIOD = {'1d': '1y', '5d': '5y', '1wk': '5y', '1mo': 'max', '3mo': 'max'}  # intraday intervals: '1d'
+PERIOD_DAYS = {'d': 1, 'mo': 30, 'y': 365}
+MAX_ENTRIES = 256
+
+
+def period_days(period: str) -> int:
+    """
+    Length of a yfinance period in days, used to compare periods
+    :param period: period in 1d,5d,1mo,3mo,1y,ytd,max template
+    :type period: str
+    :return: days
+    :rtype: int
+    """
+    if period == 'max':
+        return 10 ** 6
+    if period == 'ytd':
+        return 366
+    count, unit = re.fullmatch(r'(\d+)(d|mo|y)', period).groups()
+    return int(count) * PERIOD_DAYS[unit]
+
+
+def slice_period(history: pd.DataFrame, period: str) -> pd.DataFrame:
+    """
+    Narrow a history frame to a period.
+    Nd periods are the last N sessions (rows of the last N dates for intraday data), mo/y periods are calendar based.
+    :param history: history frame, oldest first
+    :type history: pd.DataFrame
+    :param period: period in 1d,5d,1mo,3mo,1y,ytd,max template
+    :type period: str
+    :return: the period's rows
+    :rtype: pd.DataFrame
+    """
+    if period == 'max' or len(history) == 0:
+        return history
+    last = history.index[-1]
+    if period == 'ytd':
+        return history[history.index.year == last.year]
+    count, unit = re.fullmatch(r'(\d+)(d|mo|y)', period).groups()
+    if unit == 'd':
+        sessions = history.index.normalize()
+        first_session = sessions.unique()[-int(count):][0]
+        return history[sessions >= first_session]
+    offset = pd.DateOffset(months=int(count)) if unit == 'mo' else pd.DateOffset(years=int(count))
+    return history[history.index > last - offset]
+
+
+class HistoryCache:
+    """
+    TTL + LRU cache of ticker histories keyed by (symbol, interval)
+    """
+
+    def __init__(self, fetch=None, max_entries=MAX_ENTRIES, ttl=None):
+        """
+        :param fetch: function(symbol, period, interval) -> history dataframe, the current provider's by default
+        :type fetch: function
+        :param max_entries: entries kept before the least recently used is evicted
+        :type max_entries: int
+        :param ttl: {interval: seconds} overrides of INTERVAL_TTL
+        :type ttl: dict
+        """
+        self.fetch = fetch or (lambda symbol, period, interval: providers.get_provider().history(symbol, period,
+                                                                                                interval))
+        self.max_entries = max_entries
+        self.ttl = {**INTERVAL_TTL, **(ttl or {})}
+        self._entries = OrderedDict()  # (symbol, interval) -> (fetch time, period, history)
+        self._inflight = {}  # (symbol, interval) -> threading.Event of the running fetch
+        self._lock = threading.Lock()
+
+    def history(self, symbol: str, period='1mo', interval='1d') -> pd.DataFrame:
+        """
+        Get a ticker's history, fetching only if no fresh entry covers the period
+        :param symbol: ticker symbol
+        :type symbol: str
+        :param period: period in 1d,5d,1mo,3mo,1y,ytd,max template
+        :type period: str
+        :param interval: interval in 1m,2m,5m,30m,1h,1d template
+        :type interval: str
+        :return: history of the period
+        :rtype: pd.DataFrame
+        """
+        key = (symbol.upper(), interval)
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and self._covers(entry, period, interval):
+                    self._entries.move_to_end(key)
+                    instrumentation.count('history_cache.hit', ticker=key[0])
+                    return slice_period(entry[2], period)
+                event = self._inflight.get(key)
+                is_owner = event is None
+                if is_owner:
+                    event = self._inflight[key] = threading.Event()
+            if not is_owner:  # someone is already fetching this key, wait and re-check
+                event.wait()
+                continue
+            instrumentation.count('history_cache.miss', ticker=key[0])
+            try:
+                widest = WIDEST_PERIOD.get(interval, '1d')
+                if entry is not None and period_days(entry[1]) > period_days(widest):
+                    widest = entry[1]
+                if period_days(period) > period_days(widest):
+                    widest = period
+                history = self.fetch(symbol, widest, interval)
+                self.put(symbol, history, widest, interval)
+            finally:
+                with self._lock:
+                    del self._inflight[key]
+                event.set()
+            return slice_period(history, period)
+
+    def put(self, symbol: str, history: pd.DataFrame, period: str, interval='1d'):
+        """
+        Store a history fetched elsewhere, e.g. pushed by the watcher, it serves periods up to the given one
+        :param symbol: ticker symbol
+        :type symbol: str
+        :param history: history frame, oldest first
+        :type history: pd.DataFrame
+        :param period: period the history covers
+        :type period: str
+        :param interval: interval of the history
+        :type interval: str
+        """
+        key = (symbol.upper(), interval)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), period, history)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, symbol=None):
+        """
+        Drop cached entries
+        :param symbol: drop only this symbol's entries, everything if None
+        :type symbol: str
+        """
+        with self._lock:
+            for key in list(self._entries):
+                if symbol is None or key[0] == symbol.upper():
+                    del self._entries[key]
+
+    def _covers(self, entry, period, interval) -> bool:
+        fetched_at, fetched_period, _ = entry
+        # a replay's clock runs faster than real time, entries age with it
+        is_fresh = (time.monotonic() - fetched_at) * market_clock.get_clock().speed < self.ttl.get(interval, 60)
+        return is_fresh and period_days(period) <= period_days(fetched_period)
+
+
+CACHE = HistoryCache()
+
+
+def get_history(symbol: str, period='1mo', interval='1d') -> pd.DataFrame:
+    """
+    Ticker history through the shared cache
+    :param symbol: ticker symbol
+    :type symbol: str
+    :param period: period in 1d,5d,1mo,3mo,1y,ytd,max template
+    :type period: str
+    :param interval: interval in 1m,2m,5m,30m,1h,1d template
+    :type interval: str
+    :return: history of the period
+    :rtype: pd.DataFrame
+    """
+    return CACHE.history(symbol, period, interval)
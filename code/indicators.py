@@ -0,0 +1,261 @@
+# Indicator engine
+# Rolling indicators for a whole universe at once. Arrays are shaped (tickers, dates), oldest date first, and
+# empty bars are NaN and skipped like pandas' mean() skips them.
+import numpy as np
+import pandas as pd
+
+import instrumentation
+
+# Globals
+
+MAX_ENGINES = 4  # engines of recent dataset versions kept by get_engine
+_ENGINES = {}
+
+
+def cumulative_sums(values: np.ndarray) -> tuple:
+    """
+    Cumulative sums of values, squared values and bar counts with a leading zero column, empty bars count as 0
+    :param values: array shaped (tickers, dates)
+    :type values: np.ndarray
+    :return: (sums, squared sums, counts), each shaped (tickers, dates + 1)
+    :rtype: tuple
+    """
+    values = np.asarray(values, dtype=float)
+    is_bar = ~np.isnan(values)
+    filled = np.where(is_bar, values, 0.0)
+    pad = ((0, 0), (1, 0))
+    return (np.pad(np.cumsum(filled, axis=1), pad),
+            np.pad(np.cumsum(filled * filled, axis=1), pad),
+            np.pad(np.cumsum(is_bar, axis=1), pad))
+
+
+def window_sums(cumulative: np.ndarray, window: int) -> np.ndarray:
+    """
+    Sum of the last `window` bars at every date out of a cumulative sum, shorter at the start like get_SMA
+    :param cumulative: one of cumulative_sums' arrays
+    :type cumulative: np.ndarray
+    :param window: window length
+    :type window: int
+    :return: array shaped (tickers, dates)
+    :rtype: np.ndarray
+    """
+    diff = cumulative[:, 1:].copy()
+    diff[:, window:] -= cumulative[:, 1:-window]
+    return diff
+
+
+def rolling_sma(values: np.ndarray, windows: list, sums=None) -> dict:
+    """
+    Simple moving averages of every window from one cumulative sum pass
+    :param values: array shaped (tickers, dates)
+    :type values: np.ndarray
+    :param windows: sma windows, e.g. [20, 50, 100, 200]
+    :type windows: list
+    :param sums: precomputed cumulative_sums(values)
+    :type sums: tuple
+    :return: {window: sma array shaped like values}
+    :rtype: dict
+    """
+    total, _, count = sums or cumulative_sums(values)
+    result = {}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for window in windows:
+            result[window] = window_sums(total, window) / window_sums(count, window)
+    return result
+
+
+def rolling_std(values: np.ndarray, window: int, ddof=0, sums=None) -> np.ndarray:
+    """
+    Rolling standard deviation from the same cumulative sums
+    :param values: array shaped (tickers, dates)
+    :type values: np.ndarray
+    :param window: window length
+    :type window: int
+    :param ddof: delta degrees of freedom, 0 for Bollinger Bands, 1 for pandas' rolling std
+    :type ddof: int
+    :param sums: precomputed cumulative_sums(values)
+    :type sums: tuple
+    :return: std array shaped like values
+    :rtype: np.ndarray
+    """
+    total, squared, count = sums or cumulative_sums(values)
+    n = window_sums(count, window)
+    s = window_sums(total, window)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        variance = (window_sums(squared, window) - s * s / n) / (n - ddof)
+    return np.sqrt(np.clip(variance, 0, None))
+
+
+def ema(values: np.ndarray, span: int) -> np.ndarray:
+    """
+    Exponential moving average, alpha = 2 / (span + 1)
+    :param values: array shaped (tickers, dates)
+    :type values: np.ndarray
+    :param span: ema span
+    :type span: int
+    :return: ema array shaped like values
+    :rtype: np.ndarray
+    """
+    frame = pd.DataFrame(np.asarray(values, dtype=float).T)  # dates as rows so pandas runs every ticker at once
+    return frame.ewm(span=span, adjust=False, ignore_na=True).mean().to_numpy().T
+
+
+def true_range(high: np.ndarray, low: np.ndarray, close: np.ndarray) -> np.ndarray:
+    """
+    True range, max(high - low, |high - previous close|, |low - previous close|)
+    :return: true range array shaped like close
+    :rtype: np.ndarray
+    """
+    high, low, close = (np.asarray(values, dtype=float) for values in (high, low, close))
+    previous_close = np.empty_like(close)
+    previous_close[:, 0] = np.nan
+    previous_close[:, 1:] = close[:, :-1]
+    return np.fmax(high - low, np.fmax(np.abs(high - previous_close), np.abs(low - previous_close)))
+
+
+def atr(high: np.ndarray, low: np.ndarray, close: np.ndarray, window: int) -> np.ndarray:
+    """
+    Average true range, simple average of the true range over the window
+    :return: atr array shaped like close
+    :rtype: np.ndarray
+    """
+    return rolling_sma(true_range(high, low, close), [window])[window]
+
+
+def rolling_max(values: np.ndarray, window: int) -> np.ndarray:
+    """
+    Rolling max over the last `window` bars (shorter at the start), empty bars are skipped
+    :param values: array shaped (tickers, dates)
+    :type values: np.ndarray
+    :param window: window length
+    :type window: int
+    :return: array shaped like values
+    :rtype: np.ndarray
+    """
+    return _rolling_reduce(np.fmax, values, window)
+
+
+def rolling_min(values: np.ndarray, window: int) -> np.ndarray:
+    """
+    Rolling min over the last `window` bars (shorter at the start), empty bars are skipped
+    :param values: array shaped (tickers, dates)
+    :type values: np.ndarray
+    :param window: window length
+    :type window: int
+    :return: array shaped like values
+    :rtype: np.ndarray
+    """
+    return _rolling_reduce(np.fmin, values, window)
+
+
+def _rolling_reduce(ufunc, values, window):
+    values = np.asarray(values, dtype=float)
+    padded = np.pad(values, ((0, 0), (window - 1, 0)), constant_values=np.nan)  # NaN is ignored by fmax/fmin
+    return ufunc.reduce(np.lib.stride_tricks.sliding_window_view(padded, window, axis=1), axis=2)
+
+
+def last_sma(values: np.ndarray, window: int) -> np.ndarray:
+    """
+    SMA of the last date only, summed directly over the window so values match get_SMA
+    :param values: array shaped (tickers, dates)
+    :type values: np.ndarray
+    :param window: sma window
+    :type window: int
+    :return: sma of each ticker
+    :rtype: np.ndarray
+    """
+    recent = np.asarray(values[:, -window:], dtype=float)
+    count = np.sum(~np.isnan(recent), axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.nansum(recent, axis=1) / count
+
+
+class IndicatorEngine:
+    """
+    Cached indicators of a whole price panel.
+    Every result covers all tickers of the panel; cumulative sums of a field are computed once and shared.
+    Fields are read split adjusted, so indicators stay continuous across splits.
+    """
+
+    def __init__(self, panel):
+        """
+        :param panel: price panel
+        :type panel: data_store.PricePanel
+        """
+        self.panel = panel
+        self.version = (panel.version, panel.actions.version)
+        self._cache = {}
+
+    def _cached(self, key, compute):
+        if key not in self._cache:
+            instrumentation.count('indicators.miss')
+            with instrumentation.stage('indicators.' + key[0]):
+                self._cache[key] = compute()
+        else:
+            instrumentation.count('indicators.hit')
+        return self._cache[key]
+
+    def sums(self, field='Close') -> tuple:
+        return self._cached(('sums', field), lambda: cumulative_sums(self.panel.adjusted(field)))
+
+    def sma(self, window: int, field='Close') -> np.ndarray:
+        return self.smas([window], field)[window]
+
+    def smas(self, windows: list, field='Close') -> dict:
+        """
+        SMA series of several windows, missing windows are computed together from the shared cumulative sums
+        :return: {window: sma array shaped (tickers, dates)}
+        :rtype: dict
+        """
+        missing = [w for w in windows if ('sma', field, w) not in self._cache]
+        if missing:
+            sums = self.sums(field)
+            with instrumentation.stage('indicators.sma'):
+                for window, result in rolling_sma(None, missing, sums).items():
+                    self._cache[('sma', field, window)] = result
+        return {w: self._cache[('sma', field, w)] for w in windows}
+
+    def last_smas(self, windows: list, field='Close') -> dict:
+        """
+        SMA of the last date for several windows, same values as get_SMA
+        :return: {window: sma of each ticker}
+        :rtype: dict
+        """
+        return {w: self._cached(('last_sma', field, w), lambda w=w: last_sma(self.panel.adjusted(field), w))
+                for w in windows}
+
+    def std(self, window: int, field='Close', ddof=0) -> np.ndarray:
+        return self._cached(('std', field, window, ddof),
+                            lambda: rolling_std(None, window, ddof, self.sums(field)))
+
+    def ema(self, span: int, field='Close') -> np.ndarray:
+        return self._cached(('ema', field, span), lambda: ema(self.panel.adjusted(field), span))
+
+    def highest(self, window: int, field='High') -> np.ndarray:
+        return self._cached(('highest', field, window), lambda: rolling_max(self.panel.adjusted(field), window))
+
+    def lowest(self, window: int, field='Low') -> np.ndarray:
+        return self._cached(('lowest', field, window), lambda: rolling_min(self.panel.adjusted(field), window))
+
+    def atr(self, window: int) -> np.ndarray:
+        return self._cached(('atr', window), lambda: atr(self.panel.adjusted('High'), self.panel.adjusted('Low'),
+                                                         self.panel.adjusted('Close'), window))
+
+
+def get_engine(panel) -> IndicatorEngine:
+    """
+    Indicator engine of a panel, reused while neither the panel's dataset version nor its actions change
+    :param panel: price panel
+    :type panel: data_store.PricePanel
+    :return: engine of the panel
+    :rtype: IndicatorEngine
+    """
+    if panel.version is None:  # unsaved panel, nothing to key the cache on
+        return IndicatorEngine(panel)
+    key = (panel.version, panel.actions.version)
+    engine = _ENGINES.get(key)
+    if engine is None:
+        engine = _ENGINES[key] = IndicatorEngine(panel)
+        while len(_ENGINES) > MAX_ENGINES:
+            del _ENGINES[next(iter(_ENGINES))]
+    return engine
@@ -0,0 +1,221 @@
+# Hot path instrumentation
+# Timers and counters per stage (and per ticker), reported to the status bar and to json/csv logs, with an optional
+# cProfile capture per scan. Everything is a flag check and a no-op while disabled.
+import cProfile
+import csv
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+
+import config
+
+# Globals
+
+ENABLED = config.INSTRUMENTATION['ENABLED']
+CPROFILE = config.INSTRUMENTATION['CPROFILE']
+
+_lock = threading.Lock()
+_timers = defaultdict(lambda: [0, 0.0, 0.0])  # (stage, ticker) -> [calls, total seconds, max seconds]
+_counters = defaultdict(int)  # (name, ticker) -> count
+
+
+class _NoStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_STAGE = _NoStage()
+
+
+def enable(enabled=True, cprofile=None):
+    """
+    Turn instrumentation on or off at runtime
+    :param enabled: record timers and counters
+    :type enabled: bool
+    :param cprofile: capture a cProfile per scan, unchanged if None
+    :type cprofile: bool
+    """
+    global ENABLED, CPROFILE
+    ENABLED = enabled
+    if cprofile is not None:
+        CPROFILE = cprofile
+
+
+def record(stage: str, seconds: float, ticker=None):
+    """
+    Add a timing to a stage
+    :param stage: stage name, e.g. 'provider.download'
+    :type stage: str
+    :param seconds: elapsed time
+    :type seconds: float
+    :param ticker: ticker the time was spent on, None for universe-wide stages
+    :type ticker: str
+    """
+    with _lock:
+        timer = _timers[(stage, ticker)]
+        timer[0] += 1
+        timer[1] += seconds
+        timer[2] = max(timer[2], seconds)
+
+
+@contextmanager
+def _stage(name, ticker):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start, ticker)
+
+
+def stage(name: str, ticker=None):
+    """
+    Time a block: with instrumentation.stage('store.load'): ...
+    :param name: stage name
+    :type name: str
+    :param ticker: ticker the block works on
+    :type ticker: str
+    :return: context manager
+    """
+    if not ENABLED:
+        return _NO_STAGE
+    return _stage(name, ticker)
+
+
+def timed(name: str):
+    """
+    Decorator timing every call of a function, the first argument is recorded as the ticker if it is a str
+    :param name: stage name
+    :type name: str
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return function(*args, **kwargs)
+            ticker = args[0] if args and isinstance(args[0], str) else getattr(args[0], 'ticker', None) \
+                if args else None
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - start, ticker if isinstance(ticker, str) else None)
+        return wrapper
+    return decorator
+
+
+def count(name: str, n=1, ticker=None):
+    """
+    Increase a counter
+    :param name: counter name, e.g. 'gui.results_append'
+    :type name: str
+    :param n: amount
+    :type n: int
+    :param ticker: ticker the count belongs to
+    :type ticker: str
+    """
+    if ENABLED:
+        with _lock:
+            _counters[(name, ticker)] += n
+
+
+def reset():
+    """
+    Clear every timer and counter
+    """
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+
+
+def report(per_ticker=False) -> list:
+    """
+    Timers and counters as rows, slowest stage first
+    :param per_ticker: one row per (stage, ticker) instead of per stage
+    :type per_ticker: bool
+    :return: [{'stage', 'ticker', 'calls', 'total', 'mean', 'max'}] timers followed by [{'counter', 'ticker', 'count'}]
+    :rtype: list
+    """
+    with _lock:
+        timers = {key: list(value) for key, value in _timers.items()}
+        counters = dict(_counters)
+    merged = defaultdict(lambda: [0, 0.0, 0.0])
+    for (name, ticker), (calls, total, longest) in timers.items():
+        row = merged[(name, ticker if per_ticker else None)]
+        row[0] += calls
+        row[1] += total
+        row[2] = max(row[2], longest)
+    rows = [{'stage': name, 'ticker': ticker, 'calls': calls, 'total': total, 'mean': total / calls, 'max': longest}
+            for (name, ticker), (calls, total, longest) in merged.items()]
+    rows.sort(key=lambda row: row['total'], reverse=True)
+    merged_counters = defaultdict(int)
+    for (name, ticker), value in counters.items():
+        merged_counters[(name, ticker if per_ticker else None)] += value
+    return rows + [{'counter': name, 'ticker': ticker, 'count': value}
+                   for (name, ticker), value in merged_counters.items()]
+
+
+def summary_text(top=3) -> str:
+    """
+    One line summary of the slowest stages for the status bar
+    :param top: number of stages shown
+    :type top: int
+    :return: e.g. 'provider.download 2.31s | store.load 0.02s'
+    :rtype: str
+    """
+    timers = [row for row in report() if 'stage' in row][:top]
+    return ' | '.join(f"{row['stage']} {row['total']:.2f}s" for row in timers)
+
+
+def write_log(name: str, directory=None) -> str:
+    """
+    Write the per-ticker report to <directory>/<name>_<time>.json and .csv
+    :param name: log name, e.g. the scan's name
+    :type name: str
+    :param directory: logs directory, config.FILE_PATHS['LOGS'] if None
+    :type directory: str
+    :return: path of the json log, without extension
+    :rtype: str
+    """
+    directory = directory or config.FILE_PATHS['LOGS']
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    rows = report(per_ticker=True)
+    with open(path + '.json', 'w') as f:
+        json.dump(rows, f, indent=2)
+    with open(path + '.csv', 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['stage', 'counter', 'ticker', 'calls', 'total', 'mean', 'max',
+                                               'count'])
+        writer.writeheader()
+        writer.writerows(rows)
+    return path
+
+
+@contextmanager
+def profile(name: str, directory=None):
+    """
+    cProfile a block into <directory>/<name>_<time>.prof when CPROFILE is on
+    :param name: profile name, e.g. the scan's name
+    :type name: str
+    :param directory: logs directory, config.FILE_PATHS['LOGS'] if None
+    :type directory: str
+    """
+    if not CPROFILE:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        directory = directory or config.FILE_PATHS['LOGS']
+        os.makedirs(directory, exist_ok=True)
+        profiler.dump_stats(os.path.join(directory, f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.prof"))
@@ -0,0 +1,246 @@
+# Intraday store
+# Persisted 1m/2m/5m bars partitioned by interval and trading day:
+#   <INTRADAY_STORE>/<interval>/<YYYY-MM-DD>/<TICKER>.bin
+# Every file is a flat array of RECORD rows in time order. Appends write only the new bars at the end of the day's
+# file and range reads memory-map it and binary search the time column, so neither loads a whole file.
+# Bars of a ticker are appended in time order, so the manifest's checksum is a crc32 of its files read in day order.
+import os
+import threading
+import zlib
+
+import numpy as np
+import pandas as pd
+
+import bar_aggregator
+import config
+import coverage_manifest
+import data_store
+import history_cache
+import instrumentation
+import market_clock
+
+# Globals
+
+INTERVALS = ['1m', '2m', '5m']
+EXCHANGE_TZ = market_clock.EXCHANGE_TZ
+RECORD = np.dtype([('time', '<i8'), ('open', '<f4'), ('high', '<f4'), ('low', '<f4'), ('close', '<f4'),
+                   ('volume', '<i8')])  # time is the bar start in UTC nanoseconds
+COLUMNS = {'Open': 'open', 'High': 'high', 'Low': 'low', 'Close': 'close', 'Volume': 'volume'}
+SUFFIX = '.bin'
+
+_lock = threading.Lock()  # appends of the watcher and of read-through fetches
+
+
+def partition_path(ticker: str, interval: str, day) -> str:
+    """
+    Path of one ticker's bars of one trading day
+    :param ticker: ticker symbol
+    :type ticker: str
+    :param interval: one of INTERVALS
+    :type interval: str
+    :param day: trading day
+    :type day: datetime.date or str
+    :return: path inside config.FILE_PATHS['INTRADAY_STORE']
+    :rtype: str
+    """
+    return os.path.join(config.FILE_PATHS['INTRADAY_STORE'], interval, str(day), ticker + SUFFIX)
+
+
+def session_day(when=None):
+    """
+    Trading day of a time
+    :param when: time, naive times are exchange time, the market clock's now if None
+    :type when: datetime or pd.Timestamp
+    :rtype: datetime.date
+    """
+    return market_clock.exchange_time(market_clock.get_clock().now() if when is None else when).date()
+
+
+def _records(bars: pd.DataFrame) -> np.ndarray:
+    bars = bars[bars['Close'].notna()]
+    index = pd.DatetimeIndex(bars.index)
+    index = index.tz_localize(EXCHANGE_TZ) if index.tz is None else index
+    records = np.empty(len(bars), dtype=RECORD)
+    records['time'] = index.tz_convert('UTC').tz_localize(None).values.astype('datetime64[ns]').view('i8')
+    for column, field in COLUMNS.items():
+        if column == 'Volume':
+            records[field] = data_store.to_volume(bars[column]) if column in bars else 0
+        else:
+            records[field] = bars[column].to_numpy(dtype=float)
+    return records
+
+
+def _partition(path: str) -> np.ndarray:
+    # memory-mapped records of a file, nothing is read until indexed
+    count = os.path.getsize(path) // RECORD.itemsize if os.path.isfile(path) else 0
+    if count == 0:
+        return np.empty(0, dtype=RECORD)
+    return np.memmap(path, dtype=RECORD, mode='r', shape=(count,))
+
+
+def append(ticker: str, interval: str, bars: pd.DataFrame, complete=True, save=True) -> int:
+    """
+    Append newly fetched bars, bars that are not newer than the last stored bar are skipped
+    :param ticker: ticker symbol
+    :type ticker: str
+    :param interval: one of INTERVALS
+    :type interval: str
+    :param bars: bars indexed by time, same layout as Ticker.history with an intraday interval
+    :type bars: pd.DataFrame
+    :param complete: false if the last bar may still be forming, it is left for the next append
+    :type complete: bool
+    :param save: save the manifest, append_many saves it once for all tickers
+    :type save: bool
+    :return: number of bars written
+    :rtype: int
+    """
+    records = _records(bars if complete else bars.iloc[:-1])
+    manifest = data_store.get_manifest()
+    written = 0
+    with _lock:
+        entry = manifest.get(ticker, interval)
+        if entry is not None and entry.rows:
+            records = records[records['time'] > pd.Timestamp(entry.last).value]
+        if len(records) == 0:
+            return 0
+        days = pd.DatetimeIndex(records['time']).tz_localize('UTC').tz_convert(EXCHANGE_TZ).date
+        checksum = entry.checksum if entry is not None else 0
+        for day in pd.unique(days):
+            part = records[days == day]
+            path = partition_path(ticker, interval, day)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'ab') as f:
+                f.write(part.tobytes())
+            checksum = zlib.crc32(part.tobytes(), checksum)
+            written += len(part)
+        first = entry.first if entry is not None and entry.rows else _iso(records['time'][0])
+        rows = (entry.rows if entry is not None else 0) + written
+        fetched = market_clock.get_clock().now().timestamp()
+        entry = coverage_manifest.Coverage(first, _iso(records['time'][-1]), rows, checksum, fetched)
+        manifest.record(ticker, entry, interval)
+    instrumentation.count('intraday.appended', written, ticker=ticker)
+    if save:
+        data_store.save_manifest()
+    return written
+
+
+def append_many(histories: dict, interval: str, complete=True) -> int:
+    """
+    Append the bars of several tickers, the manifest is saved once
+    :param histories: {ticker: bars}
+    :type histories: dict
+    :param interval: one of INTERVALS
+    :type interval: str
+    :param complete: false if the last bar of every history may still be forming
+    :type complete: bool
+    :return: number of bars written
+    :rtype: int
+    """
+    written = sum(append(ticker, interval, bars, complete, save=False) for ticker, bars in histories.items())
+    if written:
+        data_store.save_manifest()
+    return written
+
+
+def _iso(nanoseconds) -> str:
+    return pd.Timestamp(int(nanoseconds), tz='UTC').tz_convert(EXCHANGE_TZ).isoformat()
+
+
+@instrumentation.timed('intraday.read')
+def read(ticker: str, interval: str, start=None, end=None) -> pd.DataFrame:
+    """
+    Stored bars of a time range, only the partitions of the range are opened and only the range is read
+    :param ticker: ticker symbol
+    :type ticker: str
+    :param interval: one of INTERVALS
+    :type interval: str
+    :param start: first bar time, naive times are exchange time, from the first stored bar if None
+    :type start: datetime or str
+    :param end: end time (exclusive), to the last stored bar if None
+    :type end: datetime or str
+    :return: bars indexed by exchange time, same layout as Ticker.history
+    :rtype: pd.DataFrame
+    """
+    directory = os.path.join(config.FILE_PATHS['INTRADAY_STORE'], interval)
+    days = sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+    start = None if start is None else market_clock.exchange_time(start)
+    end = None if end is None else market_clock.exchange_time(end)
+    parts = []
+    for day in days:
+        if (start is not None and day < str(start.date())) or (end is not None and day > str(end.date())):
+            continue
+        records = _partition(partition_path(ticker, interval, day))
+        first = 0 if start is None else np.searchsorted(records['time'], start.value, 'left')
+        last = len(records) if end is None else np.searchsorted(records['time'], end.value, 'left')
+        if last > first:
+            parts.append(np.array(records[first:last]))
+    records = np.concatenate(parts) if parts else np.empty(0, dtype=RECORD)
+    index = pd.DatetimeIndex(records['time']).tz_localize('UTC').tz_convert(EXCHANGE_TZ).rename('Datetime')
+    return pd.DataFrame({column: records[field].astype(float) if column != 'Volume' else records[field]
+                         for column, field in COLUMNS.items()}, index=index)
+
+
+def session_bars(ticker: str, interval: str, day=None, fetch=True) -> pd.DataFrame:
+    """
+    Bars of one trading day, read from the store first.
+    Today's bars are fetched (and stored) when the store does not have the session's first bar yet.
+    :param ticker: ticker symbol
+    :type ticker: str
+    :param interval: one of INTERVALS
+    :type interval: str
+    :param day: trading day, today if None
+    :type day: datetime.date or str
+    :param fetch: fetch today's bars if the store is missing the session open
+    :type fetch: bool
+    :return: bars indexed by exchange time
+    :rtype: pd.DataFrame
+    """
+    day = pd.Timestamp(day or session_day()).date()
+    start = pd.Timestamp(day)
+    bars = read(ticker, interval, start, start + pd.Timedelta(days=1))
+    if fetch and day == session_day() and not _has_open(bars):
+        history = history_cache.get_history(ticker, period='1d', interval=interval)
+        append(ticker, interval, history, complete=False)
+        bars = read(ticker, interval, start, start + pd.Timedelta(days=1))
+    return bars
+
+
+def _has_open(bars: pd.DataFrame) -> bool:
+    return len(bars) > 0 and bars.index[0].hour * 60 + bars.index[0].minute == bar_aggregator.SESSION_OPEN
+
+
+def first_candle(ticker: str, interval: str, day=None, fetch=True):
+    """
+    Close - open of the session's first candle
+    :param ticker: ticker symbol
+    :type ticker: str
+    :param interval: one of INTERVALS
+    :type interval: str
+    :param day: trading day, today if None
+    :type day: datetime.date or str
+    :param fetch: fetch today's bars if the store is missing the session open
+    :type fetch: bool
+    :return: first candle, None if the session's first bar is not known
+    :rtype: float or None
+    """
+    bars = session_bars(ticker, interval, day, fetch)
+    if not _has_open(bars):
+        return None
+    return float(bars['Close'].iloc[0] - bars['Open'].iloc[0])
+
+
+def session_open(ticker: str, day=None):
+    """
+    Opening price of a session from the stored bars of any interval, nothing is fetched
+    :param ticker: ticker symbol
+    :type ticker: str
+    :param day: trading day, today if None
+    :type day: datetime.date or str
+    :return: open of the session's first bar, None if not stored
+    :rtype: float or None
+    """
+    for interval in INTERVALS:
+        bars = session_bars(ticker, interval, day, fetch=False)
+        if _has_open(bars):
+            return float(bars['Open'].iloc[0])
+    return None
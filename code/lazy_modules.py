@@ -0,0 +1,28 @@
+# Lazy imports
+# Heavy modules (yfinance, plotly, the app modules main.py loads behind the splash) are imported on first attribute
+# access instead of at startup:
+#   yf = lazy_modules.lazy_import('yfinance')
+import importlib
+import importlib.util
+import sys
+
+
+def lazy_import(name: str):
+    """
+    Import a module lazily, the module runs the first time one of its attributes is used
+    :param name: module name
+    :type name: str
+    :return: the module, or a lazy module that loads itself on first use
+    :rtype: module
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None or not hasattr(spec.loader, 'exec_module'):  # e.g. an old frozen importer, import it now
+        return importlib.import_module(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
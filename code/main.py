@@ -1,61 +1,62 @@
-import configparser
-import glob
+import time
+
+START_TIME = time.perf_counter()  # before the heavy imports, startup is measured from here
+
+import argparse
+import importlib.util
 import os.path
 import sys
 
-import pandas as pd
 import platform
 import traceback
-import yfinance as yf
 from PyQt5 import QtWidgets, uic, QtGui, QtCore, Qt
-from datetime import datetime
 
 import config
-import yf_functions as yf_func
+import instrumentation
+import lazy_modules
+from workers import ScanWorker
+
+# modules that import numpy and pandas, loaded while the splash screen is up instead of before it shows
+data_store = lazy_modules.lazy_import('data_store')
+indicators = lazy_modules.lazy_import('indicators')
+providers = lazy_modules.lazy_import('providers')
+ranking_system = lazy_modules.lazy_import('ranking_system')
+scans = lazy_modules.lazy_import('scans')
+ttm_squeeze = lazy_modules.lazy_import('ttm_squeeze')
+yf_func = lazy_modules.lazy_import('yf_functions')
 
 ## ==> GLOBALS
-counter = 0
+STARTUP_TARGET = 2.0  # seconds from launch until the main window is usable
 
 
 # Global methods:
-def set_ini_date(date=None):
-    """
-    Update ini file 1d date sections
-    :param date: date to update, if None enter the current date
-    :type date: str
-    """
-    if date == None:
-        date = datetime.today().strftime('%Y-%d-%m')
-    cp = configparser.ConfigParser()
-    cp.read(config.FILE_PATHS['INI'])
-    cp.set(config.INI_SECTIONS['DATA'], config.INI_DATA['1D'], date)
-    with open(config.FILE_PATHS['INI'], 'w') as configfile:
-        cp.write(configfile)
-
-
-def get_ini_date() -> str:
+def load_ui(ui_path: str, widget: QtWidgets.QWidget):
     """
-    get date from ini file
-    :return: date in %y-%d-%m format
-    :rtype: str
+    uic.loadUi that parses the .ui file once: it is compiled to a python module in config.FILE_PATHS['UI_CACHE']
+    and the compiled module is reused until the .ui file changes
+    :param ui_path: .ui file path
+    :type ui_path: str
+    :param widget: widget to set up, gets the ui's children as attributes like with uic.loadUi
+    :type widget: QtWidgets.QWidget
     """
-    cp = configparser.ConfigParser()
-    cp.read(config.FILE_PATHS['INI'])
-    return cp.get(config.INI_SECTIONS['DATA'], config.INI_DATA['1D'])
-
-
-def dir_is_empty(dir: str) -> bool:
-    """
-    checks if a directory is empty
-    :param dir: dir path with // in the end
-    :type dir: str
-    :return: true if empty, false if not
-    :rtype: bool
-    """
-    files = glob.glob(dir + '*')
-    if len(files) >= 1:
-        return False
-    return True
+    name = os.path.splitext(os.path.basename(ui_path))[0] + '_ui'
+    compiled_path = os.path.join(config.FILE_PATHS['UI_CACHE'], name + '.py')
+    try:
+        if not os.path.exists(compiled_path) or os.path.getmtime(compiled_path) < os.path.getmtime(ui_path):
+            os.makedirs(config.FILE_PATHS['UI_CACHE'], exist_ok=True)
+            with open(compiled_path + '.tmp', 'w', encoding='utf-8') as f:
+                uic.compileUi(ui_path, f)
+            os.replace(compiled_path + '.tmp', compiled_path)
+        spec = importlib.util.spec_from_file_location(name, compiled_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        form = next(getattr(module, attr) for attr in dir(module) if attr.startswith('Ui_'))()
+    except Exception as e:  # read-only install or a broken cache, parse the .ui file
+        print(e)
+        uic.loadUi(ui_path, widget)
+        return
+    form.setupUi(widget)
+    widget.__dict__.update(vars(form))  # children become the widget's attributes
 
 
 class MainWindow(QtWidgets.QMainWindow):
@@ -68,7 +69,7 @@ class MainWindow(QtWidgets.QMainWindow):
         init - initialize on dialog call.
         """
         super(MainWindow, self).__init__()
-        uic.loadUi(config.FILE_PATHS['MAIN_UI'], self)
+        load_ui(config.FILE_PATHS['MAIN_UI'], self)
         # On initialization:
         self.setWindowFlag(QtCore.Qt.FramelessWindowHint)  # Remove titlebar
         self.setAttribute(QtCore.Qt.WA_TranslucentBackground)  # Remove titlebar ^^ Works!
@@ -77,8 +78,12 @@ class MainWindow(QtWidgets.QMainWindow):
         self.consolidation_bar.hide()
         self.short_long_label.hide()
         self.short_long_label_2.hide()
+        self.comboBox.addItems(ttm_squeeze.SHOW_OPTIONS)
         # Global Attributes:
         self.data_1d_exists = False
+        self.scan_pool = QtCore.QThreadPool()
+        self.scan_pool.setMaxThreadCount(1)  # one scan at a time, further scans queue behind it
+        self.scan_workers = []  # running and queued scans
 
         # Triggers and connections:
         self.actionDay_Trading_Momentum.triggered.connect(self.momentum_page_open)
@@ -86,6 +91,7 @@ class MainWindow(QtWidgets.QMainWindow):
         self.actionConsolidation_Patterns.triggered.connect(self.consolidation_page_open)
         self.actionManual_Risk_Calculator.triggered.connect(self.manual_risk_open)
         self.actionExit.triggered.connect(self.close)
+        self.analyze_button.clicked.connect(self.ttm_scan)
         self.analyze_button_2.clicked.connect(self.consolidation_scan)
         self.analyze_button_3.clicked.connect(self.momentum_ticker)
         self.riskcalculate_button.clicked.connect(self.manual_risk)
@@ -100,7 +106,7 @@ class MainWindow(QtWidgets.QMainWindow):
 
     def consolidation_scan(self):
         """
-        On 'analiyze_button' press - scans for consolidation patterns in ini tickers.
+        On 'analiyze_button' press - scans for consolidation patterns in ini tickers on a background worker.
         :return:
         :rtype:
         """
@@ -108,62 +114,70 @@ class MainWindow(QtWidgets.QMainWindow):
         percentage = float(self.percentage_text.text())  # get percentage from textbox
         lookback = int(self.lookback_text.text())  # get lookback (days to look for consolidation) from textbox
 
+        worker = ScanWorker(scans.consolidation_scan, tickers, percentage=percentage, look_back_data=lookback)
+        worker.signals.started.connect(self.consolidation_scan_started)
+        worker.signals.progress.connect(self.consolidation_bar.setValue)
+        worker.signals.result.connect(self.result_appender(self.results_edit_2))
+        self.start_scan(worker)
+
+    def consolidation_scan_started(self):
+        """
+        Reset the consolidation page once its scan leaves the queue
+        :return:
+        :rtype:
+        """
         self.consolidation_bar.show()  # show the bar
         self.consolidation_bar.setValue(0)  # start progress bar from zero
-        total_for_bar = 100 / len(tickers)  # each ticker is a % of the total 100%
-        counter = 1
-        date = datetime.today().strftime('%Y-%d-%m')  # current date
-        try:
-            if not (get_ini_date() == date) or dir_is_empty(
-                    config.FILE_PATHS['1D_DATA']):  # not(date) or empty | is material implication
-                self.download_updated_data_to_csv()  # download tickers data to csv at code/data/1D
-                set_ini_date(date)  # set ini date to current date for future reference
-            self.results_edit_2.setText('')  # clears text edit.
-            for ticker in tickers:
-                df = pd.read_csv(config.FILE_PATHS['1D_DATA'] + ticker + '.csv')  # read from csv file to df
-                if yf_func.is_consolidating(df, percentage=percentage, look_back_data=lookback):
-                    self.results_edit_2.append(f'{ticker} is consolidating')
-                if yf_func.is_breaking_consolidation(df, percentage=percentage, look_back_data=lookback):
-                    self.results_edit_2.append(f'{ticker} is breaking out of consolidation!')
-                self.consolidation_bar.setValue(int(total_for_bar * counter))  # update bar
-                counter += 1
-        except Exception as e:
-            print(e)
-            traceback.print_exc()
+        self.results_edit_2.setText('')  # clears text edit.
 
-    def download_updated_data_to_csv(self):
+    def start_scan(self, worker: ScanWorker):
         """
-        download updated tickers data using yfinance.download threaded.
+        Queue a scan worker on the scan pool
+        :param worker: worker to run
+        :type worker: ScanWorker
         :return:
         :rtype:
         """
-        ticker_list = yf_func.load_tickers_from_ini()  # get tickers list.
-        data = yf.download(
-            tickers=ticker_list,
-            period='1y',
-            interval='1d',
-            group_by='ticker',
-            auto_adjust=False,
-            prepost=False,
-            threads=True,
-            proxy=None
-        )
-        data = data.T  # switch columns and rows for df
-        if not dir_is_empty(config.FILE_PATHS['1D_DATA']):  # if the directory is not empty, delete all csv files.
-            files = glob.glob(config.FILE_PATHS['1D_DATA'] + '\*.csv')
-            for f in files:
-                os.remove(f)
-        try:  # verify that the directory exists, if not, create it.
-            os.makedirs(config.FILE_PATHS['1D_DATA'])
-        except Exception as e:
-            traceback.print_exc()
+        self.scan_workers.append(worker)
+        worker.signals.finished.connect(lambda: self.scan_workers.remove(worker))
+        worker.signals.finished.connect(lambda: self.report_timings(worker.scan.__name__))
+        self.scan_pool.start(worker)
 
-        for ticker in ticker_list:  # insert df data to csv files.
-            f = open(config.FILE_PATHS['1D_DATA'] + ticker + '.csv', 'w')
-            data.loc[(ticker,),].T.to_csv(config.FILE_PATHS['1D_DATA'] + ticker + '.csv', sep=',', encoding='utf-8')
+    def result_appender(self, text_edit):
+        """
+        Slot appending scan result lines to a text edit, repaints are timed as the 'gui.append' stage
+        :param text_edit: results text edit
+        :type text_edit: QtWidgets.QTextEdit
+        :return: slot taking a result line
+        :rtype: function
+        """
+        def append(line: str):
+            with instrumentation.stage('gui.append'):
+                text_edit.append(line)
+        return append
 
-        set_ini_date()  # set the current day to ini file
-        self.data_1d_exists = True  # not used...
+    def report_timings(self, scan_name: str):
+        """
+        Show the slowest stages of a finished scan in the status bar and log its timings to config.FILE_PATHS['LOGS']
+        :param scan_name: name of the finished scan
+        :type scan_name: str
+        :return:
+        :rtype:
+        """
+        if not instrumentation.ENABLED:
+            return
+        self.statusbar.showMessage(f'{scan_name}: {instrumentation.summary_text()}')
+        instrumentation.write_log(scan_name)
+        instrumentation.reset()
+
+    def cancel_scans(self):
+        """
+        Cancel the running scan and every queued scan
+        :return:
+        :rtype:
+        """
+        for worker in self.scan_workers:
+            worker.cancel()
 
     def ttm_page_open(self):
         """
@@ -173,6 +187,18 @@ class MainWindow(QtWidgets.QMainWindow):
         """
         self.stackedWidget.setCurrentIndex(0)
 
+    def ttm_scan(self):
+        """
+        On 'analyze_button' press - scans ini tickers for TTM Squeezes, filtered by the combo box choice.
+        :return:
+        :rtype:
+        """
+        tickers = yf_func.load_tickers_from_ini()  # load tickers from ini
+        worker = ScanWorker(scans.ttm_squeeze_scan, tickers, show=self.comboBox.currentText())
+        worker.signals.started.connect(lambda: self.results_edit.setText(''))
+        worker.signals.result.connect(self.result_appender(self.results_edit))
+        self.start_scan(worker)
+
     def momentum_page_open(self):
         """
         change stackedWidget to momentum page
@@ -220,32 +246,58 @@ class MainWindow(QtWidgets.QMainWindow):
         :return:
         :rtype:
         """
-        self.results_edit_3.setText('')
         try:
-            risk_analysis = yf_func.risk_analysis(yf.Ticker(self.ticker_text.text()), int(self.risk_text.text()))
-            risk_answer = risk_analysis
-            if not yf_func.trading_day_started():
-                self.results_edit_3.append(
-                    "Risk candle is based on GAP since data on the first candle of the day is unavailable.")
-            self.results_edit_3.append(yf_func.dumb_risk_analysis_tostring(risk_answer))
-            df = pd.read_csv(config.FILE_PATHS['1D_DATA'] + self.ticker_text.text() + '.csv')
-            sma = [20, 50, 100, 200]
-            for i in sma:
-                self.results_edit_3.append(f'SMA {str(i)}: {yf_func.get_SMA(df, i)}')
-            self.results_edit_3.append(f'Last day of trading change: {yf_func.get_last_day_percentage(df)}%')
-
-            if risk_analysis['SHORT/LONG'] == 'LONG':
-                self.short_long_label.setStyleSheet('background-color: rgb(24, 124, 41)')
-                self.short_long_label.setText('Long')
-                self.short_long_label.show()
-            else:
-                self.short_long_label.setStyleSheet('background-color: rgb(193, 44, 44)')
-                self.short_long_label.setText('Short')
-                self.short_long_label.show()
-
+            worker = ScanWorker(scans.momentum_scan, self.ticker_text.text(), int(self.risk_text.text()))
         except Exception as e:
             print(e)
             traceback.print_exc()
+            return
+        worker.signals.started.connect(lambda: self.results_edit_3.setText(''))
+        worker.signals.result.connect(self.result_appender(self.results_edit_3))
+        worker.signals.done.connect(self.momentum_ticker_done)
+        self.start_scan(worker)
+
+    def momentum_ticker_done(self, risk_analysis: dict):
+        """
+        Show the Long/Short label of a finished momentum scan
+        :param risk_analysis: risk_dict returned by the scan
+        :type risk_analysis: dict
+        :return:
+        :rtype:
+        """
+        if risk_analysis['SHORT/LONG'] == 'LONG':
+            self.short_long_label.setStyleSheet('background-color: rgb(24, 124, 41)')
+            self.short_long_label.setText('Long')
+            self.short_long_label.show()
+        else:
+            self.short_long_label.setStyleSheet('background-color: rgb(193, 44, 44)')
+            self.short_long_label.setText('Short')
+            self.short_long_label.show()
+
+    def keyPressEvent(self, event):
+        """
+        Escape cancels running and queued scans
+        :param event: key event
+        :type event: event
+        :return:
+        :rtype:
+        """
+        if event.key() == QtCore.Qt.Key_Escape:
+            self.cancel_scans()
+        else:
+            super(MainWindow, self).keyPressEvent(event)
+
+    def closeEvent(self, event):
+        """
+        Stop scans before closing
+        :param event: close event
+        :type event: event
+        :return:
+        :rtype:
+        """
+        self.cancel_scans()
+        self.scan_pool.waitForDone()
+        super(MainWindow, self).closeEvent(event)
 
     def center(self):
         """
@@ -286,12 +338,14 @@ class SplashScreen(QtWidgets.QMainWindow):
     """
     Splash Screen window dialog, borderless
     """
-    def __init__(self):
+    def __init__(self, check_startup=False):
         """
         On initialization of Splash Screen
+        :param check_startup: quit once the main window is usable, with exit status 1 if STARTUP_TARGET was missed
+        :type check_startup: bool
         """
         QtWidgets.QMainWindow.__init__(self)
-        uic.loadUi(config.FILE_PATHS['SPLASH_UI'], self)
+        load_ui(config.FILE_PATHS['SPLASH_UI'], self)
 
         ## REMOVE TITLE BAR
         self.setWindowFlag(QtCore.Qt.FramelessWindowHint)
@@ -299,37 +353,83 @@ class SplashScreen(QtWidgets.QMainWindow):
         # Center
         self.oldPos = self.pos()
 
+        ## WARM-UP STEPS, one per timer tick so the splash repaints between them
+        self.steps = [("<strong>LOADING</strong> DATA STORE", self.load_store),
+                      ("<strong>PRIMING</strong> INDICATORS", self.prime_indicators),
+                      ("<strong>LOADING</strong> USER INTERFACE", self.open_main_window)]
+        self.step = 0
+        self.panel = None
+        self.check_startup = check_startup
+
         ## QTIMER ==> START
         self.timer = QtCore.QTimer()
         self.timer.timeout.connect(self.progress)
-        # TIMER IN MILLISECONDS
-        self.timer.start(10)
+        self.timer.start(0)
 
-        # CHANGE DESCRIPTION
-        self.timer.singleShot(1500, lambda: self.label_description.setText("<strong>LOADING</strong> FUNCTIONS"))
-        self.timer.singleShot(3000,
-                              lambda: self.label_description.setText("<strong>LOADING</strong> USER INTERFACE"))
         # Initial Text
-        self.label_description.setText("<strong>Stock Finding</strong> Algorithms")
+        self.progressBar.setValue(0)
+        self.label_description.setText(self.steps[0][0])
         ## SHOW ==> MAIN WINDOW
         self.show()
 
     ## ==> APP FUNCTIONS
     def progress(self):
-        global counter
-        # SET VALUE TO PROGRESS BAR
-        self.progressBar.setValue(counter)
-
-        # CLOSE SPLASH SCREE AND OPEN APP
-        if counter > 100:
+        """
+        Run the next warm-up step and show the real progress
+        :return:
+        :rtype:
+        """
+        text, step = self.steps[self.step]
+        try:
+            step()
+        except Exception as e:  # a warm-up failure only costs speed, the scans load what they need
+            print(e)
+            traceback.print_exc()
+        self.step += 1
+        self.progressBar.setValue(int(100 * self.step / len(self.steps)))
+        if self.step == len(self.steps):
             self.timer.stop()
-            # SHOW MAIN WINDOW
-            self.main = MainWindow()
-            self.main.show()
-            # CLOSE SPLASH SCREEN
-            self.close()
+        else:
+            self.label_description.setText(self.steps[self.step][0])
+
+    def load_store(self):
+        """
+        Memory-map the daily store, priming the indicators pages it in for the first scan
+        :return:
+        :rtype:
+        """
+        if data_store.store_exists():
+            self.panel = data_store.load_panel()
+
+    def prime_indicators(self):
+        """
+        Compute the indicators every scan starts with, cached until the store changes
+        :return:
+        :rtype:
+        """
+        if self.panel is not None:
+            engine = indicators.get_engine(self.panel)
+            engine.sums()
+            engine.last_smas(list(ranking_system.SMA_WEIGHTS))
 
-        counter += 1
+    def open_main_window(self):
+        """
+        Show the main window, close the splash screen and report the startup time
+        :return:
+        :rtype:
+        """
+        self.main = MainWindow()
+        self.main.show()
+        self.close()
+        self.panel = None  # the indicator engine keeps what the scans reuse
+        startup = time.perf_counter() - START_TIME
+        instrumentation.record('startup', startup)
+        self.main.statusbar.showMessage(f'Ready in {startup:.2f}s')
+        if startup > STARTUP_TARGET:
+            print(f'Startup took {startup:.2f}s, target is {STARTUP_TARGET:.2f}s')
+        if self.check_startup:
+            print(f'Startup took {startup:.2f}s')
+            QtWidgets.QApplication.exit(1 if startup > STARTUP_TARGET else 0)
 
     def mousePressEvent(self, event):
         self.oldPos = event.globalPos()
@@ -341,8 +441,19 @@ class SplashScreen(QtWidgets.QMainWindow):
 
 
 if __name__ == "__main__":
-    app = QtWidgets.QApplication(sys.argv)
-    win = SplashScreen()
+    parser = argparse.ArgumentParser(prog='Stock-Finder')
+    parser.add_argument('--replay', metavar='DIR', help='run the whole app on the recordings in DIR, no network')
+    parser.add_argument('--start', help='recorded exchange time the replay starts at, e.g. "2022-02-01 09:25"')
+    parser.add_argument('--speed', type=float, help='market seconds per second, providers.REPLAY_SPEED by default')
+    parser.add_argument('--check-startup', action='store_true',
+                        help=f'quit once the window is usable, exit status 1 if it took over {STARTUP_TARGET}s')
+    args, qt_args = parser.parse_known_args()
+    if args.replay:  # before the splash screen loads the store, the replay keeps its own stores
+        if not args.start:
+            parser.error('--replay needs --start')
+        providers.start_replay(args.replay, args.start, args.speed or providers.REPLAY_SPEED)
+    app = QtWidgets.QApplication(sys.argv[:1] + qt_args)
+    win = SplashScreen(args.check_startup)
     win.show()
     win.setFocus()
     sys.exit(app.exec_())
@@ -0,0 +1,217 @@
+# Market clock
+# Every "now" and "today" of the app comes from the current clock instead of the system time read at import, so a GUI
+# left running follows the session and tests and replays control the time:
+#   market_clock.set_clock(market_clock.ReplayClock('2022-02-01 09:30', speed=100))
+# Times are exchange times. The calendar follows the NYSE rules: weekends, holidays and 13:00 early closes.
+import functools
+import time
+
+import pandas as pd
+from dateutil.relativedelta import TH
+from pandas.tseries.holiday import AbstractHolidayCalendar, GoodFriday, Holiday, USLaborDay, \
+    USMartinLutherKingJr, USMemorialDay, USPresidentsDay, USThanksgivingDay, nearest_workday, sunday_to_monday
+from pandas.tseries.offsets import DateOffset
+
+# Globals
+
+EXCHANGE_TZ = 'America/New_York'
+OPEN = pd.Timedelta(hours=9, minutes=30)  # after midnight, exchange time
+CLOSE = pd.Timedelta(hours=16)
+EARLY_CLOSE = pd.Timedelta(hours=13)
+
+
+class ExchangeHolidays(AbstractHolidayCalendar):
+    """
+    Days the exchange is closed
+    """
+    rules = [
+        Holiday('New Years Day', month=1, day=1, observance=sunday_to_monday),  # a Saturday is not made up on Friday
+        USMartinLutherKingJr,
+        USPresidentsDay,
+        GoodFriday,
+        USMemorialDay,
+        Holiday('Juneteenth', month=6, day=19, start_date='2022-01-01', observance=nearest_workday),
+        Holiday('Independence Day', month=7, day=4, observance=nearest_workday),
+        USLaborDay,
+        USThanksgivingDay,
+        Holiday('Christmas', month=12, day=25, observance=nearest_workday),
+    ]
+
+
+class ExchangeEarlyCloses(AbstractHolidayCalendar):
+    """
+    Days the exchange closes at EARLY_CLOSE
+    """
+    rules = [
+        Holiday('Independence Day Eve', month=7, day=3, days_of_week=(0, 1, 2, 3)),
+        Holiday('Day After Thanksgiving', month=11, day=1, offset=[DateOffset(weekday=TH(4)), DateOffset(days=1)]),
+        Holiday('Christmas Eve', month=12, day=24, days_of_week=(0, 1, 2, 3)),
+    ]
+
+
+@functools.lru_cache(maxsize=None)
+def _calendar(year: int) -> tuple:
+    # (holidays, early closes) of a year, both padded by a week so observed days across new year are included
+    start, end = pd.Timestamp(year - 1, 12, 24), pd.Timestamp(year + 1, 1, 7)
+    return (frozenset(ExchangeHolidays().holidays(start, end).date),
+            frozenset(ExchangeEarlyCloses().holidays(start, end).date))
+
+
+def _day(day):
+    return get_clock().today() if day is None else pd.Timestamp(day).date()
+
+
+def is_trading_day(day=None) -> bool:
+    """
+    Checks if the exchange trades on a day
+    :param day: date, today if None
+    :type day: datetime.date or str
+    :rtype: bool
+    """
+    day = _day(day)
+    return day.weekday() < 5 and day not in _calendar(day.year)[0]
+
+
+def session_hours(day=None):
+    """
+    Open and close of a session
+    :param day: date, today if None
+    :type day: datetime.date or str
+    :return: (open, close) in exchange time, None if the exchange does not trade on the day
+    :rtype: tuple or None
+    """
+    day = _day(day)
+    if not is_trading_day(day):
+        return None
+    midnight = pd.Timestamp(day).tz_localize(EXCHANGE_TZ)
+    return midnight + OPEN, midnight + (EARLY_CLOSE if day in _calendar(day.year)[1] else CLOSE)
+
+
+def previous_session(day=None):
+    """
+    Last trading day before a day
+    :param day: date, today if None
+    :type day: datetime.date or str
+    :rtype: datetime.date
+    """
+    day = pd.Timestamp(_day(day)) - pd.Timedelta(days=1)
+    while not is_trading_day(day):
+        day -= pd.Timedelta(days=1)
+    return day.date()
+
+
+class MarketClock:
+    """
+    System time in exchange time
+    """
+    speed = 1.0  # market seconds per real second
+
+    def now(self) -> pd.Timestamp:
+        """
+        Current exchange time
+        :rtype: pd.Timestamp
+        """
+        return pd.Timestamp.now(tz=EXCHANGE_TZ)
+
+    def today(self):
+        """
+        Current exchange date
+        :rtype: datetime.date
+        """
+        return self.now().date()
+
+    def is_open(self) -> bool:
+        """
+        Checks if the regular session is trading now
+        :rtype: bool
+        """
+        now = self.now()
+        hours = session_hours(now.date())
+        return hours is not None and hours[0] <= now < hours[1]
+
+    def session_started(self) -> bool:
+        """
+        Checks if today is a trading day and its session has opened, i.e. today's first candle exists
+        :rtype: bool
+        """
+        now = self.now()
+        hours = session_hours(now.date())
+        return hours is not None and now >= hours[0]
+
+    def session_ended(self) -> bool:
+        """
+        Checks if today is a trading day and its session has closed, i.e. today's daily bar is complete
+        :rtype: bool
+        """
+        now = self.now()
+        hours = session_hours(now.date())
+        return hours is not None and now >= hours[1]
+
+
+class FixedClock(MarketClock):
+    """
+    Clock that only moves when told to, for tests
+    """
+
+    def __init__(self, when):
+        """
+        :param when: exchange time, naive times are exchange time
+        :type when: datetime or str
+        """
+        self.when = exchange_time(when)
+
+    def now(self) -> pd.Timestamp:
+        return self.when
+
+    def advance(self, seconds: float):
+        self.when += pd.Timedelta(seconds=seconds)
+
+
+class ReplayClock(MarketClock):
+    """
+    Clock of a replay: starts at a recorded time and runs `speed` times faster than real time
+    """
+
+    def __init__(self, start, speed=1.0):
+        """
+        :param start: exchange time the replay starts at, naive times are exchange time
+        :type start: datetime or str
+        :param speed: market seconds per real second, e.g. 100 replays a session in under 4 minutes
+        :type speed: float
+        """
+        self.start = exchange_time(start)
+        self.speed = float(speed)
+        self.started_at = time.monotonic()
+
+    def now(self) -> pd.Timestamp:
+        return self.start + pd.Timedelta(seconds=(time.monotonic() - self.started_at) * self.speed)
+
+
+def exchange_time(when) -> pd.Timestamp:
+    """
+    A time in exchange time
+    :param when: time, naive times are exchange time
+    :type when: datetime or str or pd.Timestamp
+    :rtype: pd.Timestamp
+    """
+    when = pd.Timestamp(when)
+    return when.tz_localize(EXCHANGE_TZ) if when.tz is None else when.tz_convert(EXCHANGE_TZ)
+
+
+# Current clock
+
+_CLOCK = MarketClock()
+
+
+def get_clock() -> MarketClock:
+    return _CLOCK
+
+
+def set_clock(clock=None):
+    """
+    Replace the clock every "now" of the app comes from
+    :param clock: new clock, the system time if None
+    :type clock: MarketClock
+    """
+    global _CLOCK
+    _CLOCK = clock or MarketClock()
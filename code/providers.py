@@ -0,0 +1,228 @@
+# Market data providers
+# Every network read goes through the current provider, so scans and load tests can run on recorded data with no
+# network or rate limits:
+#   providers.set_provider(providers.ReplayProvider('recordings', speed=60, start='2022-02-01 09:30'))
+# or the whole app replays a recorded day, the market clock included:
+#   providers.start_replay('recordings', '2022-02-01 09:25', speed=100)
+import abc
+import os
+
+import pandas as pd
+import config
+import history_cache
+import instrumentation
+import lazy_modules
+import market_clock
+
+yf = lazy_modules.lazy_import('yfinance')  # loaded on the first network read
+
+# Globals
+
+REPLAY_SPEED = 100.0  # market seconds per real second, a session replays in under 4 minutes
+REPLAY_STORES = ['1D_STORE', 'INTRADAY_STORE']  # config.FILE_PATHS kept inside the recordings during a replay
+ROLL_UP = {'Open': 'first', 'High': 'max', 'Low': 'min', 'Close': 'last', 'Volume': 'sum'}
+
+
+class MarketDataProvider(abc.ABC):
+    """
+    Interface of a market data source, a provider missing a method cannot be created
+    """
+
+    @abc.abstractmethod
+    def history(self, symbol: str, period='1mo', interval='1d') -> pd.DataFrame:
+        """
+        History of one ticker, same layout as yf.Ticker.history
+        :param symbol: ticker symbol
+        :type symbol: str
+        :param period: period in 1d,5d,1mo,3mo,1y,ytd,max template
+        :type period: str
+        :param interval: interval in 1m,2m,5m,30m,1h,1d template
+        :type interval: str
+        :return: history, oldest first
+        :rtype: pd.DataFrame
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def download(self, tickers: list, period=None, interval='1d', start=None, end=None) -> pd.DataFrame:
+        """
+        Batched history of several tickers, same layout as
+        yf.download(group_by='ticker', auto_adjust=False, actions=True)
+        :param tickers: ticker symbols
+        :type tickers: list
+        :param period: period in 1d,5d,1mo,3mo,1y,ytd,max template, ignored if start is given
+        :type period: str
+        :param interval: interval in 1m,2m,5m,30m,1h,1d template
+        :type interval: str
+        :param start: first date
+        :type start: datetime or str
+        :param end: end date (exclusive)
+        :type end: datetime or str
+        :return: dataframe with (ticker, field) columns
+        :rtype: pd.DataFrame
+        """
+        raise NotImplementedError
+
+
+class YFinanceProvider(MarketDataProvider):
+    """
+    Yahoo Finance through yfinance
+    """
+
+    def history(self, symbol: str, period='1mo', interval='1d') -> pd.DataFrame:
+        with instrumentation.stage('provider.history', symbol):
+            return yf.Ticker(symbol).history(period=period, interval=interval)
+
+    def download(self, tickers: list, period=None, interval='1d', start=None, end=None) -> pd.DataFrame:
+        instrumentation.count('provider.downloaded_tickers', len(tickers))
+        with instrumentation.stage('provider.download'):
+            data = yf.download(tickers=list(tickers), period=period, start=start, end=end, interval=interval,
+                               group_by='ticker', auto_adjust=False, actions=True, prepost=False, threads=True,
+                               proxy=None)
+        if not isinstance(data.columns, pd.MultiIndex):  # yfinance drops the ticker level for a single ticker
+            data = pd.concat({tickers[0]: data}, axis=1)
+        return data
+
+
+class ReplayProvider(MarketDataProvider):
+    """
+    Recorded bars from local files, <directory>/<interval>/<TICKER>.csv (see record).
+    With a speed, bars are served as a replay: the replay starts at `start` and its clock runs `speed` times faster
+    than real time, bars later than the replay clock are not served yet.
+    """
+
+    def __init__(self, directory: str, speed=None, start=None, clock=None):
+        """
+        :param directory: recordings directory
+        :type directory: str
+        :param speed: replay speed, e.g. 60 replays a minute every second, None serves all recorded bars
+        :type speed: float
+        :param start: recorded time the replay starts at, naive times are exchange time
+        :type start: datetime or str
+        :param clock: replay clock, instead of speed and start
+        :type clock: market_clock.MarketClock
+        """
+        self.directory = directory
+        if clock is None and speed is not None and start is not None:
+            clock = market_clock.ReplayClock(start, speed)
+        self.clock = clock
+        self._frames = {}  # (symbol, interval) -> recorded frame
+
+    def now(self):
+        """
+        Current replay time, None when not replaying
+        :rtype: pd.Timestamp or None
+        """
+        return None if self.clock is None else self.clock.now()
+
+    def recorded(self, symbol: str, interval='1d') -> pd.DataFrame:
+        """
+        Every recorded bar of a ticker, loaded once.
+        Minute intervals that were not recorded are rolled up from the recorded 1m bars.
+        :rtype: pd.DataFrame
+        """
+        key = (symbol, interval)
+        path = os.path.join(self.directory, interval, symbol + '.csv')
+        if key not in self._frames and interval not in ('1m', '1d') and interval.endswith('m') \
+                and not os.path.isfile(path):
+            minutes = self.recorded(symbol, '1m')
+            frame = minutes.resample(interval[:-1] + 'min').agg({column: how for column, how in ROLL_UP.items()
+                                                                 if column in minutes})
+            self._frames[key] = frame[frame['Close'].notna()]
+        if key not in self._frames:
+            frame = pd.read_csv(path, index_col=0)
+            frame.index = pd.to_datetime(frame.index, utc=interval != '1d')
+            if interval != '1d':
+                frame.index = frame.index.tz_convert(market_clock.EXCHANGE_TZ)
+            self._frames[key] = frame
+        return self._frames[key]
+
+    def _visible(self, frame: pd.DataFrame, interval: str) -> pd.DataFrame:
+        now = self.now()
+        if now is None:
+            return frame
+        if interval == '1d':  # a daily bar is complete once its session closed
+            today = now.tz_localize(None).normalize()
+            hours = market_clock.session_hours(today)
+            days = frame.index.tz_localize(None) if frame.index.tz is not None else frame.index
+            return frame[days <= today] if hours is not None and now >= hours[1] else frame[days < today]
+        return frame[frame.index <= now]
+
+    def history(self, symbol: str, period='1mo', interval='1d') -> pd.DataFrame:
+        return history_cache.slice_period(self._visible(self.recorded(symbol, interval), interval), period)
+
+    def download(self, tickers: list, period=None, interval='1d', start=None, end=None) -> pd.DataFrame:
+        frames = {}
+        for ticker in tickers:
+            frame = self._visible(self.recorded(ticker, interval), interval)
+            if start is not None:
+                frame = frame[frame.index >= pd.Timestamp(start)]
+            elif period is not None:
+                frame = history_cache.slice_period(frame, period)
+            if end is not None:
+                frame = frame[frame.index < pd.Timestamp(end)]
+            frames[ticker] = frame
+        return pd.concat(frames, axis=1)
+
+
+def record(tickers: list, directory: str, period='1y', interval='1d', provider=None):
+    """
+    Record bars to replay files
+    :param tickers: tickers to record
+    :type tickers: list
+    :param directory: recordings directory
+    :type directory: str
+    :param period: period in 1d,5d,1mo,3mo,1y,ytd,max template
+    :type period: str
+    :param interval: interval in 1m,2m,5m,30m,1h,1d template
+    :type interval: str
+    :param provider: provider to record from, the current one if None
+    :type provider: MarketDataProvider
+    """
+    data = (provider or get_provider()).download(tickers, period=period, interval=interval)
+    os.makedirs(os.path.join(directory, interval), exist_ok=True)
+    for ticker in tickers:
+        data[ticker].dropna(how='all').to_csv(os.path.join(directory, interval, ticker + '.csv'))
+
+
+# Current provider
+
+_PROVIDER = YFinanceProvider()
+
+
+def get_provider() -> MarketDataProvider:
+    return _PROVIDER
+
+
+def set_provider(provider: MarketDataProvider):
+    """
+    Replace the provider every data access goes through, also drops histories cached from the old one
+    :param provider: new provider
+    :type provider: MarketDataProvider
+    """
+    global _PROVIDER
+    _PROVIDER = provider
+    history_cache.CACHE.invalidate()
+
+
+def start_replay(directory: str, start, speed=REPLAY_SPEED) -> ReplayProvider:
+    """
+    Drive the whole app through recorded bars: the market clock starts at `start` and runs `speed` times faster,
+    every data access is served from the recordings and the stores are kept inside the recordings directory, so the
+    live stores are never touched
+    :param directory: recordings directory (see record), a day of intraday bars and the daily bars before it
+    :type directory: str
+    :param start: recorded time the replay starts at, naive times are exchange time
+    :type start: datetime or str
+    :param speed: market seconds per real second
+    :type speed: float
+    :return: the replay provider
+    :rtype: ReplayProvider
+    """
+    for key in REPLAY_STORES:
+        config.FILE_PATHS[key] = os.path.join(directory, 'stores', key.lower(), '')
+    clock = market_clock.ReplayClock(start, speed)
+    market_clock.set_clock(clock)
+    provider = ReplayProvider(directory, clock=clock)
+    set_provider(provider)
+    return provider
@@ -1,30 +1,40 @@
+from __future__ import annotations  # annotations name yf.Ticker, keep them from importing yfinance
+
+import heapq
+import itertools
+import math
+
+import numpy as np
+import pandas as pd
 import pandas.core.frame
-import yfinance as yf
 
+import bar_aggregator
+import config
+import data_store
+import indicators
+import instrumentation
+import providers
+import watchlists
 import yf_functions
+from yf_functions import yf
+
+# SMA score calculation percentages:
+SMA_WEIGHTS = config.SMA_WEIGHTS
+FACTORS = ['SMA', 'GAP', 'FIRST_CANDLE', 'MOMENTUM']
 
-yf_functions.load_tickers_from_ini()
 
+@instrumentation.timed('ranking.give_score')
 def give_score(ticker: yf.Ticker or str or pandas.core.frame.DataFrame) -> float:
     return sma_score(ticker)*100
 
 
+@instrumentation.timed('ranking.sma_score')
 def sma_score(ticker_data: pandas.core.frame.DataFrame) -> float:
-    # SMA score calculation percentages:
-    ABOVE_SMA20 = 0.4
-    ABOVE_SMA50 = 0.1
-    ABOVE_SMA100 = 0.2
-    ABOVE_SMA200 = 0.3
-    sma = {}
+    # weighted by SMA_WEIGHTS like sma_scores, so both score the same
     score = 0
-    for i in [20, 50, 100, 200]:
-        sma |= {str(i): yf_functions.get_SMA(ticker_data, i)}
     current_price = yf_functions.get_current_yf_price(ticker_data)
-
-    score += sma_score_helper(current_price, sma['20'], ABOVE_SMA20)
-    score += sma_score_helper(current_price, sma['50'], ABOVE_SMA50)
-    score += sma_score_helper(current_price, sma['100'], ABOVE_SMA100)
-    score += sma_score_helper(current_price, sma['200'], ABOVE_SMA200)
+    for window, weight in SMA_WEIGHTS.items():
+        score += sma_score_helper(current_price, yf_functions.get_SMA(ticker_data, window), weight)
     return score
 
 def sma_score_helper(current_price, sma, sma_weight):
@@ -51,28 +61,383 @@ def sma_score_helper(current_price, sma, sma_weight):
     return score
 
 
-def gap_score(ticker_data: pandas.core.frame.DataFrame) -> float:
-    GAP_WEIGHT = 0.5
-    FIRST_CANDLE_WEIGHT = 0.5
-    score = 0
-    current_price = yf_functions.get_current_yf_price(ticker_data)
-    gap = yf_functions.get_gap(ticker_data)
-    # gap/current_price = percentage of change (gap's worth)
-    first_candle = yf_functions.get_1st_candle(ticker_data)
-    # first_candle/current_price = percentage of change (first candle's worth)
-    return score
+def sma_score_helper_array(current_price: np.ndarray, sma: np.ndarray, sma_weight: float) -> np.ndarray:
+    """
+    sma_score_helper over arrays of tickers, same cascade
+    :param current_price: current prices
+    :type current_price: np.ndarray
+    :param sma: sma of each ticker
+    :type sma: np.ndarray
+    :param sma_weight: weight of this sma
+    :type sma_weight: float
+    :return: score of each ticker
+    :rtype: np.ndarray
+    """
+    change_percent = ((current_price - sma) * current_price) / 100
+    below = np.select([change_percent < 0.01, change_percent < 0.02, change_percent < 0.05, change_percent < 0.08],
+                      [0.5, 0.4, 0.3, 0.2], default=0.1)
+    factor = np.select([sma < current_price, sma == current_price, sma > current_price], [1, 0.8, below], default=0)
+    return factor * sma_weight
 
 
-def momentum_score(ticker_data: pandas.core.frame.DataFrame) -> float:
-    MOMENTUM = 0.5
-    last_day = yf_functions.get_last_day_percentage(ticker_data)
-    return last_day
+@instrumentation.timed('ranking.sma_scores')
+def sma_scores(closes: np.ndarray, smas=None, weights=None) -> pd.DataFrame:
+    """
+    sma_score of every ticker at once
+    :param closes: close prices shaped (tickers, dates), oldest first, empty bars are NaN
+    :type closes: np.ndarray
+    :param smas: precomputed {window: last sma of each ticker}, e.g. from IndicatorEngine.last_smas
+    :type smas: dict
+    :param weights: {window: weight}, SMA_WEIGHTS if None
+    :type weights: dict
+    :return: Price, SMA columns and the SMA score, one row per ticker
+    :rtype: pd.DataFrame
+    """
+    weights = weights or SMA_WEIGHTS
+    if smas is None:
+        smas = {window: indicators.last_sma(closes, window) for window in weights}
+    current_price = yf_functions.decimal2_array(closes[:, -1])
+    table = {'Price': current_price}
+    score = np.zeros(len(closes))
+    for window, weight in weights.items():
+        sma = yf_functions.decimal2_array(smas[window])
+        table[f'SMA{window}'] = sma
+        score += sma_score_helper_array(current_price, sma, weight)
+    table['Score'] = score * 100
+    return pd.DataFrame(table)
+
+
+@instrumentation.timed('ranking.load_universe')
+def load_universe(tickers: list, source='store') -> data_store.PricePanel:
+    """
+    Get the daily panel of a universe
+    :param tickers: tickers to load
+    :type tickers: list
+    :param source: 'store' reads the local store (fetching only missing sessions), 'download' fetches a fresh year
+    :type source: str
+    :return: panel with the tickers
+    :rtype: data_store.PricePanel
+    """
+    if source == 'store':
+        return data_store.refresh_panel(tickers)
+    data = providers.get_provider().download(tickers, period='1y', interval='1d')  # one batched request
+    return data_store.panel_from_download(data, tickers)
+
+
+def rank(tickers=None, source='store') -> pd.DataFrame:
+    """
+    Rank a universe by score
+    :param tickers: tickers to rank, ini tickers if None
+    :type tickers: list
+    :param source: where to get the data from, see load_universe
+    :type source: str
+    :return: ranking table indexed by ticker, best score first
+    :rtype: pd.DataFrame
+    """
+    registry = watchlists.get_registry()
+    ids = registry.ids() if tickers is None else registry.symbol_ids(tickers)
+    panel = load_universe(registry.symbols(ids), source)
+    ids, rows = registry.rows(panel, ids)
+    tickers = registry.symbols(ids)
+    smas = indicators.get_engine(panel).last_smas(list(SMA_WEIGHTS))  # shared with the other scans
+    table = sma_scores(panel.adjusted('Close', rows), {window: sma[rows] for window, sma in smas.items()})
+    table.index = pd.Index(tickers, name='Ticker')
+    with instrumentation.stage('ranking.sort'):
+        return table.sort_values('Score', ascending=False, kind='stable')
+
+
+class Leaderboard:
+    """
+    Top-K leaderboard: a per ticker score index and a lazy max-heap.
+    An update pushes a new heap entry and outdates the ticker's previous one, outdated entries are skipped when the
+    top is rebuilt. The top K is cached and only rebuilt when an update could change it, so querying it is O(K).
+    """
+
+    def __init__(self, k=20):
+        """
+        :param k: leaderboard size
+        :type k: int
+        """
+        self.k = k
+        self.scores = {}  # ticker -> score
+        self._entry_ids = {}  # ticker -> id of its current heap entry
+        self._heap = []  # (-score, entry id, ticker)
+        self._counter = itertools.count()
+        self._top = None  # cached [(ticker, score)], best first, None when it has to be rebuilt
+
+    def __len__(self):
+        return len(self.scores)
+
+    def __contains__(self, ticker):
+        return ticker in self.scores
+
+    def update(self, scores: dict):
+        """
+        Set the scores of some tickers, a NaN score removes the ticker
+        :param scores: {ticker: score}
+        :type scores: dict
+        """
+        for ticker, score in scores.items():
+            score = float(score)
+            if math.isnan(score):
+                self.remove(ticker)
+                continue
+            if self._top is not None and (ticker in self.scores and self._in_top(ticker) or
+                                          len(self._top) < self.k or score >= self._top[-1][1]):
+                self._top = None  # the update may reorder the top
+            self.scores[ticker] = score
+            entry_id = self._entry_ids[ticker] = next(self._counter)
+            heapq.heappush(self._heap, (-score, entry_id, ticker))
+        if len(self._heap) > 2 * len(self.scores) + self.k:  # drop outdated entries
+            self._heap = [(-self.scores[t], self._entry_ids[t], t) for t in self.scores]
+            heapq.heapify(self._heap)
+
+    def remove(self, ticker: str):
+        """
+        Drop a ticker from the leaderboard
+        :param ticker: ticker symbol
+        :type ticker: str
+        """
+        if ticker in self.scores:
+            if self._top is not None and self._in_top(ticker):
+                self._top = None
+            del self.scores[ticker]
+            del self._entry_ids[ticker]  # its heap entries are outdated now
+
+    def top(self, k=None) -> list:
+        """
+        Best tickers, best first
+        :param k: number of tickers, at most the leaderboard size, the leaderboard size if None
+        :type k: int
+        :return: [(ticker, score)]
+        :rtype: list
+        """
+        if self._top is None:
+            self._top = self._rebuild_top()
+        return self._top[:self.k if k is None else k]
+
+    def _in_top(self, ticker) -> bool:
+        return any(t == ticker for t, _ in self._top)
+
+    def _rebuild_top(self) -> list:
+        top, popped = [], []
+        while self._heap and len(top) < self.k:
+            entry = heapq.heappop(self._heap)
+            if self._entry_ids.get(entry[2]) == entry[1]:  # current entry of its ticker
+                top.append((entry[2], -entry[0]))
+                popped.append(entry)
+        for entry in popped:  # outdated entries stay popped
+            heapq.heappush(self._heap, entry)
+        return top
 
 
+class RankingService:
+    """
+    Keeps a leaderboard in sync with the store.
+    Only tickers whose last bar changed are re-scored, a new session or new weights re-score the whole universe.
+    """
+
+    def __init__(self, tickers=None, k=20, weights=None):
+        """
+        :param tickers: tickers to rank, ini tickers if None
+        :type tickers: list
+        :param k: leaderboard size
+        :type k: int
+        :param weights: {window: weight}, SMA_WEIGHTS if None
+        :type weights: dict
+        """
+        self.tickers = list(tickers) if tickers is not None else yf_functions.load_tickers_from_ini()
+        self.weights = dict(weights or SMA_WEIGHTS)
+        self.leaderboard = Leaderboard(k)
+        self.table = pd.DataFrame()  # last scoring row of every ranked ticker
+        self._last_date = None  # last session of the scored panel
+        self._actions_version = None  # corporate actions the panel was adjusted for
+        self._last_close = {}  # ticker -> last close it was scored with
+
+    def set_weights(self, weights: dict):
+        """
+        Change the SMA weights, every ticker is re-scored on the next refresh
+        :param weights: {window: weight}
+        :type weights: dict
+        """
+        self.weights = dict(weights)
+        self._last_date = None
+
+    def refresh(self, panel=None) -> list:
+        """
+        Re-score the tickers whose bars changed
+        :param panel: daily panel, the refreshed store if None
+        :type panel: data_store.PricePanel
+        :return: re-scored tickers
+        :rtype: list
+        """
+        if panel is None:
+            panel = data_store.refresh_panel(self.tickers)
+        tickers, rows = panel.rows(self.tickers)
+        closes = panel.adjusted('Close', rows)
+        last_close = closes[:, -1]
+        # a new session moves every ticker's window, a new split changes a ticker's whole history
+        rescore_all = self._last_date != panel.dates[-1] or self._actions_version != panel.actions.version
+        if rescore_all:
+            changed = np.ones(len(tickers), dtype=bool)
+        else:
+            previous = np.array([self._last_close.get(ticker, np.nan) for ticker in tickers])
+            changed = ~((previous == last_close) | (np.isnan(previous) & np.isnan(last_close)))
+            changed |= np.array([ticker not in self._last_close for ticker in tickers], dtype=bool)
+        changed_rows = np.flatnonzero(changed)
+        rescored = [tickers[i] for i in changed_rows]
+        if len(rescored):
+            with instrumentation.stage('ranking.rescore'):
+                table = sma_scores(closes[changed_rows], weights=self.weights)
+            table.index = pd.Index(rescored, name='Ticker')
+            self.table = table if rescore_all else pd.concat([self.table.drop(rescored, errors='ignore'), table])
+            self.leaderboard.update(dict(zip(rescored, table['Score'])))
+        for ticker in set(self._last_close) - set(tickers):  # left the universe or the store
+            self.leaderboard.remove(ticker)
+        self._last_close = dict(zip(tickers, last_close))
+        self._last_date = panel.dates[-1]
+        self._actions_version = panel.actions.version
+        return rescored
+
+    def top(self, k=None) -> pd.DataFrame:
+        """
+        Current top of the ranking
+        :param k: number of tickers, the leaderboard size if None
+        :type k: int
+        :return: ranking table indexed by ticker, best score first
+        :rtype: pd.DataFrame
+        """
+        return self.table.loc[[ticker for ticker, _ in self.leaderboard.top(k)]]
+
+
+def gap_factor(gaps: np.ndarray, current_price: np.ndarray) -> np.ndarray:
+    """
+    Gap's worth: gap / current price in percent
+    :param gaps: session open - previous close of each ticker
+    :type gaps: np.ndarray
+    :param current_price: current price of each ticker
+    :type current_price: np.ndarray
+    :rtype: np.ndarray
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return gaps / current_price * 100
+
+
+def first_candle_factor(first_candles: np.ndarray, current_price: np.ndarray) -> np.ndarray:
+    """
+    First candle's worth: first candle / current price in percent, NaN where the first candle is unknown
+    :param first_candles: first candle (close - open) of each ticker
+    :type first_candles: np.ndarray
+    :param current_price: current price of each ticker
+    :type current_price: np.ndarray
+    :rtype: np.ndarray
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return first_candles / current_price * 100
+
+
+def momentum_factor(closes: np.ndarray) -> np.ndarray:
+    """
+    Last day of trading's percentage change, like get_last_day_percentage of a ticker
+    :param closes: close prices shaped (tickers, dates), oldest first
+    :type closes: np.ndarray
+    :rtype: np.ndarray
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return yf_functions.decimal2_array((closes[:, -1] / closes[:, -2] - 1) * 100)
+
+
+@instrumentation.timed('ranking.factor_scores')
+def factor_scores(opens: np.ndarray, closes: np.ndarray, smas=None, gaps=None, first_candles=None,
+                  weights=None) -> pd.DataFrame:
+    """
+    Every factor and the composite score of every ticker at once.
+    Unknown factors (e.g. the first candle before the session opened) add nothing to the score.
+    :param opens: open prices shaped (tickers, dates), oldest first
+    :type opens: np.ndarray
+    :param closes: close prices shaped (tickers, dates), oldest first
+    :type closes: np.ndarray
+    :param smas: precomputed {window: last sma of each ticker}, see sma_scores
+    :type smas: dict
+    :param gaps: gap of each ticker, the last daily bar's open - previous close if None
+    :type gaps: np.ndarray
+    :param first_candles: first candle of each ticker, unknown if None
+    :type first_candles: np.ndarray
+    :param weights: {factor: weight}, config.FACTOR_WEIGHTS if None
+    :type weights: dict
+    :return: the sma_scores columns, a column per factor and the composite Score
+    :rtype: pd.DataFrame
+    """
+    weights = weights or config.FACTOR_WEIGHTS
+    table = sma_scores(closes, smas)
+    current_price = table['Price'].to_numpy()
+    if gaps is None:
+        gaps = opens[:, -1] - closes[:, -2]
+    if first_candles is None:
+        first_candles = np.full(len(closes), np.nan)
+    factors = {'SMA': table.pop('Score').to_numpy(),
+               'GAP': gap_factor(gaps, current_price),
+               'FIRST_CANDLE': first_candle_factor(first_candles, current_price),
+               'MOMENTUM': momentum_factor(closes)}
+    score = np.zeros(len(closes))
+    for factor in FACTORS:
+        table[factor] = factors[factor]
+        if weights.get(factor, 0):
+            score += weights[factor] * np.nan_to_num(factors[factor], nan=0.0, posinf=0.0, neginf=0.0)
+    table['Score'] = score
+    return table
+
+
+def factor_table(panel, tickers: list, weights=None) -> pd.DataFrame:
+    """
+    Factor scores of a universe, with the streamed gap and first candle of watched tickers
+    :param panel: daily panel
+    :type panel: data_store.PricePanel
+    :param tickers: tickers to score, tickers missing from the panel are skipped
+    :type tickers: list
+    :param weights: {factor: weight}, config.FACTOR_WEIGHTS if None
+    :type weights: dict
+    :return: factor scores indexed by ticker, best score first
+    :rtype: pd.DataFrame
+    """
+    tickers, rows = panel.rows(tickers)
+    opens, closes = panel.adjusted('Open', rows), panel.adjusted('Close', rows)
+    gaps = opens[:, -1] - closes[:, -2]
+    first_candles = np.full(len(tickers), np.nan)
+    for i, ticker in enumerate(tickers):
+        gap = bar_aggregator.AGGREGATOR.gap(ticker)
+        if gap is not None:
+            gaps[i] = gap
+        candle = bar_aggregator.AGGREGATOR.first_candle(ticker)
+        if candle is not None:
+            first_candles[i] = candle
+    smas = indicators.get_engine(panel).last_smas(list(SMA_WEIGHTS))
+    table = factor_scores(opens, closes, {window: sma[rows] for window, sma in smas.items()}, gaps, first_candles,
+                          weights)
+    table.index = pd.Index(tickers, name='Ticker')
+    return table.sort_values('Score', ascending=False, kind='stable')
+
+
+def _single_ticker_factors(ticker_data: pandas.core.frame.DataFrame, weights: dict) -> float:
+    opens = ticker_data['Open'].to_numpy(dtype=float)[None, :]
+    closes = ticker_data['Close'].to_numpy(dtype=float)[None, :]
+    return float(factor_scores(opens, closes, weights=weights)['Score'][0])
+
+
+def gap_score(ticker_data: pandas.core.frame.DataFrame) -> float:
+    """
+    Gap factor of a ticker's daily data, weighted like the composite score
+    (the first candle is unknown from daily data)
+    """
+    return _single_ticker_factors(ticker_data, {'GAP': config.FACTOR_WEIGHTS['GAP']})
+
+
+def momentum_score(ticker_data: pandas.core.frame.DataFrame) -> float:
+    """
+    Momentum factor of a ticker's daily data, weighted like the composite score
+    """
+    return _single_ticker_factors(ticker_data, {'MOMENTUM': config.FACTOR_WEIGHTS['MOMENTUM']})
 
-print(yf_functions.load_tickers_from_ini())
-score_list = {}
-for tick in yf_functions.load_tickers_from_ini():
-    score_list |= {tick: give_score(yf.download(tickers=tick, period='365d', interval='1d'))}
 
-print(score_list)
+if __name__ == "__main__":
+    print(rank())
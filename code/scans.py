@@ -0,0 +1,103 @@
+# Scans
+# Every scan is a generator yielding (progress %, result line or None) so callers can stream results,
+# report progress and stop between steps. The generator's return value is the scan's final result.
+import data_store
+import indicators
+import ttm_squeeze
+import watchlists
+import yf_functions as yf_func
+from yf_functions import yf
+
+
+def _rows(panel, tickers: list) -> tuple:
+    # store rows through the registry's symbol ids, mapped to rows once per stored panel
+    registry = watchlists.get_registry()
+    ids, rows = registry.rows(panel, registry.symbol_ids(tickers))
+    return registry.symbols(ids), rows
+
+
+def consolidation_scan(tickers: list, percentage=2.5, look_back_data=15):
+    """
+    Scans tickers for consolidation patterns and breakouts
+    :param tickers: tickers to scan
+    :type tickers: list
+    :param percentage: percentage consolidation pattern
+    :type percentage: float
+    :param look_back_data: days to look for consolidation
+    :type look_back_data: int
+    :return: {ticker: (is consolidating, is breaking out)}
+    :rtype: dict
+    """
+    yield 0, None
+    panel = data_store.refresh_panel(tickers)  # fetch only sessions missing from the store
+    yield 50, None
+    tickers, rows = _rows(panel, tickers)
+    consolidating, breaking = yf_func.scan_consolidation(panel.adjusted('Close', rows), percentage=percentage,
+                                                         look_back_data=look_back_data)  # whole universe at once
+    results = {}
+    for i, ticker in enumerate(tickers):
+        results[ticker] = (bool(consolidating[i]), bool(breaking[i]))
+        progress = 50 + int(50 * (i + 1) / len(tickers))
+        if consolidating[i]:
+            yield progress, f'{ticker} is consolidating'
+        if breaking[i]:
+            yield progress, f'{ticker} is breaking out of consolidation!'
+    yield 100, None
+    return results
+
+
+def momentum_scan(ticker: str, risk: float or int):
+    """
+    Risk analysis, SMAs and last day change of a single ticker
+    :param ticker: ticker symbol
+    :type ticker: str
+    :param risk: risk in dollars
+    :type risk: float or int
+    :return: risk_dict of the ticker
+    :rtype: dict
+    """
+    yield 0, None
+    risk_answer = yf_func.risk_analysis(yf.Ticker(ticker), risk)
+    if not yf_func.trading_day_started():
+        yield 40, "Risk candle is based on GAP since data on the first candle of the day is unavailable."
+    yield 50, yf_func.dumb_risk_analysis_tostring(risk_answer)
+    panel = data_store.refresh_panel([ticker])  # the manifest knows if the ticker is stored and fresh
+    df = panel.ticker_frame(ticker)
+    smas = indicators.get_engine(panel).last_smas([20, 50, 100, 200])  # cached until the store changes
+    for i, sma in smas.items():
+        yield 60, f'SMA {str(i)}: {yf_func.decimal2_float(sma[panel.symbol_index[ticker]])}'
+    yield 100, f'Last day of trading change: {yf_func.get_last_day_percentage(df)}%'
+    return risk_answer
+
+
+def ttm_squeeze_scan(tickers: list, show='Squeeze On', length=20, bb_mult=2.0, kc_mult=1.5):
+    """
+    Scans tickers for TTM Squeezes
+    :param tickers: tickers to scan
+    :type tickers: list
+    :param show: one of ttm_squeeze.SHOW_OPTIONS
+    :type show: str
+    :param length: Bollinger Bands & Keltner Channel length
+    :type length: int
+    :param bb_mult: Bollinger Bands standard deviation multiplier
+    :type bb_mult: float
+    :param kc_mult: Keltner Channel ATR multiplier
+    :type kc_mult: float
+    :return: squeeze table, see ttm_squeeze.squeeze_table
+    :rtype: pd.DataFrame
+    """
+    yield 0, None
+    panel = data_store.refresh_panel(tickers)  # fetch only sessions missing from the store
+    yield 50, None
+    _, rows = _rows(panel, tickers)
+    table = ttm_squeeze.squeeze_table(panel, rows, length=length, bb_mult=bb_mult, kc_mult=kc_mult)
+    for ticker, row in table.iterrows():
+        direction = 'rising' if row['Rising'] else 'falling'
+        if row['Fired'] and show in ('Squeeze Fired', 'All'):
+            yield 100, f"{ticker} squeeze fired! momentum {row['Momentum']:.2f} ({direction})"
+        elif row['Squeeze'] and show in ('Squeeze On', 'All'):
+            yield 100, f"{ticker} is in a squeeze, momentum {row['Momentum']:.2f} ({direction})"
+        elif show == 'All':
+            yield 100, f"{ticker} no squeeze, momentum {row['Momentum']:.2f} ({direction})"
+    yield 100, None
+    return table
@@ -0,0 +1,324 @@
+# Headless batch scanner
+# Runs the scans without the GUI, e.g. from cron:
+#   python stockfinder.py scan --scans consolidation sma momentum --output nightly
+# or keeps a universe's intraday bars current during the session and re-ranks it after every poll:
+#   python stockfinder.py watch --watchlists default --top 10
+# or lists the universe's gaps at the open:
+#   python stockfinder.py gaps --min-gap 2 --direction up
+# or replays a recorded day (see providers.record) 100 times faster and reports the latency from bar to signal:
+#   python stockfinder.py watch --replay recordings --start "2022-02-01 09:25" --speed 100 --rounds 300
+# The universe's price panel is loaded once, placed in shared memory and the scans are fanned out over a process
+# pool, every worker reads the same panel without copying it. Results are written as <output>_<scan>.json/.csv.
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+import config
+import data_store
+import gap_scanner
+import market_clock
+import providers
+import ranking_system
+import synthetic_data
+import watcher
+import watchlists
+import yf_functions as yf_func
+
+# Globals
+
+SCAN_NAMES = ['consolidation', 'momentum', 'sma', 'factors']
+FORMATS = ['json', 'csv']
+CHUNKS_PER_WORKER = 4  # tasks per worker, small enough chunks to balance the pool
+SYNTHETIC_STORES = ['1D_STORE', 'INTRADAY_STORE']  # config.FILE_PATHS made temporary by watch --synthetic
+
+_PANEL = None  # panel of a pool worker, a view of the shared memory block
+_SHARED = None  # shared memory block of a pool worker, kept open while the worker lives
+
+
+def consolidation(panel: data_store.PricePanel, rows: list, options: dict) -> pd.DataFrame:
+    """
+    Consolidation patterns and breakouts of some of the panel's tickers
+    :param panel: price panel
+    :type panel: data_store.PricePanel
+    :param rows: panel rows to scan
+    :type rows: list
+    :param options: command line options (percentage, lookback)
+    :type options: dict
+    :return: Consolidating and Breaking columns
+    :rtype: pd.DataFrame
+    """
+    consolidating, breaking = yf_func.scan_consolidation(panel.adjusted('Close', rows),
+                                                         percentage=options['percentage'],
+                                                         look_back_data=options['lookback'])
+    return pd.DataFrame({'Consolidating': consolidating, 'Breaking': breaking})
+
+
+def momentum(panel: data_store.PricePanel, rows: list, options: dict) -> pd.DataFrame:
+    """
+    Gap, last day change and the gap based risk analysis of some of the panel's tickers, from daily bars only
+    :param panel: price panel
+    :type panel: data_store.PricePanel
+    :param rows: panel rows to scan
+    :type rows: list
+    :param options: command line options (risk)
+    :type options: dict
+    :return: Gap, Change % and risk_dict columns, NaN for tickers with less than 2 bars
+    :rtype: pd.DataFrame
+    """
+    table = []
+    for row in rows:
+        df = panel.ticker_frame(panel.symbols[row]).dropna(subset=['Close']).reset_index(drop=True)
+        if len(df) < 2:  # delisted or new ticker, no previous close to gap from
+            table.append({'Gap': np.nan, 'Change %': np.nan})
+            continue
+        gap = yf_func.decimal2_float(df['Open'].iloc[-1] - df['Close'].iloc[-2])
+        line = {'Gap': gap, 'Change %': yf_func.get_last_day_percentage(df)}
+        if gap != 0:  # no risk candle without a gap
+            line |= yf_func.risk_dict(options['risk'], gap, yf_func.decimal2_float(df['Close'].iloc[-1]))
+        table.append(line)
+    return pd.DataFrame(table)
+
+
+def sma(panel: data_store.PricePanel, rows: list, options: dict) -> pd.DataFrame:
+    """
+    SMA score of some of the panel's tickers
+    :param panel: price panel
+    :type panel: data_store.PricePanel
+    :param rows: panel rows to scan
+    :type rows: list
+    :param options: command line options
+    :type options: dict
+    :return: see ranking_system.sma_scores
+    :rtype: pd.DataFrame
+    """
+    return ranking_system.sma_scores(panel.adjusted('Close', rows))
+
+
+def factors(panel: data_store.PricePanel, rows: list, options: dict) -> pd.DataFrame:
+    """
+    Composite factor score of some of the panel's tickers
+    :param panel: price panel
+    :type panel: data_store.PricePanel
+    :param rows: panel rows to scan
+    :type rows: list
+    :param options: command line options
+    :type options: dict
+    :return: see ranking_system.factor_scores
+    :rtype: pd.DataFrame
+    """
+    return ranking_system.factor_scores(panel.adjusted('Open', rows), panel.adjusted('Close', rows))
+
+
+SCANS = {'consolidation': consolidation, 'momentum': momentum, 'sma': sma, 'factors': factors}
+
+
+def _shared_arrays(buffer, n_symbols: int, n_dates: int) -> tuple:
+    # prices then volumes in one block, volumes start on an 8 byte boundary
+    prices_shape = (len(data_store.PRICE_FIELDS), n_symbols, n_dates)
+    prices = np.ndarray(prices_shape, dtype=data_store.PRICE_DTYPE, buffer=buffer)
+    offset = -(-prices.nbytes // 8) * 8
+    volume = np.ndarray((n_symbols, n_dates), dtype=data_store.VOLUME_DTYPE, buffer=buffer, offset=offset)
+    return prices, volume
+
+
+def _attach(name: str, symbols: list, dates: np.ndarray, actions):
+    # pool worker initializer, maps the parent's panel instead of copying it
+    global _PANEL, _SHARED
+    _SHARED = shared_memory.SharedMemory(name=name)  # the parent owns the block and unlinks it
+    _PANEL = data_store.PricePanel(*_shared_arrays(_SHARED.buf, len(symbols), len(dates)), symbols, dates,
+                                   actions=actions)
+
+
+def _run_chunk(scan: str, rows: list, options: dict) -> pd.DataFrame:
+    table = SCANS[scan](_PANEL, rows, options)
+    table.index = pd.Index([_PANEL.symbols[row] for row in rows], name='Ticker')
+    return table
+
+
+def run_scans(panel: data_store.PricePanel, rows, scans: list, options: dict, workers=None) -> dict:
+    """
+    Run scans over a universe on a process pool sharing the panel
+    :param panel: price panel of the universe
+    :type panel: data_store.PricePanel
+    :param rows: panel rows to scan, see watchlists.Registry.rows
+    :type rows: np.ndarray
+    :param scans: names from SCAN_NAMES
+    :type scans: list
+    :param options: scan options, see the command line
+    :type options: dict
+    :param workers: worker processes, os.cpu_count() if None, 1 runs in this process
+    :type workers: int
+    :return: {scan: table indexed by ticker}
+    :rtype: dict
+    """
+    global _PANEL
+    workers = workers or os.cpu_count() or 1
+    chunks = [chunk.tolist() for chunk in np.array_split(rows, max(1, min(len(rows), workers * CHUNKS_PER_WORKER)))
+              if len(chunk)]
+    if workers == 1:
+        _PANEL = panel
+        return {scan: pd.concat([_run_chunk(scan, chunk, options) for chunk in chunks]) for scan in scans}
+
+    size = -(-panel.prices.size * np.dtype(data_store.PRICE_DTYPE).itemsize // 8) * 8 + panel.volume.nbytes
+    shared = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    try:
+        prices, volume = _shared_arrays(shared.buf, len(panel.symbols), len(panel.dates))
+        prices[:], volume[:] = panel.prices, panel.volume
+        del prices, volume  # the block can not be closed while views of it exist
+        with ProcessPoolExecutor(max_workers=workers, initializer=_attach,
+                                 initargs=(shared.name, panel.symbols, panel.dates, panel.actions)) as pool:
+            futures = {scan: [pool.submit(_run_chunk, scan, chunk, options) for chunk in chunks] for scan in scans}
+            return {scan: pd.concat([future.result() for future in results]) for scan, results in futures.items()}
+    finally:
+        shared.close()
+        shared.unlink()
+
+
+def write_results(results: dict, output: str, formats=FORMATS) -> list:
+    """
+    Write scan tables to <output>_<scan>.<format>
+    :param results: {scan: table}
+    :type results: dict
+    :param output: output path prefix
+    :type output: str
+    :param formats: any of FORMATS
+    :type formats: list
+    :return: written paths
+    :rtype: list
+    """
+    paths = []
+    for scan, table in results.items():
+        for file_format in formats:
+            paths.append(f'{output}_{scan}.{file_format}')
+            if file_format == 'json':
+                table.reset_index().to_json(paths[-1], orient='records', indent=2)
+            else:
+                table.to_csv(paths[-1])
+    return paths
+
+
+def scan_command(args) -> int:
+    registry = watchlists.get_registry()
+    ids = registry.symbol_ids(args.tickers) if args.tickers else registry.ids(args.watchlists)
+    start = time.perf_counter()
+    panel = ranking_system.load_universe(registry.symbols(ids), args.source)
+    loaded = time.perf_counter()
+    options = {'percentage': args.percentage, 'lookback': args.lookback, 'risk': args.risk}
+    _, rows = registry.rows(panel, ids)
+    results = run_scans(panel, rows, args.scans, options, args.workers)
+    for path in write_results(results, args.output, args.formats):
+        print(path)
+    print(f'{len(panel)} tickers loaded in {loaded - start:.2f}s, scanned in {time.perf_counter() - loaded:.2f}s',
+          file=sys.stderr)
+    return 0
+
+
+def gaps_command(args) -> int:
+    tickers = args.tickers or watchlists.get_registry().tickers(args.watchlists)
+    start = time.perf_counter()
+    table = gap_scanner.gap_table(tickers, session=args.session, budget=args.budget, download=not args.no_download,
+                                  min_gap_percent=args.min_gap, direction=args.direction)
+    print(table.head(args.top).to_string())
+    for path in write_results({'gaps': table}, args.output, args.formats):
+        print(path)
+    print(f'{len(table)} gaps of {len(tickers)} tickers in {time.perf_counter() - start:.2f}s', file=sys.stderr)
+    return 0
+
+
+def watch_command(args) -> int:
+    if args.synthetic:  # local stand-in, nothing is fetched and the watcher's bars never reach the live stores
+        provider = synthetic_data.SyntheticProvider(speed=args.synthetic, fail_rate=args.fail_rate)
+        providers.set_provider(provider)
+        market_clock.set_clock(provider.clock)
+        saved = {key: config.FILE_PATHS[key] for key in SYNTHETIC_STORES}
+        with tempfile.TemporaryDirectory(prefix='synthetic_stores_') as stores:
+            config.FILE_PATHS.update({key: os.path.join(stores, key.lower(), '') for key in saved})
+            try:
+                return _watch(args, 'download')
+            finally:
+                config.FILE_PATHS.update(saved)
+    if args.replay:  # recorded day, the stores are kept with the recordings
+        providers.start_replay(args.replay, args.start, args.speed)
+    return _watch(args, args.source)
+
+
+def _watch(args, source: str) -> int:
+    tickers = args.tickers or watchlists.get_registry().tickers(args.watchlists)
+    panel = ranking_system.load_universe(tickers, source)
+    session_watcher = watcher.Watcher(tickers, poll_every=args.every, concurrency=args.concurrency, rate=args.rate)
+    session_watcher.seed_previous_closes(panel)
+
+    def report(updated):
+        table = ranking_system.factor_table(panel, tickers)
+        print(f'{market_clock.get_clock().now():%H:%M:%S} {len(updated)} tickers updated')
+        print(table[['Price', 'GAP', 'FIRST_CANDLE', 'MOMENTUM', 'Score']].head(args.top).to_string())
+
+    session_watcher.callbacks.append(report)
+    try:
+        asyncio.run(session_watcher.run(args.rounds))
+    except KeyboardInterrupt:
+        pass
+    if session_watcher.latencies:
+        latencies = np.array(session_watcher.latencies)
+        print(f'{len(latencies)} bars, bar to signal latency: median {np.median(latencies):.3f}s, '
+              f'p95 {np.percentile(latencies, 95):.3f}s, max {latencies.max():.3f}s', file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='stockfinder', description='Headless Stock-Finder')
+    commands = parser.add_subparsers(dest='command', required=True)
+    scan_parser = commands.add_parser('scan', help='scan a universe and write the results')
+    scan_parser.add_argument('--tickers', nargs='+', help='tickers to scan instead of watchlists')
+    scan_parser.add_argument('--watchlists', nargs='+', help='ini watchlists to scan, the default watchlist by default')
+    scan_parser.add_argument('--scans', nargs='+', choices=SCAN_NAMES, default=SCAN_NAMES)
+    scan_parser.add_argument('--source', choices=['store', 'download'], default='store',
+                             help='see ranking_system.load_universe')
+    scan_parser.add_argument('--workers', type=int, help='worker processes, every core by default')
+    scan_parser.add_argument('--output', default='scan_results', help='output path prefix')
+    scan_parser.add_argument('--formats', nargs='+', choices=FORMATS, default=FORMATS)
+    scan_parser.add_argument('--percentage', type=float, default=2.5, help='consolidation percentage')
+    scan_parser.add_argument('--lookback', type=int, default=15, help='days to look for consolidation')
+    scan_parser.add_argument('--risk', type=float, default=100.0, help='risk in dollars for the momentum scan')
+    watch_parser = commands.add_parser('watch', help='keep intraday bars current and re-rank after every poll')
+    watch_parser.add_argument('--tickers', nargs='+', help='tickers to watch instead of watchlists')
+    watch_parser.add_argument('--watchlists', nargs='+',
+                              help='ini watchlists to watch, the default watchlist by default')
+    watch_parser.add_argument('--source', choices=['store', 'download'], default='store',
+                              help='daily data, see ranking_system.load_universe')
+    watch_parser.add_argument('--every', type=float, default=watcher.POLL_EVERY, help='market seconds between polls')
+    watch_parser.add_argument('--concurrency', type=int, default=watcher.CONCURRENCY)
+    watch_parser.add_argument('--rate', type=float, default=watcher.RATE, help='requests per market second')
+    watch_parser.add_argument('--rounds', type=int, help='polls before exiting, until interrupted by default')
+    watch_parser.add_argument('--top', type=int, default=10, help='tickers shown after every poll')
+    watch_parser.add_argument('--synthetic', type=float, metavar='SPEED',
+                              help='watch synthetic data at SPEED simulated seconds per second, no network')
+    watch_parser.add_argument('--fail-rate', type=float, default=0.0, help='synthetic request failure rate')
+    watch_parser.add_argument('--replay', metavar='DIR', help='replay the recordings in DIR, no network')
+    watch_parser.add_argument('--start', help='recorded exchange time the replay starts at, e.g. "2022-02-01 09:25"')
+    watch_parser.add_argument('--speed', type=float, default=providers.REPLAY_SPEED,
+                              help='replay speed in market seconds per second, 10 to 1000 for load tests')
+    gaps_parser = commands.add_parser('gaps', help='gaps of the universe at the open, biggest first')
+    gaps_parser.add_argument('--tickers', nargs='+', help='tickers to scan instead of watchlists')
+    gaps_parser.add_argument('--watchlists', nargs='+', help='ini watchlists to scan, the default watchlist by default')
+    gaps_parser.add_argument('--session', help='session date, today by default')
+    gaps_parser.add_argument('--budget', type=float, default=gap_scanner.BUDGET, help='seconds until the list is ready')
+    gaps_parser.add_argument('--no-download', action='store_true', help='only use streamed bars and the store')
+    gaps_parser.add_argument('--min-gap', type=float, default=0.0, help='smallest absolute gap %%')
+    gaps_parser.add_argument('--direction', choices=gap_scanner.DIRECTIONS, default='both')
+    gaps_parser.add_argument('--top', type=int, default=20, help='gaps printed')
+    gaps_parser.add_argument('--output', default='gap_results', help='output path prefix')
+    gaps_parser.add_argument('--formats', nargs='+', choices=FORMATS, default=FORMATS)
+    args = parser.parse_args()
+    if args.command == 'watch' and args.replay and not args.start:
+        parser.error('--replay needs --start')
+    handlers = {'scan': scan_command, 'watch': watch_command, 'gaps': gaps_command}
+    sys.exit(handlers[args.command](args))
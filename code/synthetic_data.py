@@ -0,0 +1,188 @@
+# Synthetic market data
+# Deterministic OHLCV generator for benchmarks and offline runs, no network needed.
+# The same ticker and seed always produce the same bars.
+import zlib
+
+import numpy as np
+import pandas as pd
+
+import data_store
+import history_cache
+import market_clock
+import providers
+
+# Globals
+
+EXCHANGE_TZ = 'America/New_York'
+
+
+def _rng(ticker: str, seed: int) -> np.random.Generator:
+    return np.random.default_rng([seed, zlib.crc32(ticker.encode())])
+
+
+def _ohlcv(rng: np.random.Generator, bars: int, start_price: float, volatility: float) -> dict:
+    # geometric random walk for closes, opens gap from the previous close, highs/lows wrap the body
+    close = start_price * np.exp(np.cumsum(rng.normal(0, volatility, bars)))
+    open_price = np.concatenate([[start_price], close[:-1]]) * np.exp(rng.normal(0, volatility / 3, bars))
+    body_high = np.maximum(open_price, close)
+    body_low = np.minimum(open_price, close)
+    high = body_high * (1 + np.abs(rng.normal(0, volatility / 2, bars)))
+    low = body_low * (1 - np.abs(rng.normal(0, volatility / 2, bars)))
+    volume = rng.lognormal(14, 0.5, bars).round()
+    return {'Open': open_price, 'High': high, 'Low': low, 'Close': close, 'Adj Close': close, 'Volume': volume}
+
+
+def tickers(n: int) -> list:
+    """
+    Synthetic ticker symbols
+    :param n: number of tickers
+    :type n: int
+    :return: ['T0000', 'T0001', ...]
+    :rtype: list
+    """
+    return [f'T{i:04d}' for i in range(n)]
+
+
+def daily_frame(ticker: str, days=252, end='2022-02-01', seed=0) -> pd.DataFrame:
+    """
+    Daily bars of one ticker, same layout as yf.download of a single ticker
+    :param ticker: ticker symbol
+    :type ticker: str
+    :param days: number of sessions
+    :type days: int
+    :param end: last session date
+    :type end: str
+    :param seed: generator seed
+    :type seed: int
+    :return: dataframe indexed by Date with data_store.FIELDS columns
+    :rtype: pd.DataFrame
+    """
+    rng = _rng(ticker, seed)
+    index = pd.bdate_range(end=end, periods=days, name='Date')
+    return pd.DataFrame(_ohlcv(rng, days, rng.uniform(5, 500), rng.uniform(0.01, 0.04)), index=index)
+
+
+def download_frame(symbols: list, days=252, end='2022-02-01', seed=0) -> pd.DataFrame:
+    """
+    Daily bars of several tickers, same layout as yf.download(group_by='ticker')
+    :return: dataframe with (ticker, field) columns
+    :rtype: pd.DataFrame
+    """
+    return pd.concat({ticker: daily_frame(ticker, days, end, seed) for ticker in symbols}, axis=1)
+
+
+def daily_panel(n: int, days=252, end='2022-02-01', seed=0) -> data_store.PricePanel:
+    """
+    Daily panel of n synthetic tickers
+    :return: panel
+    :rtype: data_store.PricePanel
+    """
+    symbols = tickers(n)
+    prices, volume = data_store.empty_arrays(n, days)
+    for row, ticker in enumerate(symbols):
+        rng = _rng(ticker, seed)
+        bars = _ohlcv(rng, days, rng.uniform(5, 500), rng.uniform(0.01, 0.04))
+        for f, name in enumerate(data_store.PRICE_FIELDS):
+            prices[f, row] = bars[name]
+        volume[row] = data_store.to_volume(bars['Volume'])
+    dates = pd.bdate_range(end=end, periods=days).values.astype('datetime64[D]')
+    return data_store.PricePanel(prices, volume, symbols, dates)
+
+
+def intraday_frame(ticker: str, session='2022-02-01', interval_minutes=1, seed=0) -> pd.DataFrame:
+    """
+    Regular session intraday bars of one ticker, same layout as Ticker.history with an intraday interval.
+    The session opens with a gap from the ticker's previous close in daily_frame, so gaps match the daily bars.
+    Every interval is rolled up from the same 1m bars, like the session's daily bar (see SyntheticProvider).
+    :param ticker: ticker symbol
+    :type ticker: str
+    :param session: session date
+    :type session: str
+    :param interval_minutes: bar size in minutes
+    :type interval_minutes: int
+    :param seed: generator seed
+    :type seed: int
+    :return: dataframe indexed by exchange time Datetime
+    :rtype: pd.DataFrame
+    """
+    daily = daily_frame(ticker, end=session, seed=seed)
+    previous_close = daily.loc[daily.index < pd.Timestamp(session), 'Close'].iloc[-1]
+    rng = _rng(f'{ticker}:{session}', seed)
+    index = pd.date_range(f'{session} 09:30', f'{session} 15:59', freq='1min', tz=EXCHANGE_TZ, name='Datetime')
+    bars = _ohlcv(rng, len(index), previous_close, rng.uniform(0.0005, 0.002))
+    del bars['Adj Close']
+    bars['Volume'] = (bars['Volume'] / len(index)).round()  # a session trades about a daily bar's volume
+    minutes = pd.DataFrame(bars, index=index)
+    if interval_minutes == 1:
+        return minutes
+    return minutes.resample(f'{interval_minutes}min').agg(providers.ROLL_UP)
+
+
+class SyntheticProvider(providers.MarketDataProvider):
+    """
+    Local stand-in for the data source, serves synthetic bars so the watcher and the scans can run with no network.
+    Intraday bars appear as the simulated session clock advances, failures can be injected to exercise backoff.
+    """
+
+    def __init__(self, session='2022-02-01', speed=60.0, fail_rate=0.0, seed=0):
+        """
+        :param session: simulated session date, daily bars end the day before until its session closed
+        :type session: str
+        :param speed: simulated seconds per real second, the session starts at the open when created
+        :type speed: float
+        :param fail_rate: probability of a history request failing, batched downloads never fail
+        :type fail_rate: float
+        :param seed: generator seed
+        :type seed: int
+        """
+        self.session = session
+        self.speed = speed
+        self.fail_rate = fail_rate
+        self.seed = seed
+        self.clock = market_clock.ReplayClock(f'{session} 09:30', speed)  # set it as the market clock to follow it
+        self.requests = 0
+        self._failures = np.random.default_rng(seed)
+
+    def now(self) -> pd.Timestamp:
+        """
+        Simulated exchange time
+        :rtype: pd.Timestamp
+        """
+        return self.clock.now()
+
+    def history(self, symbol: str, period='1mo', interval='1d') -> pd.DataFrame:
+        self.requests += 1
+        if self._failures.random() < self.fail_rate:
+            raise ConnectionError('synthetic failure')
+        return self._bars(symbol, period, interval)
+
+    def _bars(self, symbol: str, period: str, interval: str) -> pd.DataFrame:
+        if interval == '1d':
+            return history_cache.slice_period(self._daily(symbol), period)
+        frame = intraday_frame(symbol, self.session, int(interval[:-1]), self.seed)
+        return frame[frame.index <= self.now()]
+
+    def _daily(self, symbol: str) -> pd.DataFrame:
+        # like ReplayProvider, the session's bar is only served once the session closed, rolled up from its 1m bars
+        daily = daily_frame(symbol, end=self.session, seed=self.seed)
+        session = pd.Timestamp(self.session)
+        daily = daily[daily.index < session]
+        hours = market_clock.session_hours(session)
+        if hours is None or self.now() < hours[1]:
+            return daily
+        minutes = intraday_frame(symbol, self.session, 1, self.seed)
+        bar = {'Open': minutes['Open'].iloc[0], 'High': minutes['High'].max(), 'Low': minutes['Low'].min(),
+               'Close': minutes['Close'].iloc[-1], 'Adj Close': minutes['Close'].iloc[-1],
+               'Volume': minutes['Volume'].sum()}
+        return pd.concat([daily, pd.DataFrame([bar], index=pd.DatetimeIndex([session], name='Date'))[daily.columns]])
+
+    def download(self, tickers: list, period=None, interval='1d', start=None, end=None) -> pd.DataFrame:
+        frames = {}
+        for ticker in tickers:
+            frame = self._bars(ticker, period or 'max', interval)
+            if start is not None:
+                frame = frame[frame.index >= pd.Timestamp(start)]
+            if end is not None:
+                frame = frame[frame.index < pd.Timestamp(end)]
+            frames[ticker] = frame
+        return pd.concat(frames, axis=1)
@@ -0,0 +1,87 @@
+# TTM Squeeze Strategy
+# Bollinger Bands inside Keltner Channels, as discussed in Mastering the Trade by John F Carter.
+# Everything runs over the whole stored daily panel at once through the indicator engine, so re-running with other
+# parameters only computes what is not cached yet.
+import numpy as np
+import pandas as pd
+
+import indicators
+
+# Globals
+
+SHOW_OPTIONS = ['Squeeze On', 'Squeeze Fired', 'All']  # ttm page combo box
+
+
+def linreg_last(values: np.ndarray, length: int) -> np.ndarray:
+    """
+    Value at the last bar of a least squares line fitted over the last `length` bars, at every date
+    Windows holding an empty bar are NaN.
+    :param values: array shaped (tickers, dates)
+    :type values: np.ndarray
+    :param length: window length
+    :type length: int
+    :return: array shaped like values
+    :rtype: np.ndarray
+    """
+    values = np.asarray(values, dtype=float)
+    x = np.arange(values.shape[1], dtype=float)
+    y_sums, _, counts = indicators.cumulative_sums(values)
+    xy_sums = indicators.cumulative_sums(values * x)[0]
+    sum_y = indicators.window_sums(y_sums, length)
+    # x restarts at 0 in every window: sum(x_local * y) = sum(x * y) - first_x * sum(y)
+    first_x = np.maximum(x - (length - 1), 0)
+    sum_xy = indicators.window_sums(xy_sums, length) - first_x * sum_y
+    sum_x = length * (length - 1) / 2
+    sum_xx = (length - 1) * length * (2 * length - 1) / 6
+    slope = (length * sum_xy - sum_x * sum_y) / (length * sum_xx - sum_x ** 2)
+    intercept = (sum_y - slope * sum_x) / length
+    result = intercept + slope * (length - 1)
+    result[indicators.window_sums(counts, length) < length] = np.nan
+    return result
+
+
+def squeeze(engine: indicators.IndicatorEngine, length=20, bb_mult=2.0, kc_mult=1.5) -> dict:
+    """
+    TTM Squeeze series of every ticker in the engine's panel
+    :param engine: indicator engine of the daily panel
+    :type engine: indicators.IndicatorEngine
+    :param length: Bollinger Bands & Keltner Channel length
+    :type length: int
+    :param bb_mult: Bollinger Bands standard deviation multiplier
+    :type bb_mult: float
+    :param kc_mult: Keltner Channel ATR multiplier
+    :type kc_mult: float
+    :return: {'SQUEEZE_ON', 'SQUEEZE_OFF', 'MOMENTUM'} arrays shaped (tickers, dates)
+    :rtype: dict
+    """
+    close = np.asarray(engine.panel.adjusted('Close'), dtype=float)
+    mid = engine.sma(length)
+    bb_width = bb_mult * engine.std(length, ddof=0)
+    kc_width = kc_mult * engine.atr(length)
+    with np.errstate(invalid='ignore'):
+        squeeze_on = bb_width < kc_width  # Bollinger Bands inside the Keltner Channel
+        squeeze_off = bb_width > kc_width
+    # momentum histogram: close relative to the mean of the Donchian midline and the SMA, smoothed by linreg
+    donchian_mid = (engine.highest(length) + engine.lowest(length)) / 2
+    momentum = linreg_last(close - (donchian_mid + mid) / 2, length)
+    return {'SQUEEZE_ON': squeeze_on, 'SQUEEZE_OFF': squeeze_off, 'MOMENTUM': momentum}
+
+
+def squeeze_table(panel, rows, length=20, bb_mult=2.0, kc_mult=1.5) -> pd.DataFrame:
+    """
+    Squeeze state of the last date for some of the panel's tickers
+    :param panel: daily price panel
+    :type panel: data_store.PricePanel
+    :param rows: panel rows to report, see watchlists.Registry.rows
+    :type rows: np.ndarray
+    :return: Squeeze (on today), Fired (on yesterday, off today), Momentum and Rising columns indexed by ticker
+    :rtype: pd.DataFrame
+    """
+    result = squeeze(indicators.get_engine(panel), length, bb_mult, kc_mult)
+    tickers = [panel.symbols[row] for row in rows]
+    on, off, momentum = result['SQUEEZE_ON'][rows], result['SQUEEZE_OFF'][rows], result['MOMENTUM'][rows]
+    with np.errstate(invalid='ignore'):
+        rising = momentum[:, -1] > momentum[:, -2]
+    return pd.DataFrame({'Squeeze': on[:, -1], 'Fired': on[:, -2] & off[:, -1],
+                         'Momentum': momentum[:, -1], 'Rising': rising},
+                        index=pd.Index(tickers, name='Ticker'))
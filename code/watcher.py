@@ -0,0 +1,228 @@
+# Session watcher
+# Keeps the intraday bars of a universe current during the session: stale tickers are polled with a concurrency
+# limit behind a token bucket, failures back off per ticker and slow the whole watcher down, and fresh bars are
+# pushed into the history cache, the intraday store, the bar aggregator and every registered callback (e.g. a scan).
+# Poll periods, rates and backoffs are in market time: under a replay clock they run as fast as the replay, and the
+# latency from a bar's arrival to its signal (the callbacks done) is measured in real seconds.
+#   asyncio.run(Watcher(tickers).run())
+import asyncio
+import random
+import time
+
+import numpy as np
+import pandas as pd
+
+import bar_aggregator
+import history_cache
+import instrumentation
+import intraday_store
+import market_clock
+import providers
+
+# Globals
+
+POLL_EVERY = 60  # market seconds between polls of a ticker
+CONCURRENCY = 8  # fetches in flight
+RATE = 2.0  # fetches per market second
+BURST = 5  # fetches allowed at once after an idle period
+MIN_RATE = 0.1  # the rate never adapts below this
+MAX_BACKOFF = 15 * 60  # market seconds
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter for one event loop
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        """
+        :param rate: tokens added per second
+        :type rate: float
+        :param capacity: most tokens kept
+        :type capacity: float
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        """
+        Wait for a token and take it
+        """
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Watcher:
+    """
+    Polls stale tickers and pushes their fresh bars.
+    The bucket's rate adapts: it halves on every failure and recovers slowly on successes, a failing ticker also
+    waits an exponentially growing time before its next poll.
+    """
+
+    def __init__(self, tickers: list, interval='1m', poll_every=POLL_EVERY, concurrency=CONCURRENCY, rate=RATE,
+                 burst=BURST, provider=None, aggregator=None, cache=None, clock=None):
+        """
+        :param tickers: tickers to keep current
+        :type tickers: list
+        :param interval: intraday interval to poll, 1m bars are also pushed into the aggregator
+        :type interval: str
+        :param poll_every: market seconds between polls of a ticker
+        :type poll_every: float
+        :param concurrency: fetches in flight
+        :type concurrency: int
+        :param rate: fetches per market second
+        :type rate: float
+        :param burst: fetches allowed at once after an idle period
+        :type burst: int
+        :param provider: data provider, the current provider if None
+        :type provider: providers.MarketDataProvider
+        :param aggregator: aggregator to push 1m bars to, bar_aggregator.AGGREGATOR if None
+        :type aggregator: bar_aggregator.BarAggregator
+        :param cache: history cache to push histories to, history_cache.CACHE if None
+        :type cache: history_cache.HistoryCache
+        :param clock: market clock, the current clock if None
+        :type clock: market_clock.MarketClock
+        """
+        self.tickers = list(dict.fromkeys(tickers))
+        self.interval = interval
+        self.clock = clock or market_clock.get_clock()
+        self.poll_every = poll_every / self.clock.speed  # real seconds from here on
+        self.concurrency = concurrency
+        self.max_rate = rate * self.clock.speed
+        self.min_rate = MIN_RATE * self.clock.speed
+        self.max_backoff = MAX_BACKOFF / self.clock.speed
+        self.bucket = TokenBucket(self.max_rate, burst)
+        self.provider = provider
+        self.aggregator = aggregator or bar_aggregator.AGGREGATOR
+        self.cache = cache or history_cache.CACHE
+        self.callbacks = []  # function(updated tickers), called after every poll
+        self.next_due = {ticker: 0.0 for ticker in self.tickers}  # monotonic time of the next poll
+        self.failures = {ticker: 0 for ticker in self.tickers}  # consecutive failures
+        self.pushed = {}  # ticker -> time of the last bar pushed to the aggregator
+        self.arrived = {}  # ticker -> start of the newest bar already measured
+        self.latencies = []  # real seconds from a bar's arrival to its signal
+        self.running = False
+
+    def seed_previous_closes(self, panel, session=None):
+        """
+        Seed the aggregator's gap reference of every ticker with its last daily close before the session
+        :param panel: daily price panel
+        :type panel: data_store.PricePanel
+        :param session: session date, the clock's today if None
+        :type session: datetime or str
+        """
+        session = np.datetime64(pd.Timestamp(session or self.clock.today()).date(), 'D')
+        tickers, rows = panel.rows(self.tickers)
+        closes = panel.adjusted('Close', rows)[:, panel.dates < session]
+        for ticker, ticker_closes in zip(tickers, closes):
+            valid = ticker_closes[~np.isnan(ticker_closes)]
+            if len(valid):
+                self.aggregator.set_previous_close(ticker, float(valid[-1]))
+
+    def stale(self) -> list:
+        """
+        Tickers due for a poll
+        :rtype: list
+        """
+        now = time.monotonic()
+        return [ticker for ticker in self.tickers if self.next_due[ticker] <= now]
+
+    async def poll(self) -> list:
+        """
+        Poll every stale ticker once
+        :return: tickers that got fresh bars
+        :rtype: list
+        """
+        due = self.stale()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        with instrumentation.stage('watcher.poll'):
+            results = await asyncio.gather(*(self._refresh(ticker, semaphore) for ticker in due))
+        histories = {ticker: history for ticker, history in zip(due, results) if history is not None}
+        updated = list(histories)
+        if self.interval in intraday_store.INTERVALS:
+            with instrumentation.stage('watcher.store'):
+                intraday_store.append_many(histories, self.interval, complete=False)
+        for callback in self.callbacks:
+            callback(updated)
+        self._measure(histories)
+        return updated
+
+    async def run(self, rounds=None):
+        """
+        Poll until stopped
+        :param rounds: number of polls, until stop() if None
+        :type rounds: int
+        """
+        self.running = True
+        done = 0
+        while self.running and (rounds is None or done < rounds):
+            await self.poll()
+            done += 1
+            await asyncio.sleep(max(0.0, min(self.next_due.values(), default=0.0) - time.monotonic()))
+        self.running = False
+
+    def stop(self):
+        """
+        Stop run() after the current poll
+        """
+        self.running = False
+
+    async def _refresh(self, ticker: str, semaphore: asyncio.Semaphore):
+        async with semaphore:
+            await self.bucket.acquire()
+            provider = self.provider or providers.get_provider()
+            try:
+                history = await asyncio.get_running_loop().run_in_executor(None, provider.history, ticker, '1d',
+                                                                           self.interval)
+            except Exception as e:
+                print(f'{ticker}: {e}')
+                self._failed(ticker)
+                return None
+        self._succeeded(ticker)
+        self.cache.put(ticker, history, '1d', self.interval)
+        if self.interval == '1m':
+            self._push(ticker, history)
+        return history
+
+    def _failed(self, ticker: str):
+        instrumentation.count('watcher.failures', ticker=ticker)
+        self.failures[ticker] += 1
+        backoff = min(self.max_backoff, self.poll_every * 2 ** self.failures[ticker])
+        self.next_due[ticker] = time.monotonic() + backoff * random.uniform(0.8, 1.2)  # jitter spreads retries
+        self.bucket.rate = max(self.min_rate, self.bucket.rate / 2)
+
+    def _succeeded(self, ticker: str):
+        self.failures[ticker] = 0
+        self.next_due[ticker] = time.monotonic() + self.poll_every
+        self.bucket.rate = min(self.max_rate, self.bucket.rate + self.max_rate / 20)
+
+    def _push(self, ticker: str, history: pd.DataFrame):
+        # the last bar may still be forming, it is pushed on the next poll
+        bars = history.iloc[:-1]
+        last = self.pushed.get(ticker)
+        if last is not None:
+            bars = bars[bars.index > last]
+        for when, bar in zip(bars.index, bars[['Open', 'High', 'Low', 'Close', 'Volume']].to_numpy()):
+            self.aggregator.add_bar(ticker, when.to_pydatetime(), *bar)
+        if len(bars):
+            self.pushed[ticker] = bars.index[-1]
+
+    def _measure(self, histories: dict):
+        # a bar arrives when the bar after it starts (the newest bar may still be forming), the arrival of every
+        # newly seen bar is compared with the clock now that the callbacks are done
+        now = self.clock.now()
+        for ticker, history in histories.items():
+            if not len(history) or history.index[-1] == self.arrived.get(ticker):
+                continue
+            self.arrived[ticker] = history.index[-1]
+            latency = (now - market_clock.exchange_time(history.index[-1])).total_seconds() / self.clock.speed
+            self.latencies.append(latency)
+            instrumentation.record('watcher.bar_to_signal', latency, ticker)
@@ -0,0 +1,210 @@
+# Watchlist registry
+# Named watchlists parsed once from the ini file. Every symbol is interned into one integer index shared by all the
+# watchlists, so a symbol that is in several watchlists is downloaded and stored once. Symbol ids are mapped to the
+# store's rows once per stored panel, scanners index the panel's fields with the row arrays:
+#   ids, rows = registry.rows(panel, registry.ids(['tech', 'energy']))
+#   [Tickers] ticker_list  -> the 'default' watchlist
+#   [Watchlists] name = AAPL MSFT ...   or   name = @symbols.txt  (whitespace separated, relative to the ini file)
+import configparser
+import os
+import threading
+
+import numpy as np
+
+import config
+
+# Globals
+
+DEFAULT_WATCHLIST = 'default'
+
+_lock = threading.Lock()
+_REGISTRY = None
+_LOADED_FROM = None  # (ini path, modification time) the registry was parsed from
+
+
+class SymbolTable:
+    """
+    Interned symbols, each symbol gets a stable integer id in order of first appearance
+    """
+
+    def __init__(self):
+        self.symbols = []  # id -> symbol
+        self.index = {}  # symbol -> id
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __contains__(self, symbol):
+        return symbol in self.index
+
+    def intern(self, symbol: str) -> int:
+        """
+        Id of a symbol, added to the table if new
+        :param symbol: ticker symbol
+        :type symbol: str
+        :return: symbol id
+        :rtype: int
+        """
+        symbol_id = self.index.get(symbol)
+        if symbol_id is None:
+            symbol_id = self.index[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        return symbol_id
+
+    def ids(self, symbols: list) -> np.ndarray:
+        """
+        Ids of several symbols, interning new ones
+        :rtype: np.ndarray
+        """
+        return np.fromiter((self.intern(symbol) for symbol in symbols), dtype=np.int32, count=len(symbols))
+
+
+class Registry:
+    """
+    Named watchlists over one symbol table
+    """
+
+    def __init__(self, watchlists=None):
+        """
+        :param watchlists: {name: [symbols]}
+        :type watchlists: dict
+        """
+        self.table = SymbolTable()
+        self.watchlists = {}  # name -> symbol ids, first appearance order, no duplicates
+        self._row_map = None  # (panel version, table size, panel row of every symbol id or -1)
+        for name, symbols in (watchlists or {}).items():
+            self.add(name, symbols)
+
+    def add(self, name: str, symbols: list):
+        """
+        Add or replace a watchlist
+        :param name: watchlist name
+        :type name: str
+        :param symbols: ticker symbols
+        :type symbols: list
+        """
+        self.watchlists[name] = _unique(self.table.ids(symbols))
+
+    def names(self) -> list:
+        return list(self.watchlists)
+
+    def ids(self, names=None) -> np.ndarray:
+        """
+        Symbol ids of the union of watchlists, a symbol shared by several watchlists appears once
+        :param names: watchlist name or names, the default watchlist if None
+        :type names: str or list
+        :return: symbol ids
+        :rtype: np.ndarray
+        """
+        if names is None:
+            names = [DEFAULT_WATCHLIST]
+        elif isinstance(names, str):
+            names = [names]
+        unknown = [name for name in names if name not in self.watchlists]
+        if unknown:
+            raise KeyError(f"unknown watchlist(s) {', '.join(unknown)}, known: {', '.join(self.watchlists)}")
+        return _unique(np.concatenate([self.watchlists[name] for name in names]))
+
+    def tickers(self, names=None) -> list:
+        """
+        Symbols of the union of watchlists, see ids
+        :rtype: list
+        """
+        return self.symbols(self.ids(names))
+
+    def symbols(self, ids) -> list:
+        """
+        Symbols of symbol ids
+        :rtype: list
+        """
+        return [self.table.symbols[symbol_id] for symbol_id in ids]
+
+    def symbol_ids(self, symbols: list) -> np.ndarray:
+        """
+        Ids of symbols outside the watchlists, e.g. from the command line, interning new ones
+        :param symbols: ticker symbols
+        :type symbols: list
+        :return: symbol ids, duplicates removed
+        :rtype: np.ndarray
+        """
+        return _unique(self.table.ids(symbols))
+
+    def rows(self, panel, ids) -> tuple:
+        """
+        Panel rows of symbol ids. The id to row map is built once per saved panel, so a scan resolves its universe
+        with one array lookup instead of a symbol lookup per ticker.
+        :param panel: price panel
+        :type panel: data_store.PricePanel
+        :param ids: symbol ids, see ids and symbol_ids
+        :type ids: np.ndarray
+        :return: (symbol ids in the panel, their rows)
+        :rtype: tuple
+        """
+        row_map = self._row_map
+        if row_map is None or row_map[0] is None or row_map[:2] != (panel.version, len(self.table)):
+            row_map = (panel.version, len(self.table),
+                       np.fromiter((panel.symbol_index.get(symbol, -1) for symbol in self.table.symbols),
+                                   dtype=np.intp, count=len(self.table)))
+            self._row_map = row_map
+        ids = np.asarray(ids, dtype=np.intp)
+        rows = row_map[2][ids]
+        found = rows >= 0
+        return ids[found], rows[found]
+
+
+def _unique(ids: np.ndarray) -> np.ndarray:
+    # deduplicate keeping first appearance order
+    _, first = np.unique(ids, return_index=True)
+    return ids[np.sort(first)]
+
+
+def parse_symbols(value: str, base_dir='') -> list:
+    """
+    Symbols of a watchlist entry, either whitespace separated symbols or @path of a symbols file
+    :param value: ini value
+    :type value: str
+    :param base_dir: directory relative paths are resolved from
+    :type base_dir: str
+    :return: upper case symbols
+    :rtype: list
+    """
+    value = value.strip()
+    if value.startswith('@'):
+        with open(os.path.join(base_dir, value[1:].strip())) as f:
+            value = f.read()
+    return [symbol.upper() for symbol in value.split()]
+
+
+def load_registry(path=None) -> Registry:
+    """
+    Parse the watchlists of an ini file
+    :param path: ini path, config.FILE_PATHS['INI'] if None
+    :type path: str
+    :return: registry with the default watchlist and every [Watchlists] entry
+    :rtype: Registry
+    """
+    path = path or config.FILE_PATHS['INI']
+    parser = configparser.ConfigParser()
+    parser.read(path)
+    base_dir = os.path.dirname(path)
+    registry = Registry()
+    registry.add(DEFAULT_WATCHLIST, parse_symbols(parser[config.INI_SECTIONS['TICKERS']]['ticker_list'], base_dir))
+    if parser.has_section(config.INI_SECTIONS['WATCHLISTS']):
+        for name, value in parser[config.INI_SECTIONS['WATCHLISTS']].items():
+            registry.add(name, parse_symbols(value, base_dir))
+    return registry
+
+
+def get_registry() -> Registry:
+    """
+    The shared registry, the ini file is parsed again only after it changed
+    :rtype: Registry
+    """
+    global _REGISTRY, _LOADED_FROM
+    path = config.FILE_PATHS['INI']
+    loaded_from = (path, os.path.getmtime(path))
+    with _lock:
+        if _REGISTRY is None or _LOADED_FROM != loaded_from:
+            _REGISTRY = load_registry(path)
+            _LOADED_FROM = loaded_from
+        return _REGISTRY
@@ -0,0 +1,83 @@
+# Background workers for the Qt GUI
+import traceback
+
+from PyQt5 import QtCore
+
+import instrumentation
+
+
+class WorkerSignals(QtCore.QObject):
+    """
+    Signals of a ScanWorker, emitted from the worker thread and delivered on the GUI thread
+    """
+    started = QtCore.pyqtSignal()
+    progress = QtCore.pyqtSignal(int)
+    result = QtCore.pyqtSignal(str)
+    done = QtCore.pyqtSignal(object)  # the scan's return value
+    error = QtCore.pyqtSignal(str)
+    cancelled = QtCore.pyqtSignal()
+    finished = QtCore.pyqtSignal()  # always emitted last once the worker ran
+
+
+class ScanWorker(QtCore.QRunnable):
+    """
+    Runs a scan generator (see scans.py) on a QThreadPool and streams its progress and results through signals.
+    Cancellation is checked between the scan's steps.
+    """
+
+    def __init__(self, scan, *args, **kwargs):
+        """
+        :param scan: generator function yielding (progress %, result line or None)
+        :type scan: function
+        :param args: scan arguments
+        :param kwargs: scan keyword arguments
+        """
+        super(ScanWorker, self).__init__()
+        self.scan = scan
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = WorkerSignals()
+        self.is_cancelled = False
+
+    def cancel(self):
+        """
+        Ask the worker to stop after the current step
+        """
+        self.is_cancelled = True
+
+    @QtCore.pyqtSlot()
+    def run(self):
+        """
+        Worker thread entry point
+        """
+        try:
+            if self.is_cancelled:  # cancelled while queued
+                self.signals.cancelled.emit()
+                return
+            self.signals.started.emit()
+            name = self.scan.__name__
+            with instrumentation.profile(name), instrumentation.stage('scan.' + name):
+                self._run_scan()
+        except Exception as e:
+            print(e)
+            traceback.print_exc()
+            self.signals.error.emit(str(e))
+        finally:
+            self.signals.finished.emit()
+
+    def _run_scan(self):
+        scan = self.scan(*self.args, **self.kwargs)
+        while True:
+            try:
+                progress, line = next(scan)
+            except StopIteration as stop:
+                self.signals.done.emit(stop.value)
+                break
+            self.signals.progress.emit(progress)
+            if line is not None:
+                instrumentation.count('scan.results')
+                self.signals.result.emit(line)
+            if self.is_cancelled:
+                scan.close()
+                self.signals.cancelled.emit()
+                break
@@ -1,25 +1,27 @@
 # Raw packages
-import configparser
+from __future__ import annotations  # annotations name yf.Ticker, keep them from importing yfinance
+
 import numpy as np
 # Other imports
 import os
 import pandas as pd
 # Data Source
 import pandas.core.frame
-# Data visualization
-import plotly.graph_objs as go
-import time
 import urllib.request
-import yfinance as yf
-from datetime import datetime
-
-import config as cfg
-
-# Global Variables
 
-SYSTEM_TIME = datetime.now().strftime("%H:%M").split(':')
-SYSTEM_TIME = [int(i) for i in SYSTEM_TIME]
+import bar_aggregator
+import data_store
+import history_cache
+import indicators
+import instrumentation
+import intraday_store
+import lazy_modules
+import market_clock
+import providers
+import watchlists
 
+go = lazy_modules.lazy_import('plotly.graph_objs')  # heavy, loaded on the first graph
+yf = lazy_modules.lazy_import('yfinance')  # loaded on the first network read
 
 # Helper functions
 
@@ -49,6 +51,18 @@ def decimal2_float(i: float) -> float:
     return float("{:.2f}".format(i))
 
 
+def decimal2_array(a: np.ndarray) -> np.ndarray:
+    """
+    decimal2_float over a whole array, rounded exactly the same way
+    :param a: floats
+    :type a: np.ndarray
+    :return: floats of only 2 decimal length
+    :rtype: np.ndarray
+    """
+    a = np.asarray(a, dtype=float)
+    return np.array(list(map("{:.2f}".format, a.ravel())), dtype=float).reshape(a.shape)
+
+
 def download_ticker(ticker, dates, interval):
     """
     downloads a ticker as pandas
@@ -61,7 +75,7 @@ def download_ticker(ticker, dates, interval):
     :return:
     :rtype:
     """
-    return yf.download(tickers=ticker, period=dates, interval=interval)
+    return providers.get_provider().download([ticker], period=dates, interval=interval)[ticker]
 
 
 def show_graph(pandas_ticker):
@@ -90,6 +104,7 @@ def show_graph(pandas_ticker):
     fig.show()
 
 
+@instrumentation.timed('yf.get_current_yf_price')
 def get_current_yf_price(ticker: yf.Ticker or pandas.core.frame.DataFrame or str) -> float:
     """
     Returns the current ticker price
@@ -101,7 +116,7 @@ def get_current_yf_price(ticker: yf.Ticker or pandas.core.frame.DataFrame or str
     if type(ticker) is str:
         ticker = yf.Ticker(ticker)
     if type(ticker) is yf.Ticker:
-        todays_data = ticker.history(period='1d')
+        todays_data = history_cache.get_history(ticker.ticker, period='1d')
         return decimal2_float(todays_data['Close'][0])
     if type(ticker) is pandas.core.frame.DataFrame:
         return decimal2_float(ticker['Close'][len(ticker) - 1])  # try [-1:]
@@ -109,29 +124,23 @@ def get_current_yf_price(ticker: yf.Ticker or pandas.core.frame.DataFrame or str
 
 def trading_day_started() -> bool:
     """
-    Checks if trading day has started according to Summer IL clock
+    Checks if today's session has started according to the market clock (exchange time, holidays included)
     :return: true if session has started, else false
     :rtype: bool
     """
-    if SYSTEM_TIME[0] > 16:
-        return True
-    elif SYSTEM_TIME[0] >= 16 and SYSTEM_TIME[1] >= 30:
-        return True
-    else:
-        return False
+    return market_clock.get_clock().session_started()
 
 
 def load_tickers_from_ini() -> list:
     """
-    Load a list of tickers from ini file location config.FILE_PATH['INI']
-    :return: List of tickers
+    Load a list of tickers from ini file location config.FILE_PATH['INI'], the ini file is parsed once
+    :return: List of tickers of the default watchlist
     :rtype: list
     """
-    config = configparser.ConfigParser()
-    config.read(cfg.FILE_PATHS['INI'])
-    return config['Tickers']['ticker_list'].split(' ')
+    return watchlists.get_registry().tickers()
 
 
+@instrumentation.timed('yf.get_gap')
 def get_gap(ticker: str or yf.Ticker or pandas.core.frame.DataFrame) -> float:
     """
     Function that can get either str or yfinance object and calculate gap.
@@ -145,7 +154,15 @@ def get_gap(ticker: str or yf.Ticker or pandas.core.frame.DataFrame) -> float:
         ticker = yf.Ticker(ticker)
 
     if type(ticker) is yf.Ticker:
-        history = ticker.history(period='2d')
+        gap = bar_aggregator.AGGREGATOR.gap(ticker.ticker)  # streamed session open, if the ticker is watched
+        if gap is not None:
+            return decimal2_float(gap)
+        session = intraday_store.session_day()
+        opening = intraday_store.session_open(ticker.ticker, session)  # stored session open and previous close
+        previous_close = data_store.previous_close(ticker.ticker, session) if opening is not None else None
+        if previous_close is not None:
+            return decimal2_float(opening - previous_close)
+        history = history_cache.get_history(ticker.ticker, period='2d')
         return decimal2_float(history['Open'][1] - history['Close'][0])  # try [-2] - # try [-1]?
 
     if type(ticker) is pandas.core.frame.DataFrame:
@@ -153,6 +170,7 @@ def get_gap(ticker: str or yf.Ticker or pandas.core.frame.DataFrame) -> float:
         return decimal2_float(df['Open'][-1] - df['Close'][-2])
 
 
+@instrumentation.timed('yf.get_SMA')
 def get_SMA(ticker: yf.Ticker or pandas.core.frame.DataFrame, sma: int) -> float:
     """
     Calculate SMA
@@ -164,7 +182,7 @@ def get_SMA(ticker: yf.Ticker or pandas.core.frame.DataFrame, sma: int) -> float
     :rtype: float
     """
     if type(ticker) is yf.Ticker:
-        history = ticker.history(period='' + str(sma) + 'd')
+        history = history_cache.get_history(ticker.ticker, period='' + str(sma) + 'd')
         return decimal2_float(history['Close'].mean())
     if type(ticker) is pandas.core.frame.DataFrame:
         df = ticker.reset_index()
@@ -172,6 +190,7 @@ def get_SMA(ticker: yf.Ticker or pandas.core.frame.DataFrame, sma: int) -> float
         return decimal2_float(df['Close'].mean())
 
 
+@instrumentation.timed('yf.get_1st_candle')
 def get_1st_candle(ticker: yf.Ticker or pandas.core.frame.DataFrame or str, interval='2m') -> float:
     """
     Get 1st candle of the day according to interval, if dataframe is given, ignore interval and use the dataframe's
@@ -185,13 +204,22 @@ def get_1st_candle(ticker: yf.Ticker or pandas.core.frame.DataFrame or str, inte
     if type(ticker) is str:
         ticker = yf.Ticker(ticker)
     if type(ticker) is yf.Ticker:
-        history = ticker.history(period='1d', interval=interval)
+        if interval.endswith('m'):  # streamed first candle, if the ticker is watched
+            candle = bar_aggregator.AGGREGATOR.first_candle(ticker.ticker, int(interval[:-1]))
+            if candle is not None:
+                return decimal2_float(candle)
+        if interval in intraday_store.INTERVALS:  # stored first candle, fetched and stored if missing
+            candle = intraday_store.first_candle(ticker.ticker, interval)
+            if candle is not None:
+                return decimal2_float(candle)
+        history = history_cache.get_history(ticker.ticker, period='1d', interval=interval)
         return decimal2_float(history['Close'][0] - history['Open'][0])
     if type(ticker) is pandas.core.frame.DataFrame:
         ticker = ticker.reset_index()
         return ticker['Close'][0] - ticker['Open'][0]  #
 
 
+@instrumentation.timed('yf.get_last_day_percentage')
 def get_last_day_percentage(ticker: yf.Ticker or pandas.core.frame.DataFrame) -> float:
     """
     Get the last day of trading's percentage change
@@ -203,10 +231,10 @@ def get_last_day_percentage(ticker: yf.Ticker or pandas.core.frame.DataFrame) ->
     # There are two cases: -% and +%
     # need to check if we're during the day or no (up period to 3d and calculate [1] & [2]
     # validate!!!
-    period = 3 if SYSTEM_TIME[0] > 16 and SYSTEM_TIME[1] >= 30 else 2
-    # ^^ basically, if current time is >16:30 take period of 3d thus getting yesterday's daily change and not today's
+    period = 3 if trading_day_started() else 2
+    # ^^ basically, once today's session started take period of 3d thus getting yesterday's daily change and not today's
     if type(ticker) is yf.Ticker:
-        history = ticker.history(period=str(period) + 'd')
+        history = history_cache.get_history(ticker.ticker, period=str(period) + 'd')
         if history['Close'][1] >= history['Close'][0]:
             return decimal2_float(((history['Close'][1] / history['Close'][0]) - 1) * 100)
         else:
@@ -277,6 +305,7 @@ def risk_dict(risk: float, risk_candle: float, current_stock_price: float) -> di
     return dict_return
 
 
+@instrumentation.timed('yf.risk_analysis')
 def risk_analysis(ticker: yf.Ticker or str, risk: float or int) -> dict:
     """
     risk analysis without user input
@@ -362,6 +391,7 @@ def dumb_risk_analysis_tostring(risk_dict: dict, colored=False) -> str:
 
 # Consolidation Pattern Strategy:
 
+@instrumentation.timed('yf.is_consolidating')
 def is_consolidating(df: pandas.core.frame.DataFrame, percentage=2.5, look_back_data=15) -> bool:
     """
     Checks if a ticker is in a consolidation state relative to the given percentage parameter
@@ -384,6 +414,7 @@ def is_consolidating(df: pandas.core.frame.DataFrame, percentage=2.5, look_back_
     return False
 
 
+@instrumentation.timed('yf.is_breaking_consolidation')
 def is_breaking_consolidation(df: pandas.core.frame.DataFrame, percentage=2.5, look_back_data=15) -> bool:
     """
     Checks if a ticker is breaking out from consolidation state relative to the given percentage parameter
@@ -407,6 +438,40 @@ def is_breaking_consolidation(df: pandas.core.frame.DataFrame, percentage=2.5, l
     return False
 
 
+@instrumentation.timed('yf.scan_consolidation')
+def scan_consolidation(closes: np.ndarray, percentage=2.5, look_back_data=15) -> tuple:
+    """
+    Vectorized is_consolidating & is_breaking_consolidation over a whole universe in one pass
+    Rows are tickers, columns are dates (oldest first), empty bars are NaN and skipped like pandas does.
+    :param closes: close prices shaped (tickers, dates)
+    :type closes: np.ndarray
+    :param percentage: percentage consolidation pattern default is 2.5
+    :type percentage: float
+    :param look_back_data: how many days to look back on (+1) default is 15 (14 days)
+    :type look_back_data: int
+    :return: (consolidating, breaking) boolean vectors, one value per ticker
+    :rtype: tuple
+    """
+    closes = np.asarray(closes, dtype=float)
+    threshold = 1 - (percentage / 100)
+
+    def reduce(ufunc, window):
+        # fmax/fmin ignore NaN, an all NaN or empty window is NaN and compares False like the pandas version
+        if window.shape[1] == 0:
+            return np.full(len(window), np.nan)
+        return ufunc.reduce(window, axis=1)
+
+    def consolidating(window):
+        return reduce(np.fmin, window) > (reduce(np.fmax, window) * threshold)
+
+    is_consolidating_now = consolidating(closes[:, -look_back_data:])
+    was_consolidating = consolidating(closes[:, :-1][:, -look_back_data:])  # all the data but the last day
+    last_close = closes[:, -1]
+    recent_max = reduce(np.fmax, closes[:, -look_back_data:-1])
+    is_breaking = was_consolidating & (last_close > recent_max)
+    return is_consolidating_now, is_breaking
+
+
 if __name__ == "__main__":
     if check_connection():
         print("~~~~Connection is good!~~~~")
@@ -415,7 +480,7 @@ if __name__ == "__main__":
     ticker = input("Insert Ticker: ")
     # Downloading and showing a ticker on a graph
     risk = input("Insert wanted risk: ")
-    ticker_data_5m = download_ticker(ticker, '1d', '5m')
+    ticker_data_5m = intraday_store.session_bars(ticker, '5m')  # stored bars first
     ticker_data_1d = download_ticker(ticker, '365d', '1d')
     print("----------------------")
     ticker = yf.Ticker(ticker)
@@ -423,10 +488,10 @@ if __name__ == "__main__":
     if not trading_day_started():
         print("\033[93mRisk candle is based on GAP since data on the first candle of the day is unavailable.\033[0m")
     print(dumb_risk_analysis_tostring(risk_answer))
-    sma = [20, 50, 100, 200]
-    for i in sma:
-        time.sleep(0.5)
-        print(f'SMA {str(i)}: {get_SMA(ticker_data_1d, i)}')
+    smas = indicators.get_engine(data_store.panel_from_download(ticker_data_1d, [ticker.ticker])).last_smas(
+        [20, 50, 100, 200])
+    for i, sma in smas.items():
+        print(f'SMA {str(i)}: {decimal2_float(sma[0])}')
     print(f'Last day of trading change: {get_last_day_percentage(ticker)}%')
     print("----------------------")
     # user_graph = input("Press Y to show graph")